@@ -0,0 +1,58 @@
+"""add last message summary and unread counters to chats
+
+Revision ID: a3c4d5e6f7b8
+Revises: f2b3c4d5e6a7
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c4d5e6f7b8'
+down_revision = 'f2b3c4d5e6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Денормализованная сводка: список чатов строится без запросов по каждому чату
+    op.add_column('chats', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_preview', sa.String(length=255), nullable=True))
+    op.add_column('chats', sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('chats', sa.Column('user1_unread_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('chats', sa.Column('user2_unread_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Заполняем сводку для существующих чатов
+    op.execute("""
+        UPDATE chats SET
+            last_message_id = (SELECT MAX(m.id) FROM chat_messages m WHERE m.chat_id = chats.id),
+            user1_unread_count = (
+                SELECT COUNT(*) FROM chat_messages m
+                WHERE m.chat_id = chats.id AND m.sender_id <> chats.user1_id AND m.is_read = 0
+            ),
+            user2_unread_count = (
+                SELECT COUNT(*) FROM chat_messages m
+                WHERE m.chat_id = chats.id AND m.sender_id <> chats.user2_id AND m.is_read = 0
+            )
+    """)
+    op.execute("""
+        UPDATE chats SET
+            last_message_preview = (SELECT SUBSTRING(m.content, 1, 255) FROM chat_messages m WHERE m.id = chats.last_message_id),
+            last_message_at = (SELECT m.created_at FROM chat_messages m WHERE m.id = chats.last_message_id)
+        WHERE last_message_id IS NOT NULL
+    """)
+
+    op.create_index('ix_chats_user1_id_last_message_at', 'chats', ['user1_id', 'last_message_at'], unique=False)
+    op.create_index('ix_chats_user2_id_last_message_at', 'chats', ['user2_id', 'last_message_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_chats_user2_id_last_message_at', table_name='chats')
+    op.drop_index('ix_chats_user1_id_last_message_at', table_name='chats')
+    op.drop_column('chats', 'user2_unread_count')
+    op.drop_column('chats', 'user1_unread_count')
+    op.drop_column('chats', 'last_message_at')
+    op.drop_column('chats', 'last_message_preview')
+    op.drop_column('chats', 'last_message_id')
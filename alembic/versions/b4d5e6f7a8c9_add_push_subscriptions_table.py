@@ -0,0 +1,41 @@
+"""add push_subscriptions table
+
+Revision ID: b4d5e6f7a8c9
+Revises: a3c4d5e6f7b8
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d5e6f7a8c9'
+down_revision = 'a3c4d5e6f7b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Подписки Web Push, раньше хранились в памяти процесса
+    op.create_table(
+        'push_subscriptions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('endpoint', sa.String(length=500), nullable=False),
+        sa.Column('subscription', sa.Text(), nullable=False),
+        sa.Column('user_agent', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('endpoint')
+    )
+    op.create_index(op.f('ix_push_subscriptions_id'), 'push_subscriptions', ['id'], unique=False)
+    op.create_index(op.f('ix_push_subscriptions_user_id'), 'push_subscriptions', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_push_subscriptions_user_id'), table_name='push_subscriptions')
+    op.drop_index(op.f('ix_push_subscriptions_id'), table_name='push_subscriptions')
+    op.drop_table('push_subscriptions')
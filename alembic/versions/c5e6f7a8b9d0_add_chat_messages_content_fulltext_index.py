@@ -0,0 +1,31 @@
+"""add fulltext index on chat_messages.content
+
+Revision ID: c5e6f7a8b9d0
+Revises: b4d5e6f7a8c9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e6f7a8b9d0'
+down_revision = 'b4d5e6f7a8c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Поиск по сообщениям: WHERE chat_id IN (...) AND MATCH (content) AGAINST (? IN BOOLEAN MODE)
+    op.create_index(
+        'ix_chat_messages_content_fulltext',
+        'chat_messages',
+        ['content'],
+        unique=False,
+        mysql_prefix='FULLTEXT'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_chat_messages_content_fulltext', table_name='chat_messages')
@@ -0,0 +1,25 @@
+"""add placeholder to property_images
+
+Revision ID: e1a2b3c4d5f6
+Revises: 449e5825a758
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a2b3c4d5f6'
+down_revision = '449e5825a758'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # LQIP-заглушка (data URI ~20px), показывается в карточках до загрузки фото
+    op.add_column('property_images', sa.Column('placeholder', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('property_images', 'placeholder')
@@ -0,0 +1,25 @@
+"""add composite index on chat_messages (chat_id, id)
+
+Revision ID: f2b3c4d5e6a7
+Revises: e1a2b3c4d5f6
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b3c4d5e6a7'
+down_revision = 'e1a2b3c4d5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Постраничная загрузка истории: WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+    op.create_index('ix_chat_messages_chat_id_id', 'chat_messages', ['chat_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_chat_messages_chat_id_id', table_name='chat_messages')
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from api.v1.endpoints import auth, contacts, weather, currency, chat, properties, favorites, upload, health, panorama_upload, media, telegram_auth, categories
+from api.v1.endpoints import auth, contacts, weather, currency, chat, properties, favorites, upload, health, panorama_upload, media, telegram_auth, categories, push
 
 api_router = APIRouter()
 
@@ -15,4 +15,5 @@ api_router.include_router(health.router, prefix="/health", tags=["health"])
 api_router.include_router(panorama_upload.router, prefix="/panorama_upload", tags=["panorama_upload"])
 api_router.include_router(media.router, prefix="/media", tags=["media"])
 api_router.include_router(telegram_auth.router, prefix="/telegram", tags=["telegram_auth"])
-api_router.include_router(categories.router, prefix="/categories", tags=["categories"])
\ No newline at end of file
+api_router.include_router(categories.router, prefix="/categories", tags=["categories"])
+api_router.include_router(push.router, prefix="/push", tags=["push"])
\ No newline at end of file
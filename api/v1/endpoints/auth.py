@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Form, Request
 from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy import or_
 from app.api import deps
 from app import models
-from app.utils.security import get_password_hash, verify_password
+from app.utils.password_hasher import password_hasher, PasswordHasherBusy
+from app.utils.rate_limit import Cooldown, RateLimit, rate_limit
 from app.utils.auth import create_access_token
 from datetime import timedelta, datetime
 from typing import Optional
@@ -15,12 +17,33 @@ from config import settings
 import re
 import random
 import string
-import json
-import os
 from app.services.devino_sms_service import DevinoSMSService
 
 router = APIRouter()
 
+# Лимиты попыток: по телефону/email из формы и по IP клиента
+SEND_CODE_LIMITS = (
+    Cooldown("send_code_cooldown", settings.SMS_RESEND_COOLDOWN_SECONDS, key="phone", field="contact"),
+    RateLimit("send_code_phone", 5, 3600, key="phone", field="contact"),
+    RateLimit("send_code_ip", 20, 3600, key="ip"),
+)
+VERIFY_CODE_LIMITS = (
+    RateLimit("verify_code_phone", 10, 900, key="phone", field="contact"),
+    RateLimit("verify_code_ip", 60, 900, key="ip"),
+)
+LOGIN_LIMITS = (
+    RateLimit("login_contact", 10, 900, key="phone", field="contact"),
+    RateLimit("login_ip", 50, 900, key="ip"),
+)
+
+def password_hasher_busy_response(e: PasswordHasherBusy) -> JSONResponse:
+    """Ответ при наплыве входов: клиент может повторить запрос через Retry-After"""
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "error": "Слишком много запросов, повторите через несколько секунд"},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 # Проверка формата телефона (любая страна)
 def is_valid_phone(phone: str) -> bool:
     # Очищаем телефон от пробелов и других символов
@@ -92,66 +115,8 @@ def get_user_by_contact(db: Session, contact: str, contact_type: str):
             
         return user
 
-# Файл для хранения кодов (тот же что использует бот)
-CODES_FILE = "verification_codes.json"
-
-def load_verification_codes():
-    """Загрузка кодов из файла"""
-    try:
-        if os.path.exists(CODES_FILE):
-            with open(CODES_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Конвертируем строки обратно в datetime
-                for phone, code_data in data.items():
-                    code_data['timestamp'] = datetime.fromisoformat(code_data['timestamp'])
-                return data
-    except Exception as e:
-        print(f"Ошибка загрузки кодов: {e}")
-    return {}
-
-def save_verification_codes(codes):
-    """Сохранение кодов в файл"""
-    try:
-        # Конвертируем datetime в строки для JSON
-        data = {}
-        for phone, code_data in codes.items():
-            data[phone] = {
-                'code': code_data['code'],
-                'timestamp': code_data['timestamp'].isoformat(),
-                'user_id': code_data.get('user_id')
-            }
-        
-        with open(CODES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Ошибка сохранения кодов: {e}")
-
-def verify_code_from_file(phone: str, code: str) -> bool:
-    """Проверка кода из файла"""
-    codes = load_verification_codes()
-    
-    if phone not in codes:
-        return False
-    
-    stored_data = codes[phone]
-    
-    # Проверяем, не истек ли код (5 минут)
-    if datetime.now() - stored_data['timestamp'] > timedelta(minutes=5):
-        # Удаляем истекший код
-        del codes[phone]
-        save_verification_codes(codes)
-        return False
-    
-    # Проверяем код
-    if stored_data['code'] == code:
-        # Удаляем код после успешной проверки
-        del codes[phone]
-        save_verification_codes(codes)
-        return True
-    
-    return False
-
 @router.post("/login")
+@rate_limit(*LOGIN_LIMITS)
 async def login(
     contact: str = Form(...),
     password: str = Form(...),
@@ -176,7 +141,13 @@ async def login(
     if not user:
         return {"success": False, "error": f"Пользователь с таким {contact_type} не найден"}
     
-    if not verify_password(password, user.hashed_password):
+    # bcrypt выполняется в отдельном пуле потоков, устаревший хеш пересчитывается
+    try:
+        password_valid = await password_hasher.verify_user(db, user, password)
+    except PasswordHasherBusy as e:
+        return password_hasher_busy_response(e)
+    
+    if not password_valid:
         return {"success": False, "error": "Неверный пароль"}
     
     if not user.is_active:
@@ -219,6 +190,7 @@ async def check_exists(
     return {"exists": exists}
 
 @router.post("/send-code")
+@rate_limit(*SEND_CODE_LIMITS, refund_failed=True)
 async def send_code(
     request: Request,
     contact: str = Form(...),
@@ -300,6 +272,7 @@ async def send_code(
         )
 
 @router.post("/verify-code")
+@rate_limit(*VERIFY_CODE_LIMITS)
 async def verify_code(
     code: str = Form(...),
     contact: str = Form(...),
@@ -352,7 +325,7 @@ async def verify_code(
                 print("🤖 Проверка через Telegram Bot")
                 from telegram_bot import sms_bot
                 
-                if sms_bot.verify_code(normalized_phone, code):
+                if await run_in_threadpool(sms_bot.verify_code, normalized_phone, code):
                     return {"verified": True}
                 else:
                     return {"verified": False, "error": "Неверный код"}
@@ -394,10 +367,15 @@ async def register(
     if user_exists(db, contact, contact_type):
         return {"success": False, "error": f"Пользователь с таким {contact_type} уже существует"}
     
+    try:
+        hashed_password = await password_hasher.hash(password)
+    except PasswordHasherBusy as e:
+        return password_hasher_busy_response(e)
+    
     # Создаем нового пользователя
     user = models.User(
         full_name=f"{first_name} {last_name}",
-        hashed_password=get_password_hash(password),
+        hashed_password=hashed_password,
         is_active=True,
         status=models.UserStatus.ACTIVE
     )
@@ -446,7 +424,10 @@ async def reset_password(
         return {"success": False, "error": f"Пользователь с таким {contact_type} не найден"}
     
     # Обновляем пароль
-    user.hashed_password = get_password_hash(password)
+    try:
+        user.hashed_password = await password_hasher.hash(password)
+    except PasswordHasherBusy as e:
+        return password_hasher_busy_response(e)
     db.commit()
     
     return {"success": True} 
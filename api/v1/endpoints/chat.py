@@ -1,100 +1,79 @@
-from typing import Any, List, Dict
-from jose import jwt
+from typing import Any, List, Dict, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_
 from datetime import datetime
 
-from fastapi import APIRouter, Request, Depends, Body, HTTPException
+from fastapi import APIRouter, Request, Response, Depends, Body, HTTPException, Query
 from fastapi.security import OAuth2PasswordBearer
 
 from app.models.chat_message import ChatMessage
 from app.models.chat import AppChatModel
 from app.models.user import User
-from app.utils.security import ALGORITHM
+from app.api import deps
+from app.utils.chat_search import get_search_terms, build_boolean_query, escape_like, highlight
+from app.websockets.chat_manager import manager as chat_manager
+from app.utils.db_replicas import use_primary
 from database import SessionLocal
 from config import settings
 
 router = APIRouter()
 
-# Получение сессии БД
+# Размер страницы истории чата
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_SIZE_MAX = 200
+
+# Размер страницы результатов поиска по сообщениям
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE_MAX = 100
+
+# Получение сессии БД. Чаты читаются только из основной БД: сообщения пишутся
+# через WebSocket, который не ставит cookie read-your-writes, и история сразу
+# после отправки могла бы прийти с реплики без нового сообщения
 def get_db():
     db = SessionLocal()
+    use_primary(db)
     try:
         yield db
     finally:
         db.close()
 
-# Получение текущего пользователя из токена
-def get_current_user_from_token(token: str, db: Session) -> User:
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload.get("sub"))
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return None
-        return user
-    except Exception as e:
-        return None
-
 
 @router.get("/")
 def get_chats(request: Request, db: Session = Depends(get_db)) -> Any:
     """
     Получить список чатов пользователя из БД.
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "token" in cookies:
-        token = cookies["token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    # Проверяем токен и получаем пользователя
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Не авторизован")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = deps.get_current_user_optional(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
-    # Получаем чаты пользователя из БД
+    # Получаем чаты пользователя вместе со сводкой (последнее сообщение, счетчики)
     chats = db.query(AppChatModel).filter(
         or_(
             AppChatModel.user1_id == current_user.id,
             AppChatModel.user2_id == current_user.id
         )
-    ).all()
+    ).order_by(AppChatModel.last_message_at.desc()).all()
     
     # Если чатов нет, возвращаем пустой список
     if not chats:
         return []
     
+    # Собеседников загружаем одним запросом
+    other_user_ids = {chat.get_other_user_id(current_user.id) for chat in chats}
+    users = {
+        user.id: user
+        for user in db.query(User).filter(User.id.in_(other_user_ids)).all()
+    }
+    
     # Формируем результат
     result = []
     for chat in chats:
-        # Определяем собеседника
-        other_user_id = chat.user2_id if chat.user1_id == current_user.id else chat.user1_id
-        other_user = db.query(User).filter(User.id == other_user_id).first()
-        
-        # Получаем последнее сообщение
-        last_message = db.query(ChatMessage).filter(
-            ChatMessage.chat_id == chat.id
-        ).order_by(ChatMessage.id.desc()).first()
-        
-        # Считаем непрочитанные сообщения с обновленным запросом
-        # Важно: используем distinct() чтобы избежать дублирования из-за возможных JOIN
-        unread_count = db.query(ChatMessage).filter(
-            ChatMessage.chat_id == chat.id,
-            ChatMessage.sender_id != current_user.id,
-            ChatMessage.is_read == False
-        ).distinct().count()
-        
-        # Выводим в лог для отладки
-        print(f"DEBUG: Чат {chat.id}, пользователь {other_user.id}, непрочитанных сообщений: {unread_count}")
-        
+        other_user = users.get(chat.get_other_user_id(current_user.id))
         if other_user:
             result.append({
                 "id": chat.id,
@@ -103,34 +82,124 @@ def get_chats(request: Request, db: Session = Depends(get_db)) -> Any:
                     "full_name": other_user.full_name,
                     "email": other_user.email
                 },
-                "last_message": last_message.content if last_message else "",
-                "last_message_time": last_message.created_at if last_message else None,
-                "unread_count": unread_count
+                "last_message": chat.last_message_preview or "",
+                "last_message_time": chat.last_message_at,
+                "unread_count": chat.get_unread_count(current_user.id)
             })
     
     return result
 
 
-@router.get("/{user_id}")
-def get_chat_messages(request: Request, user_id: int, db: Session = Depends(get_db)) -> Any:
+@router.get("/search")
+def search_messages(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Поисковый запрос"),
+    user_id: Optional[int] = Query(None, description="Искать только в чате с этим пользователем"),
+    before_id: Optional[int] = Query(None, description="Вернуть результаты старше этого id"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_PAGE_SIZE_MAX),
+    db: Session = Depends(get_db)
+) -> Any:
     """
-    Получить сообщения чата с конкретным пользователем из БД.
+    Поиск по сообщениям в чатах текущего пользователя.
+
+    Результаты от новых к старым, с фрагментом текста, где найденные слова
+    выделены <mark>. Для следующей страницы передайте before_id из заголовка
+    X-Next-Before-Id. Поиск идет только по чатам, где пользователь участник.
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "token" in cookies:
-        token = cookies["token"]
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
+        raise HTTPException(status_code=401, detail="Не авторизован")
+    
+    current_user = deps.get_current_user_optional(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Недействительный токен")
+    
+    terms = get_search_terms(q)
+    response.headers["X-Has-More"] = "false"
+    if not terms:
+        return []
+    
+    # Сначала чаты пользователя: сообщения чужих чатов в запрос не попадают
+    chats_query = db.query(AppChatModel).filter(
+        or_(
+            AppChatModel.user1_id == current_user.id,
+            AppChatModel.user2_id == current_user.id
+        )
+    )
+    if user_id is not None:
+        chats_query = chats_query.filter(
+            or_(AppChatModel.user1_id == user_id, AppChatModel.user2_id == user_id)
+        )
+    chats = {chat.id: chat for chat in chats_query.all()}
+    if not chats:
+        return []
+    
+    query = db.query(ChatMessage).filter(ChatMessage.chat_id.in_(chats.keys()))
+    if db.get_bind().dialect.name == "mysql":
+        # Полнотекстовый индекс ix_chat_messages_content_fulltext
+        query = query.filter(ChatMessage.content.match(build_boolean_query(terms)))
     else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
+        for term in terms:
+            query = query.filter(ChatMessage.content.ilike(f"%{escape_like(term)}%", escape="\\"))
+    if before_id is not None:
+        query = query.filter(ChatMessage.id < before_id)
+    # Берем на один результат больше, чтобы узнать, есть ли следующая страница
+    messages = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if has_more:
+        response.headers["X-Next-Before-Id"] = str(messages[-1].id)
+        response.headers["X-Has-More"] = "true"
+    
+    # Собеседников загружаем одним запросом
+    other_user_ids = {chats[msg.chat_id].get_other_user_id(current_user.id) for msg in messages}
+    users = {
+        user.id: user
+        for user in db.query(User).filter(User.id.in_(other_user_ids)).all()
+    } if other_user_ids else {}
     
-    # Проверяем токен и получаем пользователя
-    if not token:
+    result = []
+    for msg in messages:
+        other_user_id = chats[msg.chat_id].get_other_user_id(current_user.id)
+        other_user = users.get(other_user_id)
+        result.append({
+            "id": msg.id,
+            "chat_id": msg.chat_id,
+            "sender_id": msg.sender_id,
+            "receiver_id": current_user.id if msg.sender_id != current_user.id else other_user_id,
+            "user": {
+                "id": other_user_id,
+                "full_name": other_user.full_name if other_user else None
+            },
+            "snippet": highlight(msg.content, terms),
+            "sent_at": msg.created_at.isoformat()
+        })
+    
+    return result
+
+
+@router.get("/{user_id}")
+def get_chat_messages(
+    request: Request,
+    response: Response,
+    user_id: int,
+    before_id: Optional[int] = Query(None, description="Вернуть сообщения старше этого id"),
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_PAGE_SIZE_MAX),
+    db: Session = Depends(get_db)
+) -> Any:
+    """
+    Получить сообщения чата с конкретным пользователем из БД.
+
+    Возвращает последние limit сообщений (по возрастанию id). Для подгрузки
+    более старых передайте before_id из заголовка X-Next-Before-Id.
+    """
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Не авторизован")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = deps.get_current_user_optional(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
@@ -153,17 +222,32 @@ def get_chat_messages(request: Request, user_id: int, db: Session = Depends(get_
         db.refresh(chat)
         return []  # Новый чат без сообщений
     
-    # Получаем сообщения из БД
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.chat_id == chat.id
-    ).order_by(ChatMessage.created_at).all()
-    
-    # Отмечаем сообщения как прочитанные
-    for msg in messages:
-        if msg.sender_id != current_user.id and not msg.is_read:
-            msg.is_read = True
-    
-    db.commit()
+    # Получаем страницу сообщений по курсору (индекс chat_id, id)
+    query = db.query(ChatMessage).filter(ChatMessage.chat_id == chat.id)
+    if before_id is not None:
+        query = query.filter(ChatMessage.id < before_id)
+    # Берем на одно сообщение больше, чтобы узнать, есть ли еще более старые
+    messages = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = list(reversed(messages[:limit]))
+
+    if has_more:
+        response.headers["X-Next-Before-Id"] = str(messages[0].id)
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+
+    # Отмечаем прочитанными все входящие сообщения до последнего показанного одним UPDATE
+    if messages and before_id is None:
+        updated = db.query(ChatMessage).filter(
+            ChatMessage.chat_id == chat.id,
+            ChatMessage.sender_id != current_user.id,
+            ChatMessage.id <= messages[-1].id,
+            ChatMessage.is_read == False
+        ).update({ChatMessage.is_read: True}, synchronize_session=False)
+        AppChatModel.record_read(db, chat, current_user.id, updated)
+        db.commit()
+        if updated:
+            # Уведомляем собеседника: прочитано до последнего показанного сообщения
+            chat_manager.events.mark_read(current_user.id, user_id, messages[-1].id, persist=False)
     
     # Формируем результат
     result = []
@@ -184,21 +268,11 @@ def send_message(request: Request, user_id: int, content: str = Body(..., embed=
     """
     Отправить сообщение пользователю и сохранить в БД.
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "token" in cookies:
-        token = cookies["token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    # Проверяем токен и получаем пользователя
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Не авторизован")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = deps.get_current_user_optional(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Не авторизован")
     
@@ -229,6 +303,7 @@ def send_message(request: Request, user_id: int, content: str = Body(..., embed=
     )
     
     db.add(message)
+    AppChatModel.record_message(db, chat, message)
     db.commit()
     db.refresh(message)
     
@@ -246,21 +321,11 @@ def mark_message_as_read(request: Request, message_id: int = Body(..., embed=Tru
     """
     Отметить сообщение как прочитанное.
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "token" in cookies:
-        token = cookies["token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    # Проверяем токен и получаем пользователя
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Не авторизован")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = deps.get_current_user_optional(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
@@ -300,12 +365,16 @@ def mark_message_as_read(request: Request, message_id: int = Body(..., embed=Tru
             ChatMessage.sender_id == sender_id,
             ChatMessage.is_read == False
         ).update({ChatMessage.is_read: True})
+        AppChatModel.record_read(db, chat, current_user.id, updated)
         
         total_messages_updated += updated
     
     # Фиксируем изменения в базе данных
     db.commit()
     
+    if total_messages_updated:
+        chat_manager.events.mark_read(current_user.id, sender_id, message_id, persist=False)
+    
     return {
         "success": True, 
         "message": f"Отмечено как прочитанные {total_messages_updated} сообщений"
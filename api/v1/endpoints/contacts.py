@@ -2,11 +2,9 @@ from typing import Any, List
 
 from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
 from sqlalchemy.orm import Session
-from jose import jwt
 
 from app import models, schemas
 from app.api import deps
-from app.utils.security import ALGORITHM
 from config import settings
 from database import SessionLocal
 
@@ -30,20 +28,11 @@ def get_users_for_chat(
     """
     Получить список всех пользователей для чата, кроме текущего пользователя.
     """
-    # Получаем токен из cookie или заголовка Authorization
-    token = None
-    cookies = request.cookies
-    if "token" in cookies:
-        token = cookies["token"]
-    elif authorization and authorization.startswith("Bearer "):
-        token = authorization.replace("Bearer ", "")
+    # Текущий пользователь по токену запроса (проверяется один раз за запрос)
+    principal = deps.get_request_principal(request)
     
     try:
-        # Если есть токен, получаем текущего пользователя
-        current_user_id = None
-        if token:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-            current_user_id = int(payload.get("sub"))
+        current_user_id = principal.user_id if principal else None
         
         # Получаем всех активных пользователей
         query = db.query(models.User).filter(models.User.is_active == True)
@@ -1,74 +1,46 @@
 from typing import Any, List
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-from jose import jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models
 from app.api import deps
-from app.utils.security import ALGORITHM
 from config import settings
-from database import SessionLocal
 
 router = APIRouter()
 
-# Функция для получения сессии БД
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# Получение текущего пользователя из токена
-def get_current_user_from_token(token: str, db: Session) -> models.User:
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload.get("sub"))
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        if not user:
-            return None
-        return user
-    except Exception as e:
-        print(f"DEBUG: Ошибка при декодировании токена: {e}")
-        return None
-
 
 @router.post("/{property_id}")
-def add_to_favorites(
+async def add_to_favorites(
     property_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(deps.get_async_db)
 ) -> Any:
     """
     Добавить объявление в избранное
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "access_token" in cookies:
-        token = cookies["access_token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = await deps.get_current_user_optional_async(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
     # Проверяем существование объявления
-    property_item = db.query(models.Property).filter(models.Property.id == property_id).first()
+    property_item = (await db.execute(
+        select(models.Property.id).where(models.Property.id == property_id)
+    )).first()
     if not property_item:
         raise HTTPException(status_code=404, detail="Объявление не найдено")
     
     # Проверяем, не добавлено ли уже в избранное
-    existing_favorite = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.id,
-        models.Favorite.property_id == property_id
-    ).first()
+    existing_favorite = (await db.execute(
+        select(models.Favorite.id).where(
+            models.Favorite.user_id == current_user.id,
+            models.Favorite.property_id == property_id
+        )
+    )).first()
     
     if existing_favorite:
         return {"status": "already_exists", "message": "Объявление уже в избранном"}
@@ -80,89 +52,68 @@ def add_to_favorites(
     )
     
     db.add(new_favorite)
-    db.commit()
-    db.refresh(new_favorite)
+    await db.commit()
     
     return {"status": "success", "message": "Объявление добавлено в избранное"}
 
 
 @router.delete("/{property_id}")
-def remove_from_favorites(
+async def remove_from_favorites(
     property_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(deps.get_async_db)
 ) -> Any:
     """
     Удалить объявление из избранного
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "access_token" in cookies:
-        token = cookies["access_token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = await deps.get_current_user_optional_async(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
     # Находим запись в избранном
-    favorite = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.id,
-        models.Favorite.property_id == property_id
-    ).first()
+    favorite = (await db.execute(
+        select(models.Favorite).where(
+            models.Favorite.user_id == current_user.id,
+            models.Favorite.property_id == property_id
+        )
+    )).scalars().first()
     
     if not favorite:
         raise HTTPException(status_code=404, detail="Объявление не найдено в избранном")
     
     # Удаляем из избранного
-    db.delete(favorite)
-    db.commit()
+    await db.delete(favorite)
+    await db.commit()
     
     return {"status": "success", "message": "Объявление удалено из избранного"}
 
 
 @router.get("/")
-def get_favorites(
+async def get_favorites(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(deps.get_async_db)
 ) -> Any:
     """
     Получить список избранных объявлений пользователя
     """
-    # Получаем токен из cookie или заголовка
-    token = None
-    cookies = request.cookies
-    if "access_token" in cookies:
-        token = cookies["access_token"]
-    else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-    
-    if not token:
+    # Токен проверяется один раз за запрос, пользователь берется из кеша
+    if not deps.get_request_token(request):
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    current_user = get_current_user_from_token(token, db)
+    current_user = await deps.get_current_user_optional_async(request, db)
     if not current_user:
         raise HTTPException(status_code=401, detail="Недействительный токен")
     
-    # Получаем избранные объявления
-    favorites = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.id
-    ).all()
-    
-    # Получаем полную информацию об объявлениях
-    property_ids = [fav.property_id for fav in favorites]
-    properties = db.query(models.Property).filter(
-        models.Property.id.in_(property_ids)
-    ).all()
+    # Избранные объявления пользователя - одним запросом
+    properties = (await db.execute(
+        select(models.Property).join(
+            models.Favorite, models.Favorite.property_id == models.Property.id
+        ).where(models.Favorite.user_id == current_user.id)
+    )).scalars().unique().all()
     
     # Форматируем результат
     result = []
@@ -24,3 +24,87 @@ def health_check(db: Session = Depends(deps.get_db)):
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Ошибка проверки работоспособности: {str(e)}"
         )
+
+
+@router.get("/websockets", status_code=status.HTTP_200_OK)
+def websocket_queues_health():
+    """
+    Метрики исходящих очередей WebSocket чата этого воркера (глубина, сброшенные сообщения)
+    """
+    from app.websockets.chat_manager import manager as chat_manager
+    return chat_manager.get_send_queue_stats()
+
+
+@router.get("/websockets/connections", status_code=status.HTTP_200_OK)
+def websocket_connections_health():
+    """
+    Живые WebSocket соединения этого воркера по эндпоинтам, лимиты и отключения по простою
+    """
+    from app.websockets.lifecycle import connection_lifecycle
+    return connection_lifecycle.stats()
+
+
+@router.get("/auth", status_code=status.HTTP_200_OK)
+def auth_health():
+    """
+    Пул проверки паролей этого воркера (очередь, отказы, пересчитанные хеши), счетчики лимитов и кеш пользователей
+    """
+    from app.utils.password_hasher import password_hasher
+    from app.utils.rate_limit import rate_limit_backend
+    from app.utils.user_cache import user_cache
+    return {
+        "password_hasher": password_hasher.stats(),
+        "rate_limit": rate_limit_backend.stats(),
+        "user_cache": user_cache.stats(),
+    }
+
+
+@router.get("/media-resize", status_code=status.HTTP_200_OK)
+def media_resize_health():
+    """
+    Дисковый кеш уменьшенных изображений этого воркера: число файлов, занятый и допустимый объем
+    """
+    from app.utils.image_resizer import resize_cache
+    return resize_cache.stats()
+
+
+@router.get("/http-clients", status_code=status.HTTP_200_OK)
+def http_clients_health():
+    """
+    Исходящие клиенты внешних провайдеров этого воркера: запросы, повторы, состояние автомата, соединения в пуле
+    """
+    from app.utils.http_clients import http_clients
+    return http_clients.stats()
+
+
+@router.get("/database", status_code=status.HTTP_200_OK)
+def database_health():
+    """
+    Реплики БД для чтения этого воркера: в ротации или нет, отставание, число чтений
+    """
+    from database import replica_router
+    return replica_router.stats()
+
+
+@router.get("/telegram-bot", status_code=status.HTTP_200_OK)
+def telegram_bot_health():
+    """
+    Процесс Telegram бота: режим запуска, состояние и очередь сообщений (через IPC сокет), перезапуски, если его запускает этот воркер
+    """
+    from config import settings
+    from app.utils.bot_ipc import BotIPCClient, BotIPCError
+    from app.services.telegram_outbox import telegram_outbox
+    # Очередь этого процесса: основная без отдельного процесса бота, запасная при его недоступности
+    result = {"mode": settings.TELEGRAM_BOT_MODE, "outbox": telegram_outbox.stats()}
+    if settings.TELEGRAM_BOT_MODE == "process":
+        from app.services.telegram_bot_supervisor import bot_supervisor
+        result["supervisor"] = bot_supervisor.stats()
+    if settings.TELEGRAM_BOT_MODE in ("process", "external"):
+        client = BotIPCClient(settings.TELEGRAM_BOT_IPC_PATH, timeout=settings.TELEGRAM_BOT_IPC_TIMEOUT_SECONDS)
+        try:
+            result["bot"] = client.call("status")
+        except BotIPCError as e:
+            result["bot"] = {"error": str(e)}
+        finally:
+            client.close()
+    return result
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Request
 from typing import List, Dict, Any
 from sqlalchemy.orm import Session
 
+from app import models
 from app.api import deps
+from app.models.user import UserRole
 from app.utils.media_uploader import media_uploader
 
 router = APIRouter()
@@ -40,16 +42,45 @@ async def test_media_upload(
     
     return result
 
-@router.delete("/test-delete/{property_id}")
-async def test_media_delete(property_id: str) -> Dict[str, Any]:
-    """Тестовое удаление изображений"""
+@router.delete("/properties/{property_id}")
+async def delete_property_media(
+    property_id: int,
+    request: Request,
+    db: Session = Depends(deps.get_db)
+) -> Dict[str, Any]:
+    """Удаление изображений объявления (владелец или администратор)"""
+    current_user = deps.get_current_active_user(request, db)
+    
+    property = db.query(models.Property).filter(models.Property.id == property_id).first()
+    if not property:
+        raise HTTPException(status_code=404, detail="Объявление не найдено")
     
-    result = await media_uploader.delete_property_images(property_id)
+    if property.owner_id != current_user.id and current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Недостаточно прав для удаления изображений")
     
+    # Каталог старой раскладки media/properties/<id> (до контентно-адресуемого хранилища)
+    result = await media_uploader.delete_property_images(str(property.id))
     if result.get("status") != "success":
         raise HTTPException(status_code=400, detail=result.get("message"))
     
-    return result
+    # Изображения в content/ общие для одинаковых фото: убираем ссылки объявления,
+    # а файлы без других ссылок удалит сборщик мусора
+    images = db.query(models.PropertyImage).filter(models.PropertyImage.property_id == property.id).all()
+    content_hashes = [media_uploader.content_hash_from_url(image.url) for image in images]
+    content_hashes += [image.get("content_hash") for image in property.images_data or [] if isinstance(image, dict)]
+    
+    for image in images:
+        db.delete(image)
+    property.images_data = None
+    db.commit()
+    
+    release_result = await media_uploader.release_content(content_hashes)
+    return {
+        "status": "success",
+        "message": "Images deleted successfully",
+        "deleted_images": len(images),
+        "released": release_result["count"]
+    }
 
 @router.get("/info")
 async def media_info() -> Dict[str, Any]:
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from app.utils.image_resizer import resize_cache
+
+router = APIRouter()
+
+
+@router.get("/media/r/{width}x{height}/{path:path}")
+async def get_resized_image(width: int, height: int, path: str):
+    """
+    Уменьшенная копия изображения из static/ или media/.
+    Первый запрос делает ресайз, дальше файл отдается из дискового кеша.
+    """
+    if not resize_cache.is_allowed_size(width, height):
+        raise HTTPException(status_code=400, detail="Недопустимый размер изображения")
+
+    result = await resize_cache.get(path, width, height)
+    if not result:
+        raise HTTPException(status_code=404, detail="Изображение не найдено")
+
+    cache_path, cache_hit = result
+    return FileResponse(
+        cache_path,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": "public, max-age=604800",
+            "X-Resize-Cache": "HIT" if cache_hit else "MISS",
+        },
+    )
+
@@ -1,10 +1,11 @@
 from typing import Any
-from fastapi import APIRouter, Depends, Request, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, Request, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.responses import RedirectResponse, JSONResponse
 from sqlalchemy.orm import Session
 from app.api import deps
 from app import models
 from app.utils.panorama_processor import panorama_processor, PanoramaProcessor
+from app.utils.panorama_tiler import panorama_tiler, mark_multires_pending
 from datetime import datetime
 import json
 import os
@@ -23,23 +24,22 @@ async def check_admin_access(request: Request, db: Session):
     """Проверка доступа администратора"""
     logger.info("🔐 Проверка доступа администратора...")
     
-    auth_token = request.cookies.get('access_token')
-    if not auth_token:
-        logger.warning("❌ Токен доступа не найден в cookies")
+    # Токен уже проверен middleware или зависимостью, результат лежит в request.state
+    principal = deps.get_request_principal(request)
+    if not principal:
+        logger.warning("❌ Действительный токен доступа не найден")
         return RedirectResponse('/admin/login', status_code=303)
     
     try:
-        from jose import jwt
-        from config import settings
-        payload = jwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = principal.payload
         logger.debug(f"🔍 Payload токена: {payload}")
         
-        if not payload.get("is_admin"):
+        if not principal.is_admin:
             logger.warning("❌ Пользователь не является администратором")
             return RedirectResponse('/admin/login', status_code=303)
         
         # Получаем пользователя из базы данных
-        user = db.query(models.User).filter(models.User.id == payload["sub"]).first()
+        user = deps.get_current_user_optional(request, db)
         if not user:
             logger.error(f"❌ Пользователь с ID {payload['sub']} не найден в БД")
             return RedirectResponse('/admin/login', status_code=303)
@@ -60,23 +60,22 @@ async def check_company_access(request: Request, db: Session):
     """Проверка доступа компании"""
     logger.info("🏢 Проверка доступа компании...")
     
-    auth_token = request.cookies.get('access_token')
-    if not auth_token:
-        logger.warning("❌ Токен доступа не найден в cookies")
+    # Токен уже проверен middleware или зависимостью, результат лежит в request.state
+    principal = deps.get_request_principal(request)
+    if not principal:
+        logger.warning("❌ Действительный токен доступа не найден")
         return RedirectResponse('/companies/login', status_code=303)
     
     try:
-        from jose import jwt
-        from config import settings
-        payload = jwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = principal.payload
         logger.debug(f"🔍 Payload токена: {payload}")
         
-        if not payload.get("is_company"):
+        if not principal.is_company:
             logger.warning("❌ Пользователь не является компанией")
             return RedirectResponse('/companies/login', status_code=303)
         
         # Получаем пользователя-компанию из базы данных
-        user = db.query(models.User).filter(models.User.id == payload["sub"]).first()
+        user = deps.get_current_user_optional(request, db)
         if not user:
             logger.error(f"❌ Пользователь с ID {payload['sub']} не найден в БД")
             return RedirectResponse('/companies/login', status_code=303)
@@ -145,6 +144,7 @@ async def get_admin_panorama_info(
 async def upload_admin_panorama(
     property_id: int,
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(deps.get_db)
 ):
@@ -172,7 +172,7 @@ async def upload_admin_panorama(
         if property_obj.tour_360_file_id:
             logger.info(f"🗑️ Удаление существующих файлов панорамы: {property_obj.tour_360_file_id}")
             try:
-                await processor.delete_panorama_files(property_obj.tour_360_file_id, property_id)
+                await processor.delete_panorama_files(property_obj.tour_360_file_id)
                 logger.info("✅ Существующие файлы панорамы удалены")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка удаления существующих файлов: {str(e)}")
@@ -192,7 +192,7 @@ async def upload_admin_panorama(
         property_obj.tour_360_optimized_url = result['urls']['optimized']
         property_obj.tour_360_preview_url = result['urls']['preview']
         property_obj.tour_360_thumbnail_url = result['urls']['thumbnail']
-        property_obj.tour_360_metadata = json.dumps(result['metadata'], ensure_ascii=False)
+        property_obj.tour_360_metadata = json.dumps(mark_multires_pending(result['metadata']), ensure_ascii=False)
         property_obj.tour_360_uploaded_at = datetime.now()
         
         property_obj.tour_360_url = None
@@ -209,6 +209,10 @@ async def upload_admin_panorama(
         logger.debug("🔄 Обновление объекта из БД...")
         db.refresh(property_obj)
         
+        # Нарезка на тайлы для прогрессивного просмотра - после ответа клиенту
+        background_tasks.add_task(panorama_tiler.build_tiles, "Property", property_obj.id, result['file_id'])
+        logger.info("🧩 Нарезка панорамы на тайлы поставлена в фоновую очередь")
+        
         logger.debug("🔍 Проверка сохраненных данных:")
         logger.debug(f"  tour_360_file_id: {property_obj.tour_360_file_id}")
         logger.debug(f"  tour_360_original_url: {property_obj.tour_360_original_url}")
@@ -270,7 +274,7 @@ async def delete_admin_panorama(
             logger.info(f"🗑️ Удаление файлов панорамы: {property_obj.tour_360_file_id}")
             processor = PanoramaProcessor()
             try:
-                await processor.delete_panorama_files(property_obj.tour_360_file_id, property_id)
+                await processor.delete_panorama_files(property_obj.tour_360_file_id)
                 logger.info("✅ Файлы панорамы удалены")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка удаления файлов: {str(e)}")
@@ -353,6 +357,7 @@ async def get_company_panorama_info(
 async def upload_company_panorama(
     property_id: int,
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(deps.get_db)
 ):
@@ -383,7 +388,7 @@ async def upload_company_panorama(
         if property_obj.tour_360_file_id:
             logger.info(f"🗑️ Удаление существующих файлов панорамы: {property_obj.tour_360_file_id}")
             try:
-                await processor.delete_panorama_files(property_obj.tour_360_file_id, property_id)
+                await processor.delete_panorama_files(property_obj.tour_360_file_id)
                 logger.info("✅ Существующие файлы панорамы удалены")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка удаления существующих файлов: {str(e)}")
@@ -403,7 +408,7 @@ async def upload_company_panorama(
         property_obj.tour_360_optimized_url = result['urls']['optimized']
         property_obj.tour_360_preview_url = result['urls']['preview']
         property_obj.tour_360_thumbnail_url = result['urls']['thumbnail']
-        property_obj.tour_360_metadata = json.dumps(result['metadata'], ensure_ascii=False)
+        property_obj.tour_360_metadata = json.dumps(mark_multires_pending(result['metadata']), ensure_ascii=False)
         property_obj.tour_360_uploaded_at = datetime.now()
         
         property_obj.tour_360_url = None
@@ -415,6 +420,10 @@ async def upload_company_panorama(
         logger.debug("🔄 Обновление объекта из БД...")
         db.refresh(property_obj)
         
+        # Нарезка на тайлы для прогрессивного просмотра - после ответа клиенту
+        background_tasks.add_task(panorama_tiler.build_tiles, "Property", property_obj.id, result['file_id'])
+        logger.info("🧩 Нарезка панорамы на тайлы поставлена в фоновую очередь")
+        
         response_data = {
             "success": True,
             "message": "360° панорама успешно загружена и обработана",
@@ -474,7 +483,7 @@ async def delete_company_panorama(
             logger.info(f"🗑️ Удаление файлов панорамы: {property_obj.tour_360_file_id}")
             processor = PanoramaProcessor()
             try:
-                await processor.delete_panorama_files(property_obj.tour_360_file_id, property_id)
+                await processor.delete_panorama_files(property_obj.tour_360_file_id)
                 logger.info("✅ Файлы панорамы удалены")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка удаления файлов: {str(e)}")
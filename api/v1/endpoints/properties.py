@@ -396,6 +396,7 @@ async def create_property_with_media(
             has_parking=has_parking,
             has_elevator=has_elevator,
             photo_urls=[img["urls"]["medium"] for img in images_data],
+            photo_placeholders=[img.get("placeholder") for img in images_data],
             category_ids=[1],  # По умолчанию - Продажа
             latitude=latitude,
             longitude=longitude,
@@ -431,11 +432,13 @@ async def create_property_with_media(
         print(f"ERROR: Тип ошибки: {type(e)}")
         print(f"ERROR: Полная информация об ошибке: {repr(e)}")
         
-        # Пытаемся удалить загруженные изображения при ошибке
-        if 'property_media_id' in locals():
+        # Освобождаем загруженные изображения при ошибке: сборщик мусора удалит только те,
+        # на которые нет других ссылок - одинаковые фото могут использоваться в других объявлениях
+        if 'images_data' in locals():
             try:
-                await media_uploader.delete_property_images(property_media_id)
-                print(f"DEBUG: Загруженные изображения удалены после ошибки")
+                db.rollback()
+                await media_uploader.release_content([img.get("content_hash") for img in images_data])
+                print(f"DEBUG: Загруженные изображения освобождены после ошибки")
             except:
                 print(f"DEBUG: Не удалось удалить изображения после ошибки")
         
@@ -0,0 +1,112 @@
+from fastapi import APIRouter, Request, Depends, BackgroundTasks
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from typing import Dict, Any
+
+from app.api import deps
+from app.utils.web_push import (
+    VAPID_PUBLIC_KEY,
+    save_subscription,
+    remove_subscription,
+    send_push_in_new_session,
+)
+
+router = APIRouter()
+
+
+@router.get("/vapid-key")
+async def get_vapid_key():
+    """Get the public VAPID key for push notifications"""
+    if not VAPID_PUBLIC_KEY:
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": "VAPID keys not configured on the server"}
+        )
+    return {"publicKey": VAPID_PUBLIC_KEY}
+
+@router.post("/subscribe")
+async def subscribe(request: Request, db: Session = Depends(deps.get_db)):
+    """Save a new push subscription"""
+    try:
+        subscription_data = await request.json()
+
+        # Validate subscription data
+        if not subscription_data or not subscription_data.get("endpoint"):
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": "Invalid subscription data"}
+            )
+
+        # Подписка привязывается к текущему пользователю, чтобы слать ему уведомления чата
+        current_user = deps.get_current_user_optional(request, db)
+        is_new = save_subscription(
+            db,
+            subscription_data,
+            user_id=current_user.id if current_user else None,
+            user_agent=request.headers.get("User-Agent"),
+        )
+
+        if not is_new:
+            return {"success": True, "message": "Subscription updated"}
+        return {"success": True, "message": "Successfully subscribed to notifications"}
+
+    except Exception as e:
+        print(f"Error saving subscription: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": str(e)}
+        )
+
+@router.post("/unsubscribe")
+async def unsubscribe(request: Request, db: Session = Depends(deps.get_db)):
+    """Cancel a push subscription"""
+    try:
+        subscription_data = await request.json()
+
+        if not subscription_data or not subscription_data.get("endpoint"):
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": "Invalid subscription data"}
+            )
+
+        # Remove subscription with matching endpoint
+        if remove_subscription(db, subscription_data.get("endpoint")):
+            return {"success": True, "message": "Subscription canceled"}
+
+        return {"success": True, "message": "Subscription not found"}
+
+    except Exception as e:
+        print(f"Error canceling subscription: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": str(e)}
+        )
+
+@router.post("/test")
+async def send_test_push(request: Request, background_tasks: BackgroundTasks):
+    """Send a test push notification"""
+    try:
+        # Data for test notification
+        notification_data = {
+            "title": "Wazir Test Notification",
+            "body": "This is a test push notification. The notification system is working correctly!",
+            "icon": "/static/layout/assets/img/logo_non.png",
+            "url": "/admin/dashboard"
+        }
+
+        # Send notification to all subscribers in background task
+        background_tasks.add_task(send_push_notifications, notification_data)
+
+        return {"success": True, "message": "Test notification sent"}
+
+    except Exception as e:
+        print(f"Error sending test notification: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": str(e)}
+        )
+
+# Background task for sending push notifications
+def send_push_notifications(notification_data: Dict[str, Any]):
+    """Send push notifications to all subscribers."""
+    send_push_in_new_session(notification_data)
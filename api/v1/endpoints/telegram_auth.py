@@ -1,88 +1,42 @@
 from fastapi import APIRouter, HTTPException, Depends, Form, status, Request
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional
 import logging
 from datetime import datetime, timedelta
 import asyncio
-import random
-import json
-import os
 
 from app.api import deps
 from app.services.telegram_auth_service import telegram_auth_service
+from app.utils.rate_limit import Cooldown, RateLimit, rate_limit
+from app.utils.code_store import (
+    generate_verification_code,
+    get_verification_code,
+    save_verification_code,
+    verify_and_consume_code,
+)
 from config import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Файл для хранения кодов (тот же что использует бот)
-CODES_FILE = "verification_codes.json"
-
-def load_verification_codes():
-    """Загрузка кодов из файла"""
-    try:
-        if os.path.exists(CODES_FILE):
-            with open(CODES_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Конвертируем строки обратно в datetime
-                for phone, code_data in data.items():
-                    code_data['timestamp'] = datetime.fromisoformat(code_data['timestamp'])
-                return data
-    except Exception as e:
-        print(f"Ошибка загрузки кодов: {e}")
-    return {}
-
-def save_verification_codes(codes):
-    """Сохранение кодов в файл"""
-    try:
-        # Конвертируем datetime в строки для JSON
-        data = {}
-        for phone, code_data in codes.items():
-            data[phone] = {
-                'code': code_data['code'],
-                'timestamp': code_data['timestamp'].isoformat(),
-                'user_id': code_data.get('user_id')
-            }
-        
-        with open(CODES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Ошибка сохранения кодов: {e}")
-
-def verify_code_from_file(phone: str, code: str) -> bool:
-    """Проверка кода из файла"""
-    codes = load_verification_codes()
-    
-    if phone not in codes:
-        return False
-    
-    stored_data = codes[phone]
-    
-    # Проверяем, не истек ли код (5 минут)
-    if datetime.now() - stored_data['timestamp'] > timedelta(minutes=5):
-        # Удаляем истекший код
-        del codes[phone]
-        save_verification_codes(codes)
-        return False
-    
-    # Проверяем код
-    if stored_data['code'] == code:
-        # Удаляем код после успешной проверки
-        del codes[phone]
-        save_verification_codes(codes)
-        return True
-    
-    return False
+# Лимиты инициации: каждая создает новый код для телефона
+INITIATE_LIMITS = (
+    Cooldown("telegram_initiate_cooldown", settings.SMS_RESEND_COOLDOWN_SECONDS, key="phone", field="phone"),
+    RateLimit("telegram_initiate_phone", 5, 3600, key="phone", field="phone"),
+    RateLimit("telegram_initiate_ip", 20, 3600, key="ip"),
+)
 
 @router.post("/initiate")
+@rate_limit(*INITIATE_LIMITS, refund_failed=True)
 async def initiate_telegram_auth(
     phone: str = Form(...),
     db: Session = Depends(deps.get_db)
 ):
     """
-    Упрощенная инициация Telegram авторизации через файл
+    Упрощенная инициация Telegram авторизации: код сохраняется в общем хранилище кодов
     """
     print("\n" + "=" * 80)
     print("УПРОЩЕННАЯ TELEGRAM АВТОРИЗАЦИЯ")
@@ -91,24 +45,19 @@ async def initiate_telegram_auth(
     print(f"Бот: @{settings.TELEGRAM_BOT_USERNAME}")
     
     # Генерируем код сразу
-    code = ''.join(random.choices('0123456789', k=4))
+    code = generate_verification_code()
     print(f"СГЕНЕРИРОВАННЫЙ КОД: {code}")
     
-    # Сохраняем код в файл
+    # Сохраняем код в хранилище (его же читает бот)
     try:
         # Приводим телефон к стандартному формату
         if not phone.startswith('+'):
             phone = '+' + phone
             
-        codes = load_verification_codes()
-        codes[phone] = {
-            'code': code,
-            'timestamp': datetime.now(),
-            'user_id': None
-        }
-        save_verification_codes(codes)
+        # Хранилище кодов может быть в процессе бота - ожидание ответа в пуле потоков
+        await run_in_threadpool(save_verification_code, phone, code, user_id=None)
         
-        print(f"КОД СОХРАНЕН В ФАЙЛ: {code} для {phone}")
+        print(f"КОД СОХРАНЕН: {code} для {phone}")
         
         # Возвращаем простой ответ с ссылкой на бота
         telegram_url = f"https://t.me/{settings.TELEGRAM_BOT_USERNAME}"
@@ -116,7 +65,7 @@ async def initiate_telegram_auth(
         return {
             "success": True,
             "message": f"Код сохранен: {code}. Идите в Telegram к боту и нажмите 'Поделиться номером'",
-            "session_id": "файловый_режим",
+            "session_id": "хранилище_кодов",
             "telegram_url": telegram_url,
             "code": code  # Для тестирования
         }
@@ -288,38 +237,16 @@ async def verify_telegram_code(
             print(f"✅ Импорт telegram_bot УСПЕШЕН")
             print(f"🔧 Тип sms_bot: {type(sms_bot)}")
             
-            # Проверяем атрибуты бота
-            if hasattr(sms_bot, 'verification_codes'):
-                codes_count = len(sms_bot.verification_codes)
-                print(f"📊 Количество кодов в памяти бота: {codes_count}")
-                print(f"📋 Все телефоны в памяти: {list(sms_bot.verification_codes.keys())}")
-                
-                # Детальная проверка нашего телефона
-                for stored_phone, stored_data in sms_bot.verification_codes.items():
-                    print(f"🔍 Проверяем телефон: '{stored_phone}'")
-                    print(f"   - Совпадает с '{phone}': {stored_phone == phone}")
-                    print(f"   - Код: '{stored_data.get('code', 'НЕТ КОДА')}'")
-                    print(f"   - Время: {stored_data.get('timestamp', 'НЕТ ВРЕМЕНИ')}")
-                
-                if phone in sms_bot.verification_codes:
-                    stored_data = sms_bot.verification_codes[phone]
-                    stored_code = stored_data.get('code', 'НЕТ КОДА')
-                    stored_time = stored_data.get('timestamp', 'НЕТ ВРЕМЕНИ')
-                    print(f"✅ НАЙДЕН КОД ДЛЯ {phone}:")
-                    print(f"   - Сохраненный код: '{stored_code}'")
-                    print(f"   - Введенный код: '{code}'")
-                    print(f"   - Коды совпадают: {stored_code == code}")
-                    print(f"   - Время сохранения: {stored_time}")
-                    
-                    if stored_time != 'НЕТ ВРЕМЕНИ':
-                        time_diff = datetime.now() - stored_time
-                        print(f"   - Время прошло: {time_diff}")
-                        print(f"   - Код истек (>5 мин): {time_diff > timedelta(minutes=5)}")
-                else:
-                    print(f"❌ ТЕЛЕФОН {phone} НЕ НАЙДЕН в памяти бота")
-                    
+            # Проверяем код в общем хранилище кодов
+            stored_data = await run_in_threadpool(get_verification_code, phone)
+            if stored_data:
+                stored_code = stored_data.get('code', 'НЕТ КОДА')
+                print(f"✅ НАЙДЕН КОД ДЛЯ {phone}:")
+                print(f"   - Сохраненный код: '{stored_code}'")
+                print(f"   - Введенный код: '{code}'")
+                print(f"   - Коды совпадают: {stored_code == code}")
             else:
-                print(f"❌ У бота НЕТ атрибута verification_codes")
+                print(f"❌ ТЕЛЕФОН {phone} НЕ НАЙДЕН в хранилище кодов")
                 
         except ImportError as e:
             print(f"❌ ОШИБКА ИМПОРТА: {e}")
@@ -333,7 +260,7 @@ async def verify_telegram_code(
         # Вызов проверки кода
         print(f"🔍 Вызов sms_bot.verify_code('{phone}', '{code}')...")
         try:
-            verification_result = sms_bot.verify_code(phone, code)
+            verification_result = await run_in_threadpool(sms_bot.verify_code, phone, code)
             print(f"📋 Результат verify_code: {verification_result} (тип: {type(verification_result)})")
             
             if verification_result:
@@ -357,19 +284,19 @@ async def verify_telegram_code(
             print(f"❌ Traceback: {traceback.format_exc()}")
         
         # Резервные проверки
-        print(f"🔄 Резервная проверка из файла...")
+        print(f"🔄 Резервная проверка в хранилище кодов...")
         try:
-            file_result = verify_code_from_file(phone, code)
-            print(f"📁 Результат из файла: {file_result}")
+            store_result = await run_in_threadpool(verify_and_consume_code, phone, code)
+            print(f"📁 Результат из хранилища: {store_result}")
             
-            if file_result:
-                print(f"✅ УСПЕХ: Код подтвержден из файла")
+            if store_result:
+                print(f"✅ УСПЕХ: Код подтвержден из хранилища")
                 return JSONResponse(
                     status_code=200,
-                    content={"verified": True, "message": "Код подтвержден (файл)"}
+                    content={"verified": True, "message": "Код подтвержден (хранилище)"}
                 )
-        except Exception as file_error:
-            print(f"❌ ОШИБКА файла: {file_error}")
+        except Exception as store_error:
+            print(f"❌ ОШИБКА хранилища: {store_error}")
         
         # Тестовый режим
         print(f"🧪 Тестовый режим...")
@@ -455,8 +382,6 @@ async def force_reset_telegram_bot():
 @router.get("/status")
 async def get_telegram_auth_status():
     try:
-        telegram_auth_service.cleanup_expired_codes()
-        
         try:
             from app.services.telegram_bot_service import telegram_bot_service
             bot_running = telegram_bot_service.is_running if telegram_bot_service else False
@@ -472,8 +397,8 @@ async def get_telegram_auth_status():
                 "message": "Telegram авторизация работает",
                 "bot_available": bot_available,
                 "bot_running": bot_running,
-                "active_sessions": len(telegram_auth_service.phone_tg_mapping),
-                "active_codes": len(telegram_auth_service.codes_storage),
+                "active_sessions": await run_in_threadpool(telegram_auth_service.count_sessions),
+                "active_codes": await run_in_threadpool(telegram_auth_service.count_codes),
                 "bot_token_configured": bool(settings.TELEGRAM_BOT_TOKEN),
                 "bot_username_configured": bool(settings.TELEGRAM_BOT_USERNAME)
             }
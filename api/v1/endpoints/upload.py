@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 from app.api import deps
 from app.models.user import User
 from app.models.property import PropertyImage, Property
+from app.utils.media_uploader import media_uploader
 
 router = APIRouter()
 
@@ -93,7 +94,8 @@ async def upload_property_images(
                     image = PropertyImage(
                         url=file_url,
                         property_id=property_id,
-                        is_main=not has_main_image  # Первое загруженное изображение будет главным
+                        is_main=not has_main_image,  # Первое загруженное изображение будет главным
+                        placeholder=media_uploader.make_placeholder_from_bytes(content)
                     )
                     db.add(image)
                     db.commit()
@@ -0,0 +1,132 @@
+"""
+Проверка авторизации HTTP запросов до роутинга.
+
+Чистый ASGI middleware (без BaseHTTPMiddleware: ни задачи, ни обертки тела
+ответа на запрос). Правила доступа по префиксам путей компилируются в
+префиксное дерево один раз при сборке приложения; для пути выбирается
+правило с самым длинным совпавшим префиксом, поэтому поиск не зависит от
+числа правил.
+"""
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi.responses import RedirectResponse
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.api import deps
+
+
+class Access:
+    """Что требуется от запроса, попавшего под правило"""
+    PUBLIC = "public"
+    USER = "user"
+    ADMIN = "admin"
+    SUPERADMIN = "superadmin"
+    COMPANY = "company"
+
+
+# Страница входа для каждой закрытой области
+LOGIN_URLS = {
+    Access.USER: "/mobile/auth",
+    Access.ADMIN: "/admin/login",
+    Access.SUPERADMIN: "/superadmin/login",
+    Access.COMPANY: "/companies/login",
+}
+
+# Флаг токена, который нужен для области
+REQUIRED_FLAGS = {
+    Access.ADMIN: "is_admin",
+    Access.SUPERADMIN: "is_superadmin",
+    Access.COMPANY: "is_company",
+}
+
+# Статика отдается без проверки, до обхода дерева
+BYPASS_PREFIXES = ("/static/", "/media/")
+
+DEFAULT_RULES: Tuple[Tuple[str, str], ...] = (
+    # API эндпоинты проверяют токен сами через deps.get_current_*
+    ('/api/', Access.PUBLIC),
+    ('/mobile/auth', Access.PUBLIC),
+    ('/mobile/register', Access.PUBLIC),
+    ('/mobile/reset', Access.PUBLIC),
+    ('/mobile/test-websocket', Access.PUBLIC),
+    ('/mobile/ws/', Access.PUBLIC),
+    ('/favicon.ico', Access.PUBLIC),
+    ('/admin/', Access.ADMIN),
+    ('/admin/login', Access.PUBLIC),
+    ('/superadmin/', Access.SUPERADMIN),
+    ('/superadmin/login', Access.PUBLIC),
+    ('/companies/', Access.COMPANY),
+    ('/companies/login', Access.PUBLIC),
+)
+
+
+class RouteRules:
+    """Префиксное дерево правил: path -> правило самого длинного совпавшего префикса"""
+
+    # Ключ узла с правилом: пустая строка не совпадает ни с одним символом пути
+    ACCESS_KEY = ""
+
+    def __init__(self, rules: Iterable[Tuple[str, str]], default: str = Access.USER):
+        self.default = default
+        self._root: Dict[str, Any] = {}
+        for prefix, access in rules:
+            self.add(prefix, access)
+
+    def add(self, prefix: str, access: str):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self.ACCESS_KEY] = access
+
+    def match(self, path: str) -> str:
+        access = self.default
+        node = self._root
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            access = node.get(self.ACCESS_KEY, access)
+        return access
+
+
+class AuthenticationMiddleware:
+    """Перенаправляет на страницу входа запросы к закрытым страницам без нужного токена"""
+
+    def __init__(self, app: ASGIApp, rules: Iterable[Tuple[str, str]] = DEFAULT_RULES,
+                 bypass_prefixes: Tuple[str, ...] = BYPASS_PREFIXES):
+        self.app = app
+        self.rules = RouteRules(rules)
+        self.bypass_prefixes = bypass_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # WebSocket проверяет токен сам, статика доступна всем
+        if scope["type"] != "http" or scope["path"].startswith(self.bypass_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        access = self.rules.match(scope["path"])
+        if access == Access.PUBLIC:
+            await self.app(scope, receive, send)
+            return
+
+        response = self.check_access(Request(scope), access)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def check_access(request: Request, access: str) -> Optional[RedirectResponse]:
+        # Токен проверяется один раз за запрос, результат остается в request.state
+        # для зависимостей и обработчиков
+        principal = deps.get_request_principal(request)
+        if principal is None:
+            print(f"DEBUG: No valid token for path: {request.url.path}")
+            return RedirectResponse(LOGIN_URLS[access], status_code=303)
+
+        flag = REQUIRED_FLAGS.get(access)
+        if flag and not principal.payload.get(flag):
+            print(f"DEBUG: Token without {flag} trying to access {request.url.path}")
+            return RedirectResponse(LOGIN_URLS[access], status_code=303)
+        return None
@@ -1,12 +1,16 @@
-from typing import Generator, Optional
+from typing import Any, Dict, Generator, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status, Request
 from jose import JWTError, jwt
-from datetime import datetime
 
-from database import SessionLocal
+from database import SessionLocal, get_async_db
 from config import settings
 from app import models
+from app.utils.user_cache import user_cache
+
+# Признак того, что токен запроса еще не проверялся
+_UNRESOLVED = object()
 
 def get_db() -> Generator:
     """Получение сессии базы данных"""
@@ -16,55 +20,111 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+class Principal:
+    """Проверенные данные токена текущего запроса (без обращения к БД)"""
+
+    def __init__(self, token: str, payload: Dict[str, Any]):
+        self.token = token
+        self.payload = payload
+        self.user_id = int(payload["sub"])
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self.payload.get("is_admin"))
+
+    @property
+    def is_superadmin(self) -> bool:
+        return bool(self.payload.get("is_superadmin"))
+
+    @property
+    def is_company(self) -> bool:
+        return bool(self.payload.get("is_company"))
+
+
+def get_request_token(request: Request) -> Optional[str]:
+    """Токен из заголовка Authorization, иначе из cookies"""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    # access_token ставят страницы входа, token - старые клиенты чата
+    return request.cookies.get('access_token') or request.cookies.get('token')
+
+
+def get_request_principal(request: Request) -> Optional[Principal]:
+    """
+    Проверяет токен запроса один раз: результат (в том числе отсутствие
+    пользователя) сохраняется в request.state и переиспользуется middleware,
+    зависимостями и обработчиками.
+    """
+    principal = getattr(request.state, 'principal', _UNRESOLVED)
+    if principal is not _UNRESOLVED:
+        return principal
+
+    principal = None
+    token = get_request_token(request)
+    if token:
+        try:
+            # jose проверяет и подпись, и срок действия (exp)
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            if payload.get("sub") is not None:
+                principal = Principal(token, payload)
+        except JWTError as e:
+            print(f"DEBUG: JWT decode error: {e}")
+        except Exception as e:
+            print(f"DEBUG: Unexpected error during token decode: {e}")
+
+    request.state.principal = principal
+    return principal
+
+
 def get_current_user_optional(
     request: Request,
     db: Session = Depends(get_db)
 ) -> Optional[models.User]:
     """Получение текущего пользователя (опционально)"""
-    # Пытаемся получить токен из заголовка Authorization
-    auth_header = request.headers.get('Authorization')
-    token = None
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-    else:
-        # Если токена в заголовке нет, пытаемся получить из cookies
-        token = request.cookies.get('access_token')
-    
-    if not token:
+    principal = get_request_principal(request)
+    if principal is None:
         return None
-    
+
+    # Пользователь уже найден в этом запросе
+    user = getattr(request.state, 'user', None)
+    if user is not None and user in db:
+        return user
+
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        user_id = payload.get("sub")
-        if user_id is None:
-            return None
-            
-        # Проверяем срок действия токена
-        exp = payload.get("exp")
-        if exp and datetime.fromtimestamp(exp) < datetime.utcnow():
-            print(f"DEBUG: Token expired for user {user_id}")
-            return None
-            
-    except JWTError as e:
-        print(f"DEBUG: JWT decode error: {e}")
-        return None
+        user = user_cache.load(db, principal.user_id)
     except Exception as e:
-        print(f"DEBUG: Unexpected error during token decode: {e}")
+        print(f"DEBUG: Database error when fetching user {principal.user_id}: {e}")
         return None
-    
-    # Получаем пользователя из базы данных
-    try:
-        user = db.query(models.User).filter(models.User.id == int(user_id)).first()
-        if not user:
-            print(f"DEBUG: User with id {user_id} not found in database")
-            return None
+    if not user:
+        print(f"DEBUG: User with id {principal.user_id} not found in database")
+        return None
+    request.state.user = user
+    return user
+
+async def get_current_user_optional_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+) -> Optional[models.User]:
+    """Получение текущего пользователя (опционально) для обработчиков на AsyncSession"""
+    principal = get_request_principal(request)
+    if principal is None:
+        return None
+
+    user = getattr(request.state, 'user', None)
+    if user is not None and user in db:
         return user
+
+    try:
+        user = await user_cache.load_async(db, principal.user_id)
     except Exception as e:
-        print(f"DEBUG: Database error when fetching user {user_id}: {e}")
+        print(f"DEBUG: Database error when fetching user {principal.user_id}: {e}")
+        return None
+    if not user:
+        print(f"DEBUG: User with id {principal.user_id} not found in database")
         return None
+    request.state.user = user
+    return user
 
 def get_current_user(
     request: Request,
@@ -122,6 +122,7 @@ def create_message(
     )
     
     db.add(db_message)
+    AppChatModel.record_message(db, chat, db_message)
     db.commit()
     db.refresh(db_message)
     
@@ -154,6 +155,8 @@ def mark_message_as_read(
         )
     
     # Отмечаем сообщение как прочитанное
+    if not message.is_read and message.sender_id != current_user.id:
+        AppChatModel.record_read(db, chat, current_user.id, 1)
     message.is_read = True
     db.commit()
     
@@ -79,6 +79,7 @@ def create_ticket(
                     is_read=False
                 )
                 db.add(first_msg)
+                AppChatModel.record_message(db, chat, first_msg)
                 db.commit()
                 print(f"DEBUG: Создано первое сообщение {first_msg.id} в чате {chat.id}")
             else:
@@ -108,6 +109,7 @@ def create_ticket(
                 is_read=False
             )
             db.add(chat_msg)
+            AppChatModel.record_message(db, chat, chat_msg)
             db.commit()
     except Exception as e:
         print(f"[ERROR] Не удалось создать чат или сообщение: {e}")
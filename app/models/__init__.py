@@ -6,4 +6,5 @@ from .chat import AppChatModel, AppChatMessageModel
 from .chat_message import ChatMessage
 from .support import TicketStatus, SupportTicket, TicketResponse
 from .service import ServiceCategory, ServiceCard, ServiceCardImage
-from .category import GeneralCategory
\ No newline at end of file
+from .category import GeneralCategory
+from .push_subscription import PushSubscription
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, ForeignKey, Text, Boolean, String, DateTime, Index, case, or_
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from database import Base
 from .base import TimestampMixin
 from app.models.user import User
@@ -10,11 +11,25 @@ class AppChatModel(Base, TimestampMixin):
     Переименовано во избежание конфликта с моделями в models/chat.py
     """
     __tablename__ = "chats"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Список чатов пользователя, отсортированный по последнему сообщению
+        Index('ix_chats_user1_id_last_message_at', 'user1_id', 'last_message_at'),
+        Index('ix_chats_user2_id_last_message_at', 'user2_id', 'last_message_at'),
+        {'extend_existing': True},
+    )
+
+    PREVIEW_LENGTH = 255
 
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     user2_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+
+    # Сводка чата, обновляется вместе со вставкой сообщения (record_message)
+    last_message_id = Column(Integer, nullable=True)
+    last_message_preview = Column(String(255), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    user1_unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    user2_unread_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Отключение отношений для предотвращения конфликтов
     """
@@ -31,6 +46,71 @@ class AppChatModel(Base, TimestampMixin):
     messages = relationship("ChatMessageModel", back_populates="chat")
     """
 
+    def get_other_user_id(self, user_id: int) -> int:
+        return self.user2_id if self.user1_id == user_id else self.user1_id
+
+    def get_unread_count(self, user_id: int) -> int:
+        """Непрочитанные сообщения для участника user_id"""
+        count = self.user1_unread_count if self.user1_id == user_id else self.user2_unread_count
+        return count or 0
+
+    @classmethod
+    def _unread_column(cls, chat: "AppChatModel", user_id: int):
+        return cls.user1_unread_count if chat.user1_id == user_id else cls.user2_unread_count
+
+    @classmethod
+    def record_message(cls, db, chat: "AppChatModel", message) -> None:
+        """
+        Обновляет сводку чата для нового сообщения в той же транзакции.
+        Вызывается после db.add(message), до commit.
+
+        Обновление атомарное (одним UPDATE), поэтому параллельные отправки
+        не теряют инкременты счетчика и не откатывают last_message на более старое.
+        """
+        cls.record_messages(db, chat, [message])
+
+    @classmethod
+    def record_messages(cls, db, chat: "AppChatModel", messages) -> None:
+        """То же, что record_message, для нескольких сообщений чата одним UPDATE"""
+        if not messages:
+            return
+        db.flush()
+        last_message = max(messages, key=lambda m: m.id)
+        newer = or_(cls.last_message_id.is_(None), cls.last_message_id < last_message.id)
+        preview = (last_message.content or "")[:cls.PREVIEW_LENGTH]
+
+        increments = {}
+        for message in messages:
+            recipient_id = chat.get_other_user_id(message.sender_id)
+            column = cls._unread_column(chat, recipient_id)
+            increments[column.key] = increments.get(column.key, 0) + 1
+
+        # MySQL применяет SET слева направо, поэтому last_message_id обновляется последним
+        values = [(getattr(cls, key), getattr(cls, key) + count) for key, count in increments.items()]
+        values += [
+            (cls.last_message_preview, case((newer, preview), else_=cls.last_message_preview)),
+            (cls.last_message_at, case((newer, func.now()), else_=cls.last_message_at)),
+            (cls.last_message_id, case((newer, last_message.id), else_=cls.last_message_id)),
+        ]
+        db.query(cls).filter(cls.id == chat.id).update(
+            values,
+            synchronize_session=False,
+            update_args={"preserve_parameter_order": True},
+        )
+        db.expire(chat)
+
+    @classmethod
+    def record_read(cls, db, chat: "AppChatModel", reader_id: int, count: int) -> None:
+        """Уменьшает счетчик непрочитанных участника reader_id на count прочитанных сообщений"""
+        if not count:
+            return
+        unread_column = cls._unread_column(chat, reader_id)
+        db.query(cls).filter(cls.id == chat.id).update(
+            {unread_column: case((unread_column > count, unread_column - count), else_=0)},
+            synchronize_session=False,
+        )
+        db.expire(chat)
+
 
 class AppChatMessageModel(Base, TimestampMixin):
     """
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, Text, Boolean, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, Text, Boolean, DateTime, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from .base import TimestampMixin
@@ -6,7 +6,13 @@ import datetime
 
 class ChatMessage(Base, TimestampMixin):
     __tablename__ = "chat_messages"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Постраничная загрузка истории чата по курсору id
+        Index('ix_chat_messages_chat_id_id', 'chat_id', 'id'),
+        # Поиск по сообщениям (MATCH ... AGAINST), см. GET /api/v1/chat/search
+        Index('ix_chat_messages_content_fulltext', 'content', mysql_prefix='FULLTEXT'),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
@@ -115,6 +115,11 @@ class Property(Base, TimestampMixin):
             return self.tour_360_url
         return None
 
+    def get_360_multires(self):
+        """Возвращает конфигурацию тайлов панорамы для Pannellum (multires), если они готовы"""
+        from app.utils.panorama_tiler import get_multires_config
+        return get_multires_config(self.tour_360_metadata)
+
     # Метод для преобразования модели в словарь с правильной сериализацией всех полей
     def to_dict(self):
         result = {
@@ -197,6 +202,7 @@ class Property(Base, TimestampMixin):
                 {
                     "id": img.id,
                     "url": img.url,
+                    "placeholder": img.placeholder,
                     "is_main": img.is_main,
                     "property_id": img.property_id if hasattr(img, "property_id") else self.id,
                     "created_at": img.created_at.isoformat() if hasattr(img, "created_at") and img.created_at else None
@@ -212,6 +218,7 @@ class PropertyImage(Base, TimestampMixin):
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String(255))
     is_main = Column(Boolean, default=False)
+    placeholder = Column(Text, nullable=True)  # LQIP-заглушка (data URI ~20px), показывается до загрузки фото
     
     property_id = Column(Integer, ForeignKey("properties.id"))
     property = relationship("Property", back_populates="images")
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, String, Integer, Text, ForeignKey
+from database import Base
+from .base import TimestampMixin
+
+
+class PushSubscription(Base, TimestampMixin):
+    """Подписка браузера на Web Push (одна строка на endpoint)"""
+    __tablename__ = "push_subscriptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
+    endpoint = Column(String(500), unique=True, nullable=False)
+    # Полный объект подписки из PushManager.subscribe() в JSON (endpoint + keys)
+    subscription = Column(Text, nullable=False)
+    user_agent = Column(String(255), nullable=True)
+
+    def __repr__(self):
+        return f"<PushSubscription {self.id} user={self.user_id}>"
@@ -64,6 +64,11 @@ class ServiceCard(Base, TimestampMixin):
         if self.tour_360_optimized_url:
             return self.tour_360_optimized_url
         return self.tour_360_url
+    
+    def get_360_multires(self):
+        """Возвращает конфигурацию тайлов панорамы для Pannellum (multires), если они готовы"""
+        from app.utils.panorama_tiler import get_multires_config
+        return get_multires_config(self.tour_360_metadata)
 
 
 class ServiceCardImage(Base, TimestampMixin):
@@ -34,6 +34,7 @@ class Category(CategoryInDBBase):
 class PropertyImageBase(BaseModel):
     url: str
     is_main: Optional[bool] = False
+    placeholder: Optional[str] = None
 
 
 class PropertyImageCreate(PropertyImageBase):
@@ -79,6 +80,7 @@ class PropertyBase(BaseModel):
 class PropertyCreate(PropertyBase):
     category_ids: List[int]
     photo_urls: Optional[List[str]] = None
+    photo_placeholders: Optional[List[Optional[str]]] = None
     rooms: Optional[int] = None
     floor: Optional[int] = None
     building_floors: Optional[int] = None
@@ -4,6 +4,7 @@ import random
 import string
 from typing import Dict, Any, Optional, Tuple
 from config import settings
+from app.utils.http_clients import http_clients, ProviderUnavailable
 
 # Создаем цветной логгер для Devino SMS
 logger = logging.getLogger("devino_sms")
@@ -174,50 +175,49 @@ class DevinoSMSService:
             # Шаг 4: Отправка запроса
             logger.info("📍 Step 4: Sending HTTP request")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                logger.debug("🔌 HTTP client created with 30s timeout")
-                
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers=headers
-                )
-                
-                logger.info(f"⏱️  Request completed in {response.elapsed.total_seconds():.2f}s")
-                
-                # Шаг 5: Обработка ответа
-                logger.info("📍 Step 5: Processing response")
-                logger.info(f"📨 HTTP Status: {response.status_code}")
-                logger.debug(f"📨 Response headers: {dict(response.headers)}")
-                
-                try:
-                    response_data = response.json()
-                    logger.debug(f"📨 Raw response: {response_data}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to parse JSON response: {e}")
-                    logger.debug(f"📨 Raw response text: {response.text}")
-                    response_data = {"error": "Invalid JSON response"}
-                
-                if response.status_code == 200:
-                    # Успешный ответ
-                    logger.info("✅ SMS code sent successfully")
-                    return {
-                        'success': True,
-                        'message': 'SMS код отправлен успешно',
-                        'phone': normalized_phone,
-                        'response': response_data
-                    }
-                else:
-                    # Ошибка HTTP
-                    logger.error(f"❌ HTTP error {response.status_code}")
-                    logger.error(f"❌ Response: {response_data}")
-                    return {
-                        'success': False,
-                        'error': f'HTTP error: {response_data}'
-                    }
+            response = await http_clients.request("devino", "POST", url, json=payload, headers=headers)
+            
+            logger.info(f"⏱️  Request completed in {response.elapsed.total_seconds():.2f}s")
+            
+            # Шаг 5: Обработка ответа
+            logger.info("📍 Step 5: Processing response")
+            logger.info(f"📨 HTTP Status: {response.status_code}")
+            logger.debug(f"📨 Response headers: {dict(response.headers)}")
+            
+            try:
+                response_data = response.json()
+                logger.debug(f"📨 Raw response: {response_data}")
+            except Exception as e:
+                logger.error(f"❌ Failed to parse JSON response: {e}")
+                logger.debug(f"📨 Raw response text: {response.text}")
+                response_data = {"error": "Invalid JSON response"}
+            
+            if response.status_code == 200:
+                # Успешный ответ
+                logger.info("✅ SMS code sent successfully")
+                return {
+                    'success': True,
+                    'message': 'SMS код отправлен успешно',
+                    'phone': normalized_phone,
+                    'response': response_data
+                }
+            else:
+                # Ошибка HTTP
+                logger.error(f"❌ HTTP error {response.status_code}")
+                logger.error(f"❌ Response: {response_data}")
+                return {
+                    'success': False,
+                    'error': f'HTTP error: {response_data}'
+                }
                     
+        except ProviderUnavailable as e:
+            logger.error(f"🚫 Devino API unavailable, retry in {e.retry_after:.0f}s")
+            return {
+                'success': False,
+                'error': 'Devino API временно недоступен'
+            }
         except httpx.TimeoutException:
-            logger.error("⏰ Request timeout (30s)")
+            logger.error(f"⏰ Request timeout ({settings.DEVINO_TIMEOUT}s)")
             return {
                 'success': False,
                 'error': 'Таймаут запроса к Devino API'
@@ -296,60 +296,59 @@ class DevinoSMSService:
             # Шаг 4: Отправка запроса
             logger.info("📍 Step 4: Sending HTTP request")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                logger.debug("🔌 HTTP client created with 30s timeout")
-                
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers=headers
-                )
-                
-                logger.info(f"⏱️  Request completed in {response.elapsed.total_seconds():.2f}s")
-                
-                # Шаг 5: Обработка ответа
-                logger.info("📍 Step 5: Processing response")
-                logger.info(f"📨 HTTP Status: {response.status_code}")
-                
-                try:
-                    response_data = response.json()
-                    logger.debug(f"📨 Raw response: {response_data}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to parse JSON response: {e}")
-                    response_data = {"error": "Invalid JSON response"}
-                
-                if response.status_code == 200:
-                    # Проверяем код ответа от Devino
-                    result_code = response_data.get('Code', -1)
-                    if result_code == 0:
-                        logger.info("✅ SMS code verified successfully")
-                        return {
-                            'success': True,
-                            'valid': True,
-                            'message': 'Код подтвержден успешно',
-                            'phone': normalized_phone,
-                            'response': response_data
-                        }
-                    else:
-                        logger.warning(f"⚠️  Code verification failed: {response_data}")
-                        return {
-                            'success': True,
-                            'valid': False,
-                            'message': 'Неверный код подтверждения',
-                            'phone': normalized_phone,
-                            'response': response_data
-                        }
+            response = await http_clients.request("devino", "POST", url, json=payload, headers=headers)
+            
+            logger.info(f"⏱️  Request completed in {response.elapsed.total_seconds():.2f}s")
+            
+            # Шаг 5: Обработка ответа
+            logger.info("📍 Step 5: Processing response")
+            logger.info(f"📨 HTTP Status: {response.status_code}")
+            
+            try:
+                response_data = response.json()
+                logger.debug(f"📨 Raw response: {response_data}")
+            except Exception as e:
+                logger.error(f"❌ Failed to parse JSON response: {e}")
+                response_data = {"error": "Invalid JSON response"}
+            
+            if response.status_code == 200:
+                # Проверяем код ответа от Devino
+                result_code = response_data.get('Code', -1)
+                if result_code == 0:
+                    logger.info("✅ SMS code verified successfully")
+                    return {
+                        'success': True,
+                        'valid': True,
+                        'message': 'Код подтвержден успешно',
+                        'phone': normalized_phone,
+                        'response': response_data
+                    }
                 else:
-                    # Ошибка HTTP
-                    logger.error(f"❌ HTTP error {response.status_code}")
-                    logger.error(f"❌ Response: {response_data}")
+                    logger.warning(f"⚠️  Code verification failed: {response_data}")
                     return {
-                        'success': False,
-                        'error': f'HTTP error: {response_data}'
+                        'success': True,
+                        'valid': False,
+                        'message': 'Неверный код подтверждения',
+                        'phone': normalized_phone,
+                        'response': response_data
                     }
+            else:
+                # Ошибка HTTP
+                logger.error(f"❌ HTTP error {response.status_code}")
+                logger.error(f"❌ Response: {response_data}")
+                return {
+                    'success': False,
+                    'error': f'HTTP error: {response_data}'
+                }
                     
+        except ProviderUnavailable as e:
+            logger.error(f"🚫 Devino API unavailable, retry in {e.retry_after:.0f}s")
+            return {
+                'success': False,
+                'error': 'Devino API временно недоступен'
+            }
         except httpx.TimeoutException:
-            logger.error("⏰ Request timeout (30s)")
+            logger.error(f"⏰ Request timeout ({settings.DEVINO_TIMEOUT}s)")
             return {
                 'success': False,
                 'error': 'Таймаут запроса к Devino API'
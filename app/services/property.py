@@ -13,6 +13,7 @@ class CRUDProperty(CRUDBase[Property, PropertyCreate, PropertyUpdate]):
     ) -> Property:
         # Извлекаем URL-адреса изображений перед созданием объекта недвижимости
         photo_urls = obj_in.photo_urls if obj_in.photo_urls else []
+        photo_placeholders = obj_in.photo_placeholders if obj_in.photo_placeholders else []
         
         # Извлекаем категории перед созданием объекта недвижимости
         category_ids = obj_in.category_ids if obj_in.category_ids else []
@@ -21,7 +22,7 @@ class CRUDProperty(CRUDBase[Property, PropertyCreate, PropertyUpdate]):
         self._ensure_categories_exist(db)
         
         # Создаем объект данных, исключая photo_urls и category_ids
-        obj_in_data = jsonable_encoder(obj_in, exclude={"photo_urls", "category_ids"})
+        obj_in_data = jsonable_encoder(obj_in, exclude={"photo_urls", "photo_placeholders", "category_ids"})
         db_obj = Property(**obj_in_data, owner_id=owner_id)
         
         # Сохраняем объект в базе данных
@@ -37,7 +38,8 @@ class CRUDProperty(CRUDBase[Property, PropertyCreate, PropertyUpdate]):
         # Добавляем изображения
         for i, url in enumerate(photo_urls):
             is_main = i == 0  # Первое изображение будет главным
-            property_image = PropertyImage(property_id=db_obj.id, url=url, is_main=is_main)
+            placeholder = photo_placeholders[i] if i < len(photo_placeholders) else None
+            property_image = PropertyImage(property_id=db_obj.id, url=url, is_main=is_main, placeholder=placeholder)
             db.add(property_image)
         
         db.commit()
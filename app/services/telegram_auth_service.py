@@ -12,8 +12,11 @@ from datetime import datetime, timedelta
 from typing import Dict, Optional, Union, Any, List
 from dataclasses import dataclass
 
-import httpx
+from starlette.concurrency import run_in_threadpool
+
 from config import settings
+from app.services.telegram_outbox import send_telegram_message, PRIORITY_CODE
+from app.utils.code_store import code_store, CODE_KEY_PREFIX
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -39,12 +42,10 @@ class TelegramAuthService:
     def __init__(self):
         self.bot_token = getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
         self.bot_username = getattr(settings, 'TELEGRAM_BOT_USERNAME', None)
-        self.codes_storage = {}
-        self.phone_tg_mapping = {}
         self.code_expiry = 300
         
-        # Хранение сессий в памяти (в реальном приложении лучше использовать Redis)
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+        # Сессии хранятся в общем хранилище кодов (в памяти или Redis) и истекают сами
+        self.store = code_store
         # Срок действия сессии в минутах
         self.session_lifetime = 15
         
@@ -53,6 +54,24 @@ class TelegramAuthService:
     def generate_code(self) -> str:
         return str(random.randint(1000, 9999))
     
+    @staticmethod
+    def _session_key(session_id: str) -> str:
+        return f"tg_session:{session_id}"
+    
+    @staticmethod
+    def _phone_key(phone: str) -> str:
+        # Подтвержденная сессия по телефону - для проверки кода без перебора сессий
+        return f"tg_session_phone:{phone}"
+    
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(self._session_key(session_id))
+    
+    def count_sessions(self) -> int:
+        return self.store.count("tg_session:")
+    
+    def count_codes(self) -> int:
+        return self.store.count(CODE_KEY_PREFIX)
+    
     async def create_session(self, phone: str) -> TelegramAuthResult:
         """
         Создает новую сессию авторизации и возвращает session_id
@@ -64,14 +83,14 @@ class TelegramAuthService:
         normalized_phone = ''.join(filter(str.isdigit, phone))
         
         # Создаем сессию
-        self.sessions[session_id] = {
+        # Хранилище может быть в другом процессе (Redis, бот) - вызовы из event loop идут через пул потоков
+        await run_in_threadpool(self.store.set, self._session_key(session_id), {
             'phone': normalized_phone,
-            'created_at': datetime.now(),
-            'expires_at': datetime.now() + timedelta(minutes=self.session_lifetime),
+            'created_at': datetime.now().isoformat(),
             'confirmed': False,
             'telegram_user_id': None,
             'code': None
-        }
+        }, self.session_lifetime * 60)
         
         # Формируем ссылку на Telegram бота
         telegram_url = f"https://t.me/{self.bot_username}?start={session_id}"
@@ -90,25 +109,15 @@ class TelegramAuthService:
         Проверяет телефон полученный от Telegram и сравнивает с указанным при инициализации
         Если совпадает - генерирует код и привязывает его к сессии
         """
-        # Проверяем существование сессии
-        if session_id not in self.sessions:
+        # Проверяем существование сессии (истекшие удаляются хранилищем)
+        session = await run_in_threadpool(self.get_session, session_id)
+        if session is None:
             logger.warning(f"❌ Сессия не найдена: {session_id}")
             return TelegramAuthResult(
                 success=False,
                 message="Сессия не найдена или истекла"
             )
         
-        session = self.sessions[session_id]
-        
-        # Проверяем срок действия сессии
-        if datetime.now() > session['expires_at']:
-            logger.warning(f"⌛ Сессия истекла: {session_id}")
-            del self.sessions[session_id]
-            return TelegramAuthResult(
-                success=False,
-                message="Сессия истекла"
-            )
-        
         # Нормализуем телефоны для сравнения (только цифры)
         session_phone = ''.join(filter(str.isdigit, session['phone']))
         telegram_phone = ''.join(filter(str.isdigit, phone))
@@ -128,10 +137,17 @@ class TelegramAuthService:
         # Генерируем 4-значный код
         code = ''.join(random.choices('0123456789', k=4))
         
-        # Обновляем сессию
+        # Обновляем сессию, срок действия не меняется
         session['confirmed'] = True
         session['telegram_user_id'] = telegram_user_id
         session['code'] = code
+        if not await run_in_threadpool(self.store.update, self._session_key(session_id), session):
+            return TelegramAuthResult(
+                success=False,
+                message="Сессия истекла"
+            )
+        ttl = await run_in_threadpool(self.store.ttl, self._session_key(session_id)) or self.session_lifetime * 60
+        await run_in_threadpool(self.store.set, self._phone_key(session_phone), {'session_id': session_id}, ttl)
         
         logger.info(f"✅ Телефон подтвержден для сессии {session_id}")
         logger.info(f"🔢 Сгенерирован код: {code}")
@@ -149,45 +165,28 @@ class TelegramAuthService:
         # Нормализуем телефон
         normalized_phone = ''.join(filter(str.isdigit, phone))
         
-        # Ищем сессию по телефону
-        session_id = None
-        for sid, session in self.sessions.items():
-            session_phone = ''.join(filter(str.isdigit, session['phone']))
-            if session_phone == normalized_phone and session['confirmed']:
-                session_id = sid
-                break
+        # Ищем подтвержденную сессию по телефону
+        phone_entry = await run_in_threadpool(self.store.get, self._phone_key(normalized_phone))
+        session_id = phone_entry['session_id'] if phone_entry else None
         
-        if not session_id:
+        if not session_id or await run_in_threadpool(self.get_session, session_id) is None:
             logger.warning(f"❌ Сессия не найдена для телефона: {normalized_phone}")
             return TelegramAuthResult(
                 success=False,
                 message="Сессия не найдена или телефон не подтвержден"
             )
         
-        session = self.sessions[session_id]
-        
-        # Проверяем срок действия сессии
-        if datetime.now() > session['expires_at']:
-            logger.warning(f"⌛ Сессия истекла: {session_id}")
-            del self.sessions[session_id]
-            return TelegramAuthResult(
-                success=False,
-                message="Сессия истекла"
-            )
-        
-        # Проверяем код
-        if session['code'] != code:
-            logger.warning(f"❌ Неверный код: {code} != {session['code']}")
+        # Проверяем код и удаляем сессию одной атомарной операцией: код одноразовый
+        if await run_in_threadpool(self.store.pop_if, self._session_key(session_id), 'code', code) is None:
+            logger.warning(f"❌ Неверный код для сессии {session_id}")
             return TelegramAuthResult(
                 success=False,
                 message="Неверный код"
             )
         
+        await run_in_threadpool(self.store.delete, self._phone_key(normalized_phone))
         logger.info(f"✅ Код подтвержден для сессии {session_id}")
         
-        # Удаляем сессию после успешной авторизации
-        del self.sessions[session_id]
-        
         return TelegramAuthResult(
             success=True,
             message="Код подтвержден"
@@ -197,52 +196,26 @@ class TelegramAuthService:
         """
         Возвращает статус сессии
         """
-        if session_id not in self.sessions:
-            return {
-                "found": False,
-                "message": "Сессия не найдена"
-            }
-        
-        session = self.sessions[session_id]
-        
-        # Проверяем срок действия сессии
-        if datetime.now() > session['expires_at']:
-            del self.sessions[session_id]
+        session = self.get_session(session_id)
+        if session is None:
             return {
                 "found": False,
-                "message": "Сессия истекла"
+                "message": "Сессия не найдена или истекла"
             }
         
         return {
             "found": True,
             "confirmed": session['confirmed'],
-            "expires_in": int((session['expires_at'] - datetime.now()).total_seconds()),
+            "expires_in": self.store.ttl(self._session_key(session_id)) or 0,
             "phone": session['phone'][-4:].rjust(len(session['phone']), '*')  # Маскируем номер
         }
     
     def cleanup_expired_sessions(self) -> int:
         """
-        Удаляет истекшие сессии
-        Возвращает количество удаленных сессий
+        Истекшие сессии удаляет само хранилище (TTL), ручная очистка не нужна.
+        Оставлено для совместимости, возвращает 0.
         """
-        expired_count = 0
-        current_time = datetime.now()
-        
-        # Создаем список ключей для удаления
-        to_delete = []
-        for session_id, session in self.sessions.items():
-            if current_time > session['expires_at']:
-                to_delete.append(session_id)
-        
-        # Удаляем истекшие сессии
-        for session_id in to_delete:
-            del self.sessions[session_id]
-            expired_count += 1
-        
-        if expired_count > 0:
-            logger.info(f"🧹 Удалено {expired_count} истекших сессий")
-        
-        return expired_count
+        return 0
     
     async def _send_code_to_telegram(self, telegram_id: int, code: str):
         if not self.bot_token:
@@ -250,15 +223,9 @@ class TelegramAuthService:
             return
             
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"https://api.telegram.org/bot{self.bot_token}/sendMessage",
-                    json={
-                        'chat_id': telegram_id,
-                        'text': f"Код подтверждения: {code}",
-                        'parse_mode': 'HTML'
-                    }
-                )
+            # Через очередь бота: учитывает лимиты Telegram, коды идут раньше уведомлений
+            if not await send_telegram_message(telegram_id, f"Код подтверждения: {code}", PRIORITY_CODE, parse_mode='HTML'):
+                logger.error(f"Очередь сообщений Telegram переполнена, код для {telegram_id} не отправлен")
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения в Telegram: {e}")
     
@@ -271,23 +238,8 @@ class TelegramAuthService:
         return phone
     
     def cleanup_expired_codes(self):
-        now = datetime.now()
-        expired_phones = []
-        
-        for phone, data in self.codes_storage.items():
-            if now - data['created_at'] > timedelta(seconds=self.code_expiry):
-                expired_phones.append(phone)
-        
-        for phone in expired_phones:
-            del self.codes_storage[phone]
-            
-        expired_sessions = []
-        for phone, data in self.phone_tg_mapping.items():
-            if now - data['created_at'] > timedelta(minutes=5):
-                expired_sessions.append(phone)
-                
-        for phone in expired_sessions:
-            del self.phone_tg_mapping[phone]
+        """Коды истекают в хранилище сами (TTL); оставлено для совместимости"""
+        return 0
 
     async def initiate_auth(self, phone: str) -> TelegramAuthResponse:
         """
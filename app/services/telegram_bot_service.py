@@ -3,7 +3,6 @@ import logging
 from typing import Dict, Optional, Any
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
-import aiohttp
 import random
 import string
 from datetime import datetime, timedelta
@@ -11,9 +10,13 @@ from datetime import datetime, timedelta
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.error import Conflict, Forbidden, BadRequest, TimedOut, NetworkError
+from starlette.concurrency import run_in_threadpool
 
 from config import settings
 from app.services.telegram_auth_service import telegram_auth_service
+from app.utils.code_store import save_verification_code, verify_and_consume_code
+from app.utils.http_clients import http_clients, redact
+from app.services.telegram_outbox import send_telegram_message, PRIORITY_CODE
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +36,7 @@ class TelegramBotService:
         self.bot_token = settings.TELEGRAM_BOT_TOKEN
         self.bot_username = settings.TELEGRAM_BOT_USERNAME
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
-        self.codes_storage = {}  # Временное хранилище кодов (в продакшене использовать Redis)
+        # Коды подтверждения - в общем хранилище кодов (app.utils.code_store)
         
     async def start_bot(self):
         if not settings.TELEGRAM_BOT_TOKEN:
@@ -198,39 +201,27 @@ class TelegramBotService:
             # Генерируем код
             code = self.generate_code()
             
-            # Сохраняем код с временной меткой
-            self.codes_storage[phone] = {
-                'code': code,
-                'timestamp': datetime.now(),
-                'chat_id': chat_id
-            }
+            # Сохраняем код, срок действия задает хранилище
+            await run_in_threadpool(save_verification_code, phone, code, chat_id=chat_id)
             
-            # Если у нас есть chat_id, отправляем сообщение напрямую
+            # Если у нас есть chat_id, отправляем сообщение
             if chat_id:
                 message = f"🔐 Ваш код подтверждения: {code}\n\nКод действителен 5 минут."
                 
-                url = f"{self.base_url}/sendMessage"
-                payload = {
-                    'chat_id': chat_id,
-                    'text': message,
-                    'parse_mode': 'HTML'
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=payload) as response:
-                        if response.status == 200:
-                            return SMSResult(
-                                success=True,
-                                message=f"SMS код отправлен в Telegram: {code}",
-                                code=code,
-                                data={'chat_id': chat_id}
-                            )
-                        else:
-                            logger.error(f"Ошибка отправки в Telegram: {response.status}")
-                            return SMSResult(
-                                success=False,
-                                message="Ошибка отправки в Telegram"
-                            )
+                # Через очередь бота: учитывает лимиты Telegram, коды идут раньше уведомлений
+                if await send_telegram_message(int(chat_id), message, PRIORITY_CODE, parse_mode='HTML'):
+                    return SMSResult(
+                        success=True,
+                        message=f"SMS код отправлен в Telegram: {code}",
+                        code=code,
+                        data={'chat_id': chat_id}
+                    )
+                else:
+                    logger.error("Ошибка отправки в Telegram: очередь сообщений переполнена")
+                    return SMSResult(
+                        success=False,
+                        message="Ошибка отправки в Telegram"
+                    )
             else:
                 # Если нет chat_id, возвращаем код для отображения (для тестирования)
                 return SMSResult(
@@ -251,23 +242,8 @@ class TelegramBotService:
         """
         Проверка кода подтверждения
         """
-        if phone not in self.codes_storage:
-            return False
-        
-        stored_data = self.codes_storage[phone]
-        
-        # Проверяем, не истек ли код (5 минут)
-        if datetime.now() - stored_data['timestamp'] > timedelta(minutes=5):
-            del self.codes_storage[phone]
-            return False
-        
-        # Проверяем код
-        if stored_data['code'] == code:
-            # Удаляем код после успешной проверки
-            del self.codes_storage[phone]
-            return True
-        
-        return False
+        # Истекшие коды удаляет хранилище, верный код удаляется сразу после проверки
+        return verify_and_consume_code(phone, code)
     
     async def get_bot_info(self) -> Dict[str, Any]:
         """
@@ -275,15 +251,13 @@ class TelegramBotService:
         """
         try:
             url = f"{self.base_url}/getMe"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data
-                    else:
-                        return {"error": f"HTTP {response.status}"}
+            response = await http_clients.request("telegram", "GET", url)
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return {"error": f"HTTP {response.status_code}"}
         except Exception as e:
-            return {"error": str(e)}
+            return {"error": redact(str(e))}
 
 # Создаем глобальный экземпляр сервиса
 telegram_bot_service = TelegramBotService() 
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Запуск процесса Telegram бота из веб-воркеров.
+
+Каждый воркер при старте пытается взять файловую блокировку; получивший ее
+запускает `python telegram_bot.py` и перезапускает процесс, если тот упал
+(с растущей задержкой). Остальные воркеры периодически повторяют попытку и
+подхватывают процесс, если воркер-владелец завершится. Сам процесс бота
+держит собственную блокировку, поэтому поллер всегда один.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+class BotSupervisor:
+    def __init__(self, command: List[str], lock_path: str, restart_delay: float = 1.0,
+                 max_restart_delay: float = 30.0, stable_seconds: float = 60.0,
+                 poll_seconds: float = 5.0, stop_timeout: float = 10.0):
+        self.command = command
+        self.lock_path = lock_path
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_seconds = stable_seconds
+        self.poll_seconds = poll_seconds
+        self.stop_timeout = stop_timeout
+
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.starts = 0
+        self.last_exit_code: Optional[int] = None
+
+    def _acquire_lock(self) -> bool:
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _release_lock(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            if self._acquire_lock():
+                logger.info(f"🤖 Воркер {os.getpid()} запускает процесс Telegram бота")
+                await self._supervise()
+            else:
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _supervise(self):
+        delay = self.restart_delay
+        while not self._stopping:
+            started_at = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.command, cwd=str(PROJECT_ROOT))
+            self.starts += 1
+            self.last_exit_code = await self.process.wait()
+            if self._stopping:
+                break
+
+            if time.monotonic() - started_at >= self.stable_seconds:
+                delay = self.restart_delay
+            logger.warning(
+                f"⚠️ Процесс Telegram бота завершился с кодом {self.last_exit_code}, перезапуск через {delay:.0f} с"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    async def close(self):
+        self._stopping = True
+        process = self.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.stop_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Процесс Telegram бота не остановился, завершаем принудительно")
+                process.kill()
+                await process.wait()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._release_lock()
+
+    def stats(self) -> Dict[str, Any]:
+        running = self.process is not None and self.process.returncode is None
+        return {
+            "supervisor": self._lock_file is not None,
+            "pid": self.process.pid if running else None,
+            "starts": self.starts,
+            "last_exit_code": self.last_exit_code,
+        }
+
+
+bot_supervisor = BotSupervisor(
+    [sys.executable, str(PROJECT_ROOT / "telegram_bot.py")],
+    settings.TELEGRAM_BOT_IPC_PATH + ".supervisor.lock",
+)
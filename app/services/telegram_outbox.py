@@ -0,0 +1,356 @@
+"""
+Очередь исходящих сообщений Telegram с учетом ограничений Bot API.
+
+Telegram отвечает 429 (с retry_after), если боту отправлять больше ~30
+сообщений в секунду всего и больше ~1 в секунду в один чат. Все сообщения
+бота идут через одну очередь:
+- общий и по-чатовый token bucket - сообщение уходит, только когда есть токены;
+- две полосы: коды подтверждения всегда раньше уведомлений, при переполнении
+  очереди код вытесняет самое старое уведомление;
+- 429 - чат (или вся очередь при retry_after от автомата провайдера) ждет
+  указанное время, сообщение остается первым в очереди; сетевые ошибки и 5xx -
+  повтор с растущей задержкой; сообщения старше TELEGRAM_OUTBOX_MAX_AGE_SECONDS
+  (код уже истек) не отправляются;
+- сообщения одного чата уходят по порядку.
+
+Очередь работает в процессе бота (один на все воркеры, поэтому общий лимит
+соблюдается). Веб-воркеры ставят сообщения через send_telegram_message -
+по IPC сокету, а без отдельного процесса бота - в очередь своего процесса.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from app.utils.http_clients import http_clients, ProviderUnavailable, redact
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CODE = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_NAMES = {PRIORITY_CODE: "code", PRIORITY_NOTIFICATION: "notification"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_delay(self, now: float) -> float:
+        """Через сколько секунд появится целый токен (0 - уже есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "text", "priority", "parse_mode", "attempts", "enqueued_at", "not_before", "future")
+
+    def __init__(self, chat_id: int, text: str, priority: int, parse_mode: Optional[str], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.parse_mode = parse_mode
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0
+        self.future = future
+
+
+async def send_via_bot_api(message: OutboundMessage) -> httpx.Response:
+    payload = {"chat_id": message.chat_id, "text": message.text}
+    if message.parse_mode:
+        payload["parse_mode"] = message.parse_mode
+    return await http_clients.request(
+        "telegram", "POST", f"/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage", json=payload
+    )
+
+
+def get_retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after"))
+    except Exception:
+        return float(response.headers.get("Retry-After") or 1)
+
+
+class TelegramOutbox:
+    # Сколько сообщений полосы просматривается в поиске чата, у которого есть токен
+    SCAN_LIMIT = 200
+
+    def __init__(self, send: Callable[[OutboundMessage], Awaitable[httpx.Response]] = send_via_bot_api,
+                 global_rate: float = 25.0, global_burst: float = 5, chat_rate: float = 1.0, chat_burst: float = 3,
+                 queue_size: int = 5000, concurrency: int = 8, max_attempts: int = 5,
+                 max_age: float = 300.0):
+        self.send_func = send
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+
+        self._lanes: List[Deque[OutboundMessage]] = [deque(), deque()]
+        # Небольшой запас на всплеск: за любую секунду уходит не больше global_rate + global_burst
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_paused_until: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._in_flight: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = time.monotonic()
+
+        self.counters = {
+            "enqueued": 0, "sent": 0, "failed": 0, "dropped": 0, "expired": 0, "retried": 0, "rate_limited": 0,
+        }
+        # Полоса -> [отправлено, суммарное ожидание, максимальное ожидание]
+        self._latency = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def enqueue(self, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+                parse_mode: Optional[str] = None) -> Optional[asyncio.Future]:
+        """
+        Ставит сообщение в очередь. Возвращает future с результатом доставки (True/False)
+        или None, если очередь заполнена.
+        """
+        self._ensure_started()
+        if self._queued() >= self.queue_size:
+            # Код важнее уведомления: вытесняем самое старое уведомление
+            notifications = self._lanes[PRIORITY_NOTIFICATION]
+            if priority == PRIORITY_CODE and notifications:
+                self._finish(notifications.popleft(), False, "dropped")
+            else:
+                self.counters["dropped"] += 1
+                logger.warning(f"⚠️ Очередь Telegram заполнена ({self.queue_size}), сообщение в чат {chat_id} отброшено")
+                return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(OutboundMessage(int(chat_id), text, priority, parse_mode, future))
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+                   parse_mode: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Ставит сообщение в очередь и ждет доставки"""
+        future = self.enqueue(chat_id, text, priority, parse_mode)
+        if future is None:
+            return False
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _pick(self, now: float) -> Tuple[Optional[OutboundMessage], Optional[float]]:
+        """Первое готовое сообщение (коды раньше уведомлений) или через сколько секунд ждать"""
+        wait = None
+        for lane in self._lanes:
+            seen = set()
+            for index, message in enumerate(lane):
+                if index >= self.SCAN_LIMIT:
+                    wait = 0.05 if wait is None else min(wait, 0.05)
+                    break
+                if now - message.enqueued_at > self.max_age:
+                    del lane[index]
+                    self._finish(message, False, "expired")
+                    return None, 0.0
+                # Следующие сообщения чата ждут предыдущее, порядок сохраняется
+                if message.chat_id in seen or message.chat_id in self._in_flight:
+                    seen.add(message.chat_id)
+                    continue
+                seen.add(message.chat_id)
+                delay = max(
+                    message.not_before - now,
+                    self._chat_paused_until.get(message.chat_id, 0.0) - now,
+                    self._get_chat_bucket(message.chat_id).get_delay(now),
+                )
+                if delay <= 0:
+                    del lane[index]
+                    return message, None
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            now = time.monotonic()
+            self._prune(now)
+            wait = max(self._paused_until - now, self._global_bucket.get_delay(now))
+            message = None
+            if wait <= 0:
+                message, wait = self._pick(now)
+
+            if message is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await semaphore.acquire()
+            now = time.monotonic()
+            self._global_bucket.consume(now)
+            self._get_chat_bucket(message.chat_id).consume(now)
+            self._in_flight.add(message.chat_id)
+            task = asyncio.get_running_loop().create_task(self._deliver(message))
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _deliver(self, message: OutboundMessage):
+        message.attempts += 1
+        try:
+            response = await self.send_func(message)
+        except ProviderUnavailable as e:
+            # Автомат провайдера открыт: ждет вся очередь
+            self._paused_until = time.monotonic() + e.retry_after
+            self._retry(message, 0.0, count_attempt=False)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка отправки в Telegram чат {message.chat_id}: {redact(str(e))}")
+            self._retry(message, min(2 ** message.attempts, 60))
+            return
+        finally:
+            self._in_flight.discard(message.chat_id)
+            self._wakeup.set()
+
+        if response.status_code == 200:
+            self._finish(message, True, "sent")
+        elif response.status_code == 429:
+            retry_after = get_retry_after(response)
+            self.counters["rate_limited"] += 1
+            self._chat_paused_until[message.chat_id] = time.monotonic() + retry_after
+            logger.warning(f"⚠️ Telegram 429 для чата {message.chat_id}, повтор через {retry_after:.0f} с")
+            self._retry(message, 0.0, count_attempt=False)
+        elif response.status_code >= 500:
+            self._retry(message, min(2 ** message.attempts, 60))
+        else:
+            # 400 (чат не найден), 403 (бот заблокирован) - повтор не поможет
+            logger.error(f"❌ Telegram отклонил сообщение в чат {message.chat_id}: {response.status_code} {response.text}")
+            self._finish(message, False, "failed")
+
+    def _retry(self, message: OutboundMessage, delay: float, count_attempt: bool = True):
+        if not count_attempt:
+            message.attempts -= 1
+        if message.attempts >= self.max_attempts:
+            self._finish(message, False, "failed")
+            return
+        self.counters["retried"] += 1
+        message.not_before = time.monotonic() + delay
+        # Первым в своей полосе: сообщения этого чата не обгонят его
+        self._lanes[message.priority].appendleft(message)
+        self._wakeup.set()
+
+    def _finish(self, message: OutboundMessage, delivered: bool, counter: str):
+        self.counters[counter] += 1
+        if delivered:
+            latency = self._latency[message.priority]
+            waited = time.monotonic() - message.enqueued_at
+            latency[0] += 1
+            latency[1] += waited
+            latency[2] = max(latency[2], waited)
+        if not message.future.done():
+            message.future.set_result(delivered)
+
+    def _prune(self, now: float):
+        # Полные ведра и истекшие паузы простаивающих чатов не нужны
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+        for chat_id in [chat_id for chat_id, until in self._chat_paused_until.items() if until <= now]:
+            del self._chat_paused_until[chat_id]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for lane in self._lanes:
+            while lane:
+                message = lane.popleft()
+                if not message.future.done():
+                    message.future.set_result(False)
+
+    def stats(self) -> Dict[str, Any]:
+        result = dict(self.counters)
+        result["queued"] = {PRIORITY_NAMES[priority]: len(lane) for priority, lane in enumerate(self._lanes)}
+        result["in_flight"] = len(self._in_flight)
+        result["latency"] = {
+            PRIORITY_NAMES[priority]: {
+                "avg": round(total / count, 3) if count else 0,
+                "max": round(maximum, 3),
+            }
+            for priority, (count, total, maximum) in self._latency.items()
+        }
+        return result
+
+
+telegram_outbox = TelegramOutbox(
+    global_rate=settings.TELEGRAM_OUTBOX_GLOBAL_RATE,
+    chat_rate=settings.TELEGRAM_OUTBOX_CHAT_RATE,
+    chat_burst=settings.TELEGRAM_OUTBOX_CHAT_BURST,
+    queue_size=settings.TELEGRAM_OUTBOX_QUEUE_SIZE,
+    max_attempts=settings.TELEGRAM_OUTBOX_MAX_ATTEMPTS,
+    max_age=settings.TELEGRAM_OUTBOX_MAX_AGE_SECONDS,
+)
+
+_bot_client = None
+
+
+async def send_telegram_message(chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+                                parse_mode: Optional[str] = None) -> bool:
+    """
+    Ставит сообщение в очередь процесса бота (через IPC), а если бот работает
+    в этом процессе или недоступен - в очередь этого процесса. True - сообщение принято.
+    """
+    global _bot_client
+    if settings.TELEGRAM_BOT_MODE in ("process", "external") and not settings.TELEGRAM_BOT_PROCESS:
+        from starlette.concurrency import run_in_threadpool
+        from app.utils.bot_ipc import BotIPCClient, BotIPCError, BotIPCTimeout
+        if _bot_client is None:
+            _bot_client = BotIPCClient(settings.TELEGRAM_BOT_IPC_PATH, timeout=settings.TELEGRAM_BOT_IPC_TIMEOUT_SECONDS)
+        try:
+            # Ожидание ответа бота - в пуле потоков, event loop веб-воркера не блокируется
+            return await run_in_threadpool(_bot_client.call, "send_message", chat_id, text, priority, parse_mode)
+        except BotIPCTimeout as e:
+            # Бот мог уже поставить сообщение в очередь - отправка этим процессом продублировала бы его
+            logger.warning(f"⚠️ {e}, сообщение в чат {chat_id} повторно не отправляется")
+            return False
+        except BotIPCError as e:
+            logger.warning(f"⚠️ Очередь процесса бота недоступна ({e}), сообщение отправит этот процесс")
+    return telegram_outbox.enqueue(chat_id, text, priority, parse_mode) is not None
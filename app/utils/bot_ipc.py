@@ -0,0 +1,167 @@
+"""
+Связь веб-воркеров с процессом Telegram бота через Unix сокет.
+
+Бот работает в отдельном процессе (telegram_bot.py): один поллер на все
+воркеры. Если AUTH_CODE_STORE_URL не задан, коды подтверждения и сессии
+Telegram авторизации хранятся в памяти процесса бота, а веб-воркеры читают,
+создают и проверяют их через code_store.IPCCodeStore - тот же интерфейс CodeStore,
+поэтому обработчики не знают, где лежат коды.
+
+Протокол - JSON строки: запрос {"op": "get", "args": [...]}, ответ
+{"result": ...} или {"error": "..."}. Операции выполняются по одной на
+соединение, у каждого потока воркера свое соединение.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Операции CodeStore, которые процесс бота выполняет для веб-воркеров
+CODE_STORE_OPS = ("get", "set", "set_if_absent", "update", "pop_if", "delete", "ttl", "count")
+
+
+class BotIPCError(Exception):
+    """Процесс бота недоступен или вернул ошибку"""
+
+
+class BotIPCTimeout(BotIPCError):
+    """Процесс бота не ответил вовремя: запрос мог быть выполнен"""
+
+
+class BotIPCServer:
+    """Сервер в процессе бота: op -> обработчик (обычная или async функция)"""
+
+    def __init__(self, path: str, handlers: Dict[str, Callable]):
+        self.path = path
+        self.handlers = handlers
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self):
+        # Сокет от прошлого запуска остается файлом; единственность процесса гарантирует блокировка бота
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"🔌 IPC сокет бота: {self.path}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(await self._dispatch(line))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _dispatch(self, line: bytes) -> bytes:
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            handler = self.handlers.get(request.get("op"))
+            if handler is None:
+                raise BotIPCError(f"Unknown operation: {request.get('op')}")
+            result = handler(*request.get("args", []))
+            if inspect.isawaitable(result):
+                result = await result
+            response = {"result": result}
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Ошибка IPC операции: {e}")
+            response = {"error": str(e)}
+        return (json.dumps(response, ensure_ascii=False, default=str) + "\n").encode()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Открытые соединения воркеров закрываются, иначе wait_closed их ждет
+            tasks = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "errors": self.errors}
+
+
+class BotIPCClient:
+    """
+    Синхронный клиент (как и RedisCodeStore): вызов ждет ответа бота до timeout
+    секунд, поэтому из async кода - только через run_in_threadpool
+    """
+
+    def __init__(self, path: str, timeout: float = 2.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise BotIPCError(f"Процесс Telegram бота недоступен ({self.path}): {e}") from e
+        connection = (sock, sock.makefile("rb"))
+        self._local.connection = connection
+        return connection
+
+    def _disconnect(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def call(self, op: str, *args) -> Any:
+        payload = (json.dumps({"op": op, "args": args}, ensure_ascii=False, default=str) + "\n").encode()
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            fresh = connection is None
+            sock, reader = connection if connection is not None else self._connect()
+            try:
+                sock.sendall(payload)
+                line = reader.readline()
+            except socket.timeout as e:
+                # Запрос мог выполниться: не повторяем (pop_if нельзя выполнить дважды)
+                self._disconnect()
+                raise BotIPCTimeout(f"Процесс Telegram бота не ответил за {self.timeout} с") from e
+            except OSError:
+                line = b""
+            if line:
+                break
+            # Соединение закрыто процессом бота (перезапуск) - запрос до него не дошел
+            self._disconnect()
+            if fresh or attempt:
+                raise BotIPCError("Процесс Telegram бота закрыл соединение")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise BotIPCError(response["error"])
+        return response["result"]
+
+    def close(self):
+        self._disconnect()
+
+
+def get_code_store_handlers(store) -> Dict[str, Callable]:
+    return {op: getattr(store, op) for op in CODE_STORE_OPS}
@@ -0,0 +1,71 @@
+import re
+from html import escape
+from typing import List
+
+# Символы операторов BOOLEAN MODE, которые нельзя передавать из пользовательского ввода
+_BOOLEAN_OPERATORS = re.compile(r'[+\-<>()~*"@]+')
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+MAX_TERMS = 10
+SNIPPET_RADIUS = 60
+
+
+def get_search_terms(query: str) -> List[str]:
+    """Слова поискового запроса без операторов и повторов (не больше MAX_TERMS)"""
+    terms = []
+    for term in _WORD.findall(_BOOLEAN_OPERATORS.sub(" ", query or "").lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def build_boolean_query(terms: List[str]) -> str:
+    """
+    Запрос для MATCH ... AGAINST (... IN BOOLEAN MODE): все слова обязательны,
+    каждое ищется по префиксу (окончания в русском языке меняются)
+    """
+    return " ".join(f"+{term}*" for term in terms)
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def highlight(content: str, terms: List[str], radius: int = SNIPPET_RADIUS) -> str:
+    """
+    Фрагмент текста вокруг первого совпадения с подсветкой слов в <mark>.
+    Текст экранируется, поэтому результат можно вставлять как HTML.
+    """
+    content = content or ""
+    if not terms:
+        return escape(content[:radius * 2])
+
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - radius) if first else 0
+    end = min(len(content), (first.end() if first else 0) + radius)
+    # Не режем слова на границах фрагмента
+    if start > 0:
+        space = content.find(" ", start)
+        if space != -1 and space < (first.start() if first else end):
+            start = space + 1
+    if end < len(content):
+        space = content.rfind(" ", start, end)
+        if space != -1 and (not first or space > first.end()):
+            end = space
+
+    fragment = content[start:end]
+    parts = []
+    position = 0
+    for match in pattern.finditer(fragment):
+        parts.append(escape(fragment[position:match.start()]))
+        parts.append(f"<mark>{escape(match.group(0))}</mark>")
+        position = match.end()
+    parts.append(escape(fragment[position:]))
+
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "…" + snippet
+    if end < len(content):
+        snippet = snippet + "…"
+    return snippet
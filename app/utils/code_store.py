@@ -0,0 +1,340 @@
+"""
+Хранилище кодов подтверждения и сессий авторизации с автоматическим истечением.
+
+Используется и HTTP обработчиками, и Telegram ботом вместо verification_codes.json:
+- get/set - O(1), значения - JSON-совместимые словари;
+- истечение по TTL (в памяти - через колесо таймеров, без периодической очистки);
+- pop_if - атомарная проверка и удаление (код можно использовать только один раз).
+
+MemoryCodeStore - в памяти одного процесса (по умолчанию - процесса бота, веб-воркеры
+обращаются к нему через app.utils.bot_ipc), RedisCodeStore - общий для всех
+воркеров и процесса бота (AUTH_CODE_STORE_URL=redis://...).
+"""
+import json
+import math
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import settings
+
+CODE_KEY_PREFIX = "code:"
+# Код, сгенерированный при открытии страницы, бот и страница переиспользуют это время
+CODE_REUSE_SECONDS = 120
+
+
+class CodeStore(ABC):
+    """Базовый интерфейс хранилища"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: int) -> Tuple[Dict[str, Any], bool]:
+        """Сохраняет значение, если ключа нет. Возвращает (текущее значение, сохранено ли новое)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, key: str, value: Dict[str, Any]) -> bool:
+        """Заменяет значение, сохраняя оставшийся TTL. False - ключа нет"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def pop_if(self, key: str, field: str, expected: Any) -> Optional[Dict[str, Any]]:
+        """Атомарно удаляет значение, если value[field] == expected, и возвращает его"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def ttl(self, key: str) -> Optional[int]:
+        """Сколько секунд осталось жить ключу (None - ключа нет)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, prefix: str) -> int:
+        """Число живых ключей с префиксом (для статуса, не для горячего пути)"""
+        raise NotImplementedError
+
+
+class MemoryCodeStore(CodeStore):
+    """
+    Хранилище в памяти процесса. Истечение - колесо таймеров с секундными слотами:
+    ключ попадает в слот своего момента истечения, и при каждом обращении
+    обрабатываются только слоты, прошедшие с прошлого обращения.
+    """
+
+    WHEEL_SLOTS = 3600
+
+    def __init__(self):
+        # ключ -> (момент истечения по time.monotonic, значение в JSON)
+        self._data: Dict[str, Tuple[float, str]] = {}
+        self._wheel: List[Set[str]] = [set() for _ in range(self.WHEEL_SLOTS)]
+        self._cursor = int(time.monotonic())
+        # Бот и обработчики могут обращаться из разных потоков
+        self._lock = threading.RLock()
+
+    def _advance(self, now: float):
+        current = int(now)
+        # Если обращений не было дольше оборота колеса, достаточно пройти его один раз
+        start = max(self._cursor + 1, current - self.WHEEL_SLOTS + 1)
+        for tick in range(start, current + 1):
+            slot = self._wheel[tick % self.WHEEL_SLOTS]
+            if not slot:
+                continue
+            for key in list(slot):
+                entry = self._data.get(key)
+                if entry is None or entry[0] <= now:
+                    self._data.pop(key, None)
+                    slot.discard(key)
+                elif int(entry[0]) % self.WHEEL_SLOTS != tick % self.WHEEL_SLOTS:
+                    # Ключ перезаписан с другим сроком и уже стоит в своем слоте
+                    slot.discard(key)
+        self._cursor = max(self._cursor, current)
+
+    def _get_entry(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def _put(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._data[key] = (expires_at, json.dumps(value, ensure_ascii=False, default=str))
+        self._wheel[int(expires_at) % self.WHEEL_SLOTS].add(key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            entry = self._get_entry(key, now)
+            return json.loads(entry[1]) if entry else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int):
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            self._put(key, value, now + ttl)
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: int) -> Tuple[Dict[str, Any], bool]:
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            entry = self._get_entry(key, now)
+            if entry:
+                return json.loads(entry[1]), False
+            self._put(key, value, now + ttl)
+            return value, True
+
+    def update(self, key: str, value: Dict[str, Any]) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            if not entry:
+                return False
+            self._put(key, value, entry[0])
+            return True
+
+    def pop_if(self, key: str, field: str, expected: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            entry = self._get_entry(key, now)
+            if not entry:
+                return None
+            value = json.loads(entry[1])
+            if value.get(field) != expected:
+                return None
+            del self._data[key]
+            return value
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def ttl(self, key: str) -> Optional[int]:
+        with self._lock:
+            now = time.monotonic()
+            entry = self._get_entry(key, now)
+            return max(0, math.ceil(entry[0] - now)) if entry else None
+
+    def count(self, prefix: str) -> int:
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            return sum(1 for key, (expires_at, _) in self._data.items() if key.startswith(prefix) and expires_at > now)
+
+
+class RedisCodeStore(CodeStore):
+    """Хранилище в Redis: TTL ключей, SET NX и WATCH/MULTI для проверки с удалением"""
+
+    def __init__(self, url: str, prefix: str = "auth:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    @staticmethod
+    def _dump(value: Dict[str, Any]) -> str:
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self._client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int):
+        self._client.set(self._key(key), self._dump(value), ex=ttl)
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: int) -> Tuple[Dict[str, Any], bool]:
+        for _ in range(3):
+            if self._client.set(self._key(key), self._dump(value), ex=ttl, nx=True):
+                return value, True
+            current = self.get(key)
+            # Ключ мог истечь между SET NX и GET - тогда пробуем снова
+            if current is not None:
+                return current, False
+        return value, False
+
+    def update(self, key: str, value: Dict[str, Any]) -> bool:
+        return bool(self._client.set(self._key(key), self._dump(value), xx=True, keepttl=True))
+
+    def pop_if(self, key: str, field: str, expected: Any) -> Optional[Dict[str, Any]]:
+        redis_key = self._key(key)
+
+        def check_and_delete(pipe):
+            raw = pipe.get(redis_key)
+            if raw is None:
+                return None
+            value = json.loads(raw)
+            if value.get(field) != expected:
+                return None
+            pipe.multi()
+            pipe.delete(redis_key)
+            return value
+
+        # Если ключ изменился между GET и DEL, транзакция повторяется
+        return self._client.transaction(check_and_delete, redis_key, value_from_callable=True)
+
+    def delete(self, key: str) -> bool:
+        return bool(self._client.delete(self._key(key)))
+
+    def ttl(self, key: str) -> Optional[int]:
+        seconds = self._client.ttl(self._key(key))
+        return seconds if seconds is not None and seconds >= 0 else None
+
+    def count(self, prefix: str) -> int:
+        return sum(1 for _ in self._client.scan_iter(match=f"{self._key(prefix)}*", count=500))
+
+
+class IPCCodeStore(CodeStore):
+    """Хранилище в памяти процесса Telegram бота, запросы через Unix сокет (app.utils.bot_ipc)"""
+
+    def __init__(self, path: str, timeout: float = 2.0):
+        from app.utils.bot_ipc import BotIPCClient
+        self.client = BotIPCClient(path, timeout=timeout)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.client.call("get", key)
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int):
+        self.client.call("set", key, value, ttl)
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: int) -> Tuple[Dict[str, Any], bool]:
+        current, created = self.client.call("set_if_absent", key, value, ttl)
+        return current, created
+
+    def update(self, key: str, value: Dict[str, Any]) -> bool:
+        return self.client.call("update", key, value)
+
+    def pop_if(self, key: str, field: str, expected: Any) -> Optional[Dict[str, Any]]:
+        return self.client.call("pop_if", key, field, expected)
+
+    def delete(self, key: str) -> bool:
+        return self.client.call("delete", key)
+
+    def ttl(self, key: str) -> Optional[int]:
+        return self.client.call("ttl", key)
+
+    def count(self, prefix: str) -> int:
+        return self.client.call("count", prefix)
+
+
+def create_code_store(url: Optional[str] = None) -> CodeStore:
+    """
+    Хранилище по настройке AUTH_CODE_STORE_URL: redis://... или пусто - в памяти.
+    Если бот работает отдельным процессом, память - его: веб-воркеры обращаются к ней через сокет.
+    """
+    url = url if url is not None else settings.AUTH_CODE_STORE_URL
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCodeStore(url, prefix=settings.AUTH_CODE_STORE_PREFIX)
+    if settings.TELEGRAM_BOT_MODE in ("process", "external") and not settings.TELEGRAM_BOT_PROCESS:
+        return IPCCodeStore(settings.TELEGRAM_BOT_IPC_PATH, timeout=settings.TELEGRAM_BOT_IPC_TIMEOUT_SECONDS)
+    return MemoryCodeStore()
+
+
+code_store = create_code_store()
+
+
+# --- Коды подтверждения телефона ---
+
+def normalize_code_phone(phone: str) -> str:
+    """Телефон в формате +XXXXXXXX, как его сохраняют страница и бот"""
+    phone = str(phone).strip()
+    return phone if phone.startswith('+') else '+' + phone
+
+
+def get_code_ttl() -> int:
+    return settings.TELEGRAM_CODE_EXPIRY_MINUTES * 60
+
+
+def generate_verification_code() -> str:
+    return ''.join(random.choices('0123456789', k=4))
+
+
+def save_verification_code(phone: str, code: str, **extra) -> None:
+    """Сохраняет код для телефона (заменяя прежний)"""
+    value = {'code': code, 'created_at': time.time()}
+    value.update(extra)
+    code_store.set(CODE_KEY_PREFIX + normalize_code_phone(phone), value, get_code_ttl())
+
+
+def get_verification_code(phone: str) -> Optional[Dict[str, Any]]:
+    return code_store.get(CODE_KEY_PREFIX + normalize_code_phone(phone))
+
+
+def get_or_create_verification_code(phone: str, reuse_seconds: int = CODE_REUSE_SECONDS, **extra) -> Tuple[str, int, bool]:
+    """
+    Возвращает (код, сколько секунд он еще показывается как действующий, новый ли он).
+    Код младше reuse_seconds переиспользуется, иначе создается новый.
+    """
+    key = CODE_KEY_PREFIX + normalize_code_phone(phone)
+    value = {'code': generate_verification_code(), 'created_at': time.time()}
+    value.update(extra)
+
+    current, created = code_store.set_if_absent(key, value, get_code_ttl())
+    if not created:
+        age = time.time() - current.get('created_at', 0)
+        if age <= reuse_seconds:
+            return current['code'], reuse_seconds - int(age), False
+        code_store.set(key, value, get_code_ttl())
+    return value['code'], reuse_seconds, True
+
+
+def verify_and_consume_code(phone: str, code: str) -> bool:
+    """Проверяет код и сразу удаляет его: повторно тот же код не пройдет"""
+    return code_store.pop_if(CODE_KEY_PREFIX + normalize_code_phone(phone), 'code', str(code).strip()) is not None
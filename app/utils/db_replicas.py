@@ -0,0 +1,256 @@
+"""
+Чтение с реплик БД.
+
+Если заданы DATABASE_REPLICA_URLS, сессии (SessionLocal и AsyncSessionLocal)
+отправляют чтения на реплики по кругу, а все, что пишет, - на основную БД
+(DATABASE_URL):
+- flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE и сырой text() идут в
+  основную БД, после этого сессия до закрытия читает только из нее
+  (read-your-writes внутри запроса);
+- запрос, который что-то записал, ставит cookie на DB_REPLICA_MAX_LAG_SECONDS:
+  следующие запросы этого клиента (например, страница после redirect) тоже
+  читают из основной БД (ReadYourWritesMiddleware);
+- отставание реплик проверяется фоном каждые DB_REPLICA_CHECK_SECONDS;
+  реплика с отставанием больше DB_REPLICA_MAX_LAG_SECONDS, с остановленной
+  репликацией или с ошибкой соединения выводится из ротации до следующей
+  успешной проверки. Без живых реплик все читается из основной БД.
+
+Обработчику, которому нужны свежие данные без записи, достаточно вызвать
+use_primary(db) до первого запроса. Так сделано для чатов: сообщения пишутся
+через WebSocket (без cookie), поэтому запись сообщений и отметок о прочтении
+и HTTP эндпоинты чатов всегда работают с основной БД.
+
+Локально: DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db - две SQLite базы,
+чтения видны по отсутствию данных, записанных только в основную.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Ключ session.info: сессия читает только из основной БД
+USE_PRIMARY = "use_primary"
+
+# Cookie read-your-writes: до какого времени (unix) клиент читает из основной БД
+PRIMARY_COOKIE = "db_primary_until"
+
+# Состояние текущего HTTP запроса: {"primary": читать из основной, "wrote": запрос писал}
+_request_routing: ContextVar[Optional[Dict[str, bool]]] = ContextVar("db_request_routing", default=None)
+
+
+def use_primary(db) -> None:
+    """Все запросы сессии (Session или AsyncSession) - в основную БД"""
+    db.info[USE_PRIMARY] = True
+
+
+def is_write(clause) -> bool:
+    if clause is None or isinstance(clause, (UpdateBase, TextClause)):
+        return True
+    return getattr(clause, "_for_update_arg", None) is not None
+
+
+class Replica:
+    def __init__(self, name: str, engine: Engine, async_engine=None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        # До первой проверки реплика считается живой: процессы без фоновой
+        # проверки (скрипты, бот) тоже читают с реплик, ошибки соединения выводят ее из ротации
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.reads = 0
+
+        for sync_engine in (engine, async_engine.sync_engine if async_engine is not None else None):
+            if sync_engine is not None:
+                event.listen(sync_engine, "handle_error", self._on_error)
+
+    def get_engine(self, async_mode: bool) -> Engine:
+        # Сессия внутри AsyncSession синхронная и работает с sync_engine async движка
+        return self.async_engine.sync_engine if async_mode else self.engine
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(f"{type(context.original_exception).__name__}: {context.original_exception}")
+
+    def mark_down(self, error: str):
+        if self.healthy:
+            logger.warning(f"⚠️ Реплика {self.name} выведена из ротации: {error}")
+        self.healthy = False
+        self.error = error
+
+
+class ReplicaRouter:
+    def __init__(self, replicas: List[Replica], max_lag: float, check_seconds: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._next = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.primary_reads = 0
+
+    def pick(self, async_mode: bool) -> Optional[Engine]:
+        """Движок живой реплики по кругу; None - читать из основной БД"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            self.primary_reads += 1
+            return None
+        replica = healthy[next(self._next) % len(healthy)]
+        replica.reads += 1
+        return replica.get_engine(async_mode)
+
+    @staticmethod
+    def get_lag(connection) -> float:
+        """Отставание реплики в секундах; у не-MySQL (локальная SQLite) и у MySQL без репликации - 0"""
+        if connection.dialect.name != "mysql":
+            connection.execute(text("SELECT 1"))
+            return 0.0
+        try:
+            row = connection.execute(text("SHOW REPLICA STATUS")).mappings().first()
+            column = "Seconds_Behind_Source"
+        except Exception:
+            # MySQL до 8.0.22
+            row = connection.execute(text("SHOW SLAVE STATUS")).mappings().first()
+            column = "Seconds_Behind_Master"
+        if row is None:
+            return 0.0
+        if row[column] is None:
+            raise RuntimeError("репликация остановлена")
+        return float(row[column])
+
+    def check_replica(self, replica: Replica):
+        replica.checked_at = time.time()
+        try:
+            with replica.engine.connect() as connection:
+                replica.lag = self.get_lag(connection)
+        except Exception as e:
+            replica.lag = None
+            replica.mark_down(str(e))
+            return
+
+        if replica.lag > self.max_lag:
+            replica.mark_down(f"отставание {replica.lag:.0f} с")
+            return
+        if not replica.healthy:
+            logger.info(f"✅ Реплика {replica.name} возвращена в ротацию")
+        replica.healthy = True
+        replica.error = None
+
+    def check(self):
+        for replica in self.replicas:
+            self.check_replica(replica)
+
+    async def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # Проверка через синхронные движки - в пуле потоков, чтобы не блокировать event loop
+            await asyncio.to_thread(self.check)
+            await asyncio.sleep(self.check_seconds)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+            replica.engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_lag": self.max_lag,
+            "primary_fallback_reads": self.primary_reads,
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag": replica.lag,
+                    "error": replica.error,
+                    "reads": replica.reads,
+                    "checked_at": replica.checked_at,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+class RoutingSession(Session):
+    """Session с выбором движка на каждый запрос: чтения - реплики, запись - основная БД (bind)"""
+
+    def __init__(self, *args, router: Optional[ReplicaRouter] = None, async_mode: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self.async_mode = async_mode
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self.router is None or not self.router.replicas:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+
+        if self._flushing or is_write(clause):
+            self.info[USE_PRIMARY] = True
+            request_routing = _request_routing.get()
+            if request_routing is not None:
+                request_routing["wrote"] = True
+            return super().get_bind(mapper, clause=clause, **kwargs)
+
+        request_routing = _request_routing.get()
+        if self.info.get(USE_PRIMARY) or (request_routing is not None and request_routing["primary"]):
+            return super().get_bind(mapper, clause=clause, **kwargs)
+
+        return self.router.pick(self.async_mode) or super().get_bind(mapper, clause=clause, **kwargs)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Чистый ASGI middleware: клиент, который только что что-то записал, еще
+    max_lag секунд читает из основной БД - реплика могла не получить запись
+    """
+
+    def __init__(self, app: ASGIApp, router: ReplicaRouter):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.router.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            primary_until = float(Request(scope).cookies.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0.0
+        request_routing = {"primary": primary_until > time.time(), "wrote": False}
+        token = _request_routing.set(request_routing)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and request_routing["wrote"]:
+                max_age = max(1, math.ceil(self.router.max_lag))
+                cookie = f"{PRIMARY_COOKIE}={time.time() + max_age:.0f}; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_routing.reset(token)
@@ -0,0 +1,283 @@
+"""
+Общие исходящие HTTP клиенты для внешних провайдеров (Devino, Telegram Bot API, курс валют).
+
+Для каждого провайдера - один httpx.AsyncClient на воркер с пулом keep-alive
+соединений (без нового TLS рукопожатия на каждый запрос), свои таймауты,
+повторы с экспоненциальной задержкой и случайным разбросом и автомат
+(circuit breaker): после серии ошибок запросы к провайдеру сразу получают
+ProviderUnavailable, пока не пройдет время восстановления, затем один
+пробный запрос решает, закрыть автомат или снова открыть.
+
+Клиенты создаются при первом запросе и закрываются при остановке приложения
+(http_clients.close() в lifespan).
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Токен Telegram бота в пути запроса: /bot<token>/sendMessage
+BOT_TOKEN_PATH = re.compile(r"/bot[^/\s'\"]+")
+
+
+def redact(text: str) -> str:
+    """Текст для логов без токена бота"""
+    return BOT_TOKEN_PATH.sub("/bot***", text)
+
+
+def redact_url(url: Any) -> str:
+    """Путь запроса для логов: без хоста, query (ключи API) и токена бота"""
+    return redact(httpx.URL(str(url)).path)
+
+
+class ProviderUnavailable(Exception):
+    """Автомат провайдера открыт: запрос не отправлялся"""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"Provider {provider} is unavailable, retry in {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probe_started_at: Optional[float] = None
+
+    def get_retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.recovery_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.get_retry_after() > 0:
+            return False
+        # Время восстановления прошло: пропускаем один пробный запрос
+        # (если проба пропала без результата, например запрос отменили, - через recovery_seconds следующую)
+        now = time.monotonic()
+        if self._probe_started_at is not None and now - self._probe_started_at < self.recovery_seconds:
+            return False
+        self.state = self.HALF_OPEN
+        self._probe_started_at = now
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self._probe_started_at = None
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened_count": self.opened_count,
+            "retry_after": round(self.get_retry_after(), 1) if self.state == self.OPEN else 0,
+        }
+
+
+class Provider:
+    """Настройки и состояние одного внешнего провайдера"""
+
+    # Ответы, после которых запрос имеет смысл повторить
+    RETRY_STATUSES = {429, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, name: str, base_url: str = "", timeout: float = 10.0, connect_timeout: float = 5.0,
+                 retries: int = 2, backoff: float = 0.2, max_connections: int = 20,
+                 max_keepalive: int = 10, keepalive_expiry: float = 30.0,
+                 failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.breaker = CircuitBreaker(failure_threshold, recovery_seconds)
+
+        self.requests = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=self.limits,
+            headers={"User-Agent": "Wazir-FastAPI/1.0"},
+        )
+
+    def get_delay(self, attempt: int) -> float:
+        # Экспоненциальная задержка с полным случайным разбросом
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retried": self.retried,
+            "rejected": self.rejected,
+            "breaker": self.breaker.stats(),
+        }
+
+
+class HTTPClientRegistry:
+    def __init__(self):
+        self.providers: Dict[str, Provider] = {}
+        # (провайдер, event loop) -> клиент: пул соединений нельзя делить между циклами
+        self._clients: Dict[Tuple[str, asyncio.AbstractEventLoop], httpx.AsyncClient] = {}
+
+    def register(self, provider: Provider) -> Provider:
+        self.providers[provider.name] = provider
+        return provider
+
+    def get_client(self, name: str) -> httpx.AsyncClient:
+        key = (name, asyncio.get_running_loop())
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self.providers[name].create_client()
+            self._clients[key] = client
+        return client
+
+    async def request(self, name: str, method: str, url: str, idempotent: Optional[bool] = None,
+                      **kwargs) -> httpx.Response:
+        """
+        Запрос к провайдеру через общий клиент.
+
+        Неидемпотентные запросы (POST) повторяются только если соединение не
+        было установлено - иначе, например, SMS может уйти дважды. Ответы
+        502/503/504 и 429 повторяются для идемпотентных запросов; после последней
+        попытки ответ возвращается вызывающему коду, а 5xx и сетевые ошибки
+        учитываются автоматом.
+        """
+        provider = self.providers[name]
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in Provider.IDEMPOTENT_METHODS
+
+        if not provider.breaker.allow():
+            provider.rejected += 1
+            raise ProviderUnavailable(name, provider.breaker.get_retry_after())
+
+        client = self.get_client(name)
+        attempt = 0
+        while True:
+            provider.requests += 1
+            try:
+                response = await client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = e
+                can_retry = True
+            except httpx.TransportError as e:
+                error = e
+                can_retry = idempotent
+            else:
+                if response.status_code not in Provider.RETRY_STATUSES:
+                    if response.status_code >= 500:
+                        provider.failures += 1
+                        provider.breaker.record_failure()
+                    else:
+                        provider.breaker.record_success()
+                    return response
+                error = None
+                can_retry = idempotent
+
+            provider.failures += 1
+            if not can_retry or attempt >= provider.retries:
+                if error is not None:
+                    provider.breaker.record_failure()
+                    logger.warning(f"⚠️ {name}: {method} {redact_url(url)} не выполнен: {redact(repr(error))}")
+                    raise error
+                # 429 - ограничение частоты у провайдера, а не его отказ
+                if response.status_code == 429:
+                    provider.breaker.record_success()
+                else:
+                    provider.breaker.record_failure()
+                return response
+
+            attempt += 1
+            provider.retried += 1
+            await asyncio.sleep(provider.get_delay(attempt))
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for key, client in list(self._clients.items()):
+            if key[1] is loop:
+                await client.aclose()
+            del self._clients[key]
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, provider in self.providers.items():
+            result[name] = provider.stats()
+            result[name]["clients"] = sum(
+                1 for key, client in self._clients.items() if key[0] == name and not client.is_closed
+            )
+            result[name]["pooled_connections"] = sum(
+                self._get_pool_size(client) for key, client in self._clients.items() if key[0] == name
+            )
+        return result
+
+    @staticmethod
+    def _get_pool_size(client: httpx.AsyncClient) -> int:
+        # httpx не публикует состояние пула, берем его у транспорта httpcore, если доступно
+        try:
+            return len(client._transport._pool.connections)
+        except Exception:
+            return 0
+
+
+http_clients = HTTPClientRegistry()
+
+http_clients.register(Provider(
+    "devino",
+    base_url=settings.DEVINO_API_URL,
+    timeout=settings.DEVINO_TIMEOUT,
+    failure_threshold=settings.HTTP_BREAKER_FAILURE_THRESHOLD,
+    recovery_seconds=settings.HTTP_BREAKER_RECOVERY_SECONDS,
+))
+http_clients.register(Provider(
+    "telegram",
+    base_url="https://api.telegram.org",
+    timeout=settings.HTTP_TELEGRAM_TIMEOUT_SECONDS,
+    failure_threshold=settings.HTTP_BREAKER_FAILURE_THRESHOLD,
+    recovery_seconds=settings.HTTP_BREAKER_RECOVERY_SECONDS,
+))
+http_clients.register(Provider(
+    "fx",
+    base_url="https://api.exchangerate-api.com",
+    timeout=settings.HTTP_FX_TIMEOUT_SECONDS,
+    retries=1,
+    failure_threshold=settings.HTTP_BREAKER_FAILURE_THRESHOLD,
+    recovery_seconds=settings.HTTP_BREAKER_RECOVERY_SECONDS,
+))
@@ -5,10 +5,21 @@ from pathlib import Path
 # Путь к заглушке для изображений
 DEFAULT_IMAGE = "/static/layout/assets/img/property-placeholder.jpg"
 
-def get_valid_image_url(url):
+# Ширина картинки в карточках списков (должна входить в MEDIA_RESIZE_WIDTHS)
+CARD_IMAGE_WIDTH = 800
+
+# Старые загрузки без вариантов - для них отдаем уменьшенную копию через /media/r/
+LEGACY_UPLOADS_PREFIX = '/static/uploads/'
+
+def get_resized_image_url(url, width, height=0):
+    """Возвращает URL уменьшенной копии изображения (ресайз по запросу с кешем)"""
+    return f"/media/r/{width}x{height}/{url.lstrip('/')}"
+
+def get_valid_image_url(url, width=None):
     """
     Проверяет наличие изображения по указанному URL
     Если изображение не найдено, возвращает заглушку
+    Если указана ширина, для старых загрузок без вариантов возвращает URL ресайза
     """
     if not url:
         return DEFAULT_IMAGE
@@ -37,6 +48,8 @@ def get_valid_image_url(url):
     
     # Проверяем существование файла
     if file_path and file_path.exists():
+        if width and url.startswith(LEGACY_UPLOADS_PREFIX):
+            return get_resized_image_url(url, width)
         return url
     
     # Возвращаем заглушку, если файл не найден
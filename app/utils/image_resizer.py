@@ -0,0 +1,206 @@
+import io
+import os
+import uuid
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from config import settings
+
+
+class ResizeCache:
+    """
+    Дисковый кеш уменьшенных копий изображений с ограничением по размеру.
+
+    Индекс (путь -> размер файла) хранится в OrderedDict в порядке последнего
+    обращения; при превышении лимита удаляются самые давно использованные файлы.
+    При старте индекс восстанавливается по mtime, поэтому mtime файла
+    обновляется при каждом попадании в кеш.
+    """
+
+    # Корни, из которых разрешено брать исходники
+    SOURCE_ROOTS = ("static", "media")
+    SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
+    QUALITY = 82
+
+    def __init__(self, cache_dir: str, max_bytes: int, allowed_sizes, base_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.allowed_sizes = set(allowed_sizes)
+        self.base_dir = Path(base_dir)
+
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._index_lock = threading.Lock()
+        # Ключ кеша -> [блокировка, сколько запросов ее держат или ждут]
+        self._key_locks: Dict[str, list] = {}
+        # Индекс загружается один раз, даже если первые запросы пришли одновременно
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def _load_index(self):
+        """Восстанавливает LRU-индекс из содержимого каталога кеша"""
+        with self._load_lock:
+            if self._loaded:
+                return
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            entries = []
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith(".tmp"):
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, path, stat.st_size))
+
+            entries.sort()
+            with self._index_lock:
+                for _, path, size in entries:
+                    self._index[path] = size
+                    self._total_bytes += size
+                self._loaded = True
+        self._evict()
+
+    def is_allowed_size(self, width: int, height: int) -> bool:
+        # Высота 0 означает "по пропорциям"
+        return width in self.allowed_sizes and (height == 0 or height in self.allowed_sizes)
+
+    def resolve_source(self, path: str) -> Optional[Path]:
+        """Проверяет путь исходника: только static/ и media/, без выхода за их пределы"""
+        parts = Path(path).parts
+        if not parts or parts[0] not in self.SOURCE_ROOTS:
+            return None
+        root = (self.base_dir / parts[0]).resolve()
+        source = (self.base_dir / path).resolve()
+        if root not in source.parents or source.suffix.lower() not in self.SOURCE_EXTENSIONS:
+            return None
+        if not source.is_file():
+            return None
+        return source
+
+    def cache_path(self, source: Path, width: int, height: int) -> Path:
+        stat = source.stat()
+        # В ключ входит mtime исходника: замена файла автоматически инвалидирует кеш
+        key = hashlib.sha1(f"{source}|{stat.st_mtime_ns}|{width}x{height}".encode()).hexdigest()
+        return self.cache_dir / key[0:2] / f"{key}.jpg"
+
+    def _touch(self, cache_path: Path) -> bool:
+        key = str(cache_path)
+        with self._index_lock:
+            if key not in self._index:
+                return False
+            self._index.move_to_end(key)
+        try:
+            os.utime(cache_path)
+        except FileNotFoundError:
+            self._forget(key)
+            return False
+        return True
+
+    def _forget(self, key: str):
+        with self._index_lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+
+    def _evict(self):
+        while True:
+            with self._index_lock:
+                if self._total_bytes <= self.max_bytes or not self._index:
+                    return
+                key, size = self._index.popitem(last=False)
+                self._total_bytes -= size
+            try:
+                os.remove(key)
+            except FileNotFoundError:
+                pass
+
+    def _render(self, source: Path, cache_path: Path, width: int, height: int) -> int:
+        """Ресайз исходника в файл кеша (выполняется в пуле потоков)"""
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            target_height = height or max(1, round(image.height * width / image.width))
+            image.thumbnail((width, target_height), Image.Resampling.LANCZOS)
+
+            if image.mode in ('RGBA', 'LA', 'P'):
+                if image.mode == 'P':
+                    image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=self.QUALITY, optimize=True, progressive=True)
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, cache_path)
+        return len(buffer.getvalue())
+
+    async def get(self, path: str, width: int, height: int) -> Optional[Tuple[Path, bool]]:
+        """
+        Возвращает (путь к файлу в кеше, было ли попадание) или None,
+        если исходник не найден или запрещен.
+        """
+        from starlette.concurrency import run_in_threadpool
+
+        if not self._loaded:
+            await run_in_threadpool(self._load_index)
+
+        source = self.resolve_source(path)
+        if not source:
+            return None
+
+        cache_path = self.cache_path(source, width, height)
+        if self._touch(cache_path):
+            return cache_path, True
+
+        # Один ресайз на ключ, даже если картинку одновременно запросили несколько клиентов
+        key = str(cache_path)
+        entry = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if self._touch(cache_path):
+                    return cache_path, True
+                size = await run_in_threadpool(self._render, source, cache_path, width, height)
+                # Индекс обновляется под блокировкой ключа: следующий запрос уже попадет в кеш
+                with self._index_lock:
+                    previous = self._index.pop(key, 0)
+                    self._index[key] = size
+                    self._total_bytes += size - previous
+        finally:
+            # Блокировку убираем, только когда ее никто не держит и не ждет
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._key_locks.pop(key, None)
+
+        await run_in_threadpool(self._evict)
+        return cache_path, False
+
+    def stats(self) -> Dict[str, int]:
+        with self._index_lock:
+            return {
+                "files": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+resize_cache = ResizeCache(
+    cache_dir=settings.MEDIA_RESIZE_CACHE_DIR,
+    max_bytes=settings.MEDIA_RESIZE_CACHE_MAX_BYTES,
+    allowed_sizes=settings.MEDIA_RESIZE_WIDTHS,
+    base_dir=settings.BASE_DIR,
+)
@@ -0,0 +1,233 @@
+"""
+Сборщик мусора медиа-файлов.
+
+Удаляет из media/ файлы, на которые больше нет ссылок в БД: варианты
+удаленных объявлений, замененные фото заведений, старые панорамы и их тайлы.
+
+Запуск (без --delete только показывает, что будет удалено):
+    python -m app.utils.media_gc
+    python -m app.utils.media_gc --delete --grace-hours 24
+"""
+import os
+import re
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterator, Iterable, Optional, Set, Tuple
+
+from .media_uploader import media_uploader
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGarbageCollector:
+    """
+    Строит множество ссылок из БД (пачками по batch_size строк), затем
+    потоково обходит дерево media/ и удаляет файлы без ссылок старше grace_seconds.
+
+    Безопасен при параллельных загрузках: файлы моложе grace_seconds не трогаются,
+    а MediaUploader.store_image обновляет mtime переиспользуемого содержимого,
+    так что дедуплицированный блоб, на который только что сослались, тоже "молодой".
+    """
+
+    DEFAULT_GRACE_SECONDS = 24 * 60 * 60
+    DEFAULT_BATCH_SIZE = 1000
+
+    # Каталоги, которые обходит сборщик
+    ROOTS = ("content", "properties", "panoramas", "service_cards")
+
+    UUID_PREFIX_RE = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_")
+    UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+    CONTENT_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+    MEDIA_URL_RE = re.compile(r"/media/([^\s\"'?#]+)")
+
+    def __init__(self, media_path: Optional[Path] = None, grace_seconds: int = DEFAULT_GRACE_SECONDS,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.media_path = Path(media_path) if media_path else media_uploader.media_path
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+
+    # --- Ссылки из БД ---
+
+    def _iter_rows(self, db, model, *columns) -> Iterator[Tuple]:
+        """Построчно читает колонки модели, пачками по id (keyset-пагинация)"""
+        last_id = 0
+        while True:
+            rows = (
+                db.query(model.id, *columns)
+                .filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_id = rows[-1][0]
+
+    def _iter_reference_values(self, db) -> Iterator[Any]:
+        from app import models
+
+        sources = [
+            (models.PropertyImage, models.PropertyImage.url),
+            (models.ServiceCardImage, models.ServiceCardImage.url),
+            (models.User, models.User.company_logo_url),
+            (models.GeneralCategory, models.GeneralCategory.image_url),
+            (models.Property, models.Property.images_data, models.Property.tour_360_metadata,
+             models.Property.tour_360_url, models.Property.tour_360_original_url, models.Property.tour_360_optimized_url,
+             models.Property.tour_360_preview_url, models.Property.tour_360_thumbnail_url),
+            (models.ServiceCard, models.ServiceCard.image_url, models.ServiceCard.tour_360_metadata,
+             models.ServiceCard.tour_360_url, models.ServiceCard.tour_360_original_url, models.ServiceCard.tour_360_optimized_url,
+             models.ServiceCard.tour_360_preview_url, models.ServiceCard.tour_360_thumbnail_url),
+        ]
+        for model, *columns in sources:
+            for row in self._iter_rows(db, model, *columns):
+                yield from row
+
+    def collect_references(self, db) -> Set[str]:
+        """
+        Множество ключей, на которые есть ссылки: хеши содержимого, UUID файлов
+        (все варианты и тайлы одной загрузки) и относительные пути прочих файлов.
+        """
+        referenced: Set[str] = set()
+        for value in self._iter_reference_values(db):
+            if not value:
+                continue
+            text = value if isinstance(value, str) else json.dumps(value)
+            for relative_path in self.MEDIA_URL_RE.findall(text):
+                referenced.add(self.get_key(relative_path))
+        return referenced
+
+    # --- Обход дерева ---
+
+    def get_key(self, relative_path: str) -> str:
+        """Ключ файла: по нему файл считается живым, если ключ есть в ссылках"""
+        parts = relative_path.split("/")
+        if parts[0] == media_uploader.CONTENT_DIR and len(parts) >= 4 and self.CONTENT_HASH_RE.match(parts[3]):
+            return parts[3]
+        # .../tiles/<file_id>/... - тайлы живут, пока жива их панорама
+        if "tiles" in parts[:-1]:
+            file_id = parts[parts.index("tiles") + 1]
+            if self.UUID_RE.fullmatch(file_id.replace(".tmp", "")):
+                return file_id.replace(".tmp", "")
+        match = self.UUID_PREFIX_RE.match(parts[-1])
+        if match:
+            return match.group(1)
+        return relative_path
+
+    def iter_files(self) -> Iterator[Tuple[str, os.DirEntry]]:
+        """Потоково обходит корни media/, не собирая список файлов в память"""
+        stack = [self.media_path / root for root in self.ROOTS]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+                        elif entry.is_file(follow_symlinks=False):
+                            relative_path = Path(entry.path).relative_to(self.media_path).as_posix()
+                            yield relative_path, entry
+            except FileNotFoundError:
+                continue
+
+    def _remove_empty_dirs(self, directories: Iterable[Path]):
+        for directory in sorted(set(directories), key=lambda d: len(d.parts), reverse=True):
+            current = directory
+            while current != self.media_path and current.name not in self.ROOTS:
+                try:
+                    current.rmdir()
+                except OSError:
+                    break
+                current = current.parent
+
+    def run(self, db, dry_run: bool = True) -> Dict[str, Any]:
+        started = time.time()
+        referenced = self.collect_references(db)
+        logger.info(f"🔗 Ссылок на медиа в БД: {len(referenced)}")
+
+        cutoff = time.time() - self.grace_seconds
+        report = {
+            "dry_run": dry_run,
+            "references": len(referenced),
+            "scanned_files": 0,
+            "scanned_bytes": 0,
+            "skipped_recent": 0,
+            "deleted_files": 0,
+            "reclaimed_bytes": 0,
+            "errors": 0,
+        }
+        touched_dirs = []
+
+        for relative_path, entry in self.iter_files():
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            report["scanned_files"] += 1
+            report["scanned_bytes"] += stat.st_size
+
+            if self.get_key(relative_path) in referenced:
+                continue
+            if stat.st_mtime > cutoff:
+                report["skipped_recent"] += 1
+                continue
+
+            if not dry_run:
+                try:
+                    # Повторная проверка mtime прямо перед удалением: файл могли
+                    # переиспользовать (дедупликация) уже после снимка ссылок
+                    if os.stat(entry.path).st_mtime > cutoff:
+                        report["skipped_recent"] += 1
+                        continue
+                    os.remove(entry.path)
+                    touched_dirs.append(Path(entry.path).parent)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error(f"❌ Не удалось удалить {relative_path}: {e}")
+                    report["errors"] += 1
+                    continue
+            else:
+                logger.info(f"🗑️ [dry-run] {relative_path} ({stat.st_size} байт)")
+
+            report["deleted_files"] += 1
+            report["reclaimed_bytes"] += stat.st_size
+
+        if not dry_run:
+            self._remove_empty_dirs(touched_dirs)
+
+        report["duration_seconds"] = round(time.time() - started, 2)
+        logger.info(f"✅ Сборка мусора завершена: {report}")
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Удаление медиа-файлов без ссылок в БД")
+    parser.add_argument("--delete", action="store_true",
+                        help="Удалить файлы (без флага только показать, что будет удалено)")
+    parser.add_argument("--grace-hours", type=float, default=MediaGarbageCollector.DEFAULT_GRACE_SECONDS / 3600,
+                        help="Не трогать файлы моложе указанного числа часов")
+    parser.add_argument("--batch-size", type=int, default=MediaGarbageCollector.DEFAULT_BATCH_SIZE,
+                        help="Размер пачки при чтении ссылок из БД")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from database import SessionLocal
+
+    collector = MediaGarbageCollector(grace_seconds=int(args.grace_hours * 3600), batch_size=args.batch_size)
+    db = SessionLocal()
+    try:
+        report = collector.run(db, dry_run=not args.delete)
+    finally:
+        db.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import uuid
 import os
+import re
 import shutil
+import hashlib
+import base64
 import io
 from typing import List, Optional, Dict, Any
 from fastapi import UploadFile
@@ -9,7 +12,27 @@ from PIL import Image, ImageOps
 from datetime import datetime
 import aiofiles
 
+# Идентификатор каталога медиа объявления или заведения: 12, service-12, 1a2b-3c4d-...
+MEDIA_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
 class MediaUploader:
+    # Варианты изображений: (ширина, высота, качество JPEG)
+    VARIANTS = {
+        'original': (4096, 4096, 95),
+        'large': (1920, 1080, 85),
+        'medium': (800, 600, 80),
+        'small': (400, 300, 75),
+        'thumbnail': (150, 150, 70)
+    }
+    
+    # LQIP-заглушка: ~20px JPEG в data URI, встраивается прямо в карточки
+    PLACEHOLDER_SIZE = (20, 20)
+    PLACEHOLDER_QUALITY = 40
+    
+    # Контентно-адресуемое хранилище: content/ab/cd/<sha256>/<sha256>_<variant>.jpg
+    CONTENT_DIR = "content"
+    CONTENT_URL_RE = re.compile(r"/media/content/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})/")
+    
     def __init__(self, media_path: str = "media"):
         self.media_path = Path(media_path)
         self.media_path.mkdir(exist_ok=True)
@@ -40,29 +63,136 @@ class MediaUploader:
         image.save(buffer, format='JPEG', quality=quality, optimize=True)
         return buffer.getvalue()
     
+    def make_placeholder(self, image: Image.Image) -> str:
+        """Крошечное размытое превью изображения в виде data URI"""
+        placeholder_data = self._resize_image(image.copy(), self.PLACEHOLDER_SIZE, self.PLACEHOLDER_QUALITY)
+        return "data:image/jpeg;base64," + base64.b64encode(placeholder_data).decode("ascii")
+    
+    def make_placeholder_from_bytes(self, file_content: bytes) -> Optional[str]:
+        try:
+            return self.make_placeholder(Image.open(io.BytesIO(file_content)))
+        except Exception as e:
+            print(f"ERROR: Не удалось построить заглушку изображения: {e}")
+            return None
+    
+    def _variant_url(self, base_path: Path, file_id: str, variant: str) -> str:
+        relative_path = base_path.relative_to(self.media_path)
+        relative_path_str = str(relative_path).replace("\\", "/")
+        return f"/media/{relative_path_str}/{file_id}_{variant}.jpg"
+    
     async def _save_image_variants(self, image: Image.Image, base_path: Path, file_id: str) -> Dict[str, str]:
-        variants = {
-            'original': (4096, 4096, 95),
-            'large': (1920, 1080, 85),
-            'medium': (800, 600, 80),
-            'small': (400, 300, 75),
-            'thumbnail': (150, 150, 70)
-        }
-        
         urls = {}
-        for variant, (width, height, quality) in variants.items():
+        for variant, (width, height, quality) in self.VARIANTS.items():
             variant_data = self._resize_image(image.copy(), (width, height), quality)
             variant_path = base_path / f"{file_id}_{variant}.jpg"
             
-            async with aiofiles.open(variant_path, 'wb') as f:
+            # Пишем во временный файл и атомарно подменяем, чтобы параллельная
+            # загрузка того же файла не увидела недописанный вариант
+            tmp_path = base_path / f".{variant_path.name}.{uuid.uuid4().hex}.tmp"
+            async with aiofiles.open(tmp_path, 'wb') as f:
                 await f.write(variant_data)
+            os.replace(tmp_path, variant_path)
             
-            relative_path = base_path.relative_to(self.media_path)
-            relative_path_str = str(relative_path).replace("\\", "/")
-            urls[variant] = f"/media/{relative_path_str}/{file_id}_{variant}.jpg"
+            urls[variant] = self._variant_url(base_path, file_id, variant)
         
         return urls
     
+    def content_hash(self, file_content: bytes) -> str:
+        return hashlib.sha256(file_content).hexdigest()
+    
+    def get_content_dir(self, content_hash: str) -> Path:
+        return self.media_path / self.CONTENT_DIR / content_hash[0:2] / content_hash[2:4] / content_hash
+    
+    def content_hash_from_url(self, url: Optional[str]) -> Optional[str]:
+        """Извлекает хеш содержимого из URL варианта (None для старых UUID-файлов)"""
+        if not url:
+            return None
+        match = self.CONTENT_URL_RE.search(url)
+        return match.group(1) if match else None
+    
+    def _existing_variant_urls(self, content_hash: str) -> Optional[Dict[str, str]]:
+        content_dir = self.get_content_dir(content_hash)
+        urls = {}
+        for variant in self.VARIANTS:
+            if not (content_dir / f"{content_hash}_{variant}.jpg").exists():
+                return None
+            urls[variant] = self._variant_url(content_dir, content_hash, variant)
+        return urls
+    
+    def _touch_content(self, content_hash: str):
+        """Обновляет mtime переиспользуемого содержимого, чтобы сборщик мусора его не тронул"""
+        content_dir = self.get_content_dir(content_hash)
+        for path in content_dir.iterdir():
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+    
+    def _placeholder_path(self, content_hash: str) -> Path:
+        return self.get_content_dir(content_hash) / f"{content_hash}_placeholder.txt"
+    
+    async def _load_placeholder(self, content_hash: str) -> Optional[str]:
+        placeholder_path = self._placeholder_path(content_hash)
+        if placeholder_path.exists():
+            async with aiofiles.open(placeholder_path, 'r') as f:
+                return await f.read()
+        
+        # Содержимое загружено до появления заглушек - строим по миниатюре
+        thumbnail_path = self.get_content_dir(content_hash) / f"{content_hash}_thumbnail.jpg"
+        async with aiofiles.open(thumbnail_path, 'rb') as f:
+            placeholder = self.make_placeholder_from_bytes(await f.read())
+        if placeholder:
+            await self._save_placeholder(content_hash, placeholder)
+        return placeholder
+    
+    async def _save_placeholder(self, content_hash: str, placeholder: str):
+        placeholder_path = self._placeholder_path(content_hash)
+        tmp_path = placeholder_path.with_name(f".{placeholder_path.name}.{uuid.uuid4().hex}.tmp")
+        async with aiofiles.open(tmp_path, 'w') as f:
+            await f.write(placeholder)
+        os.replace(tmp_path, placeholder_path)
+    
+    async def store_image(self, file_content: bytes) -> Dict[str, Any]:
+        """
+        Сохраняет изображение по хешу содержимого.
+        Если такие байты уже загружались, декодирование и ресайз пропускаются,
+        возвращаются URL существующих вариантов.
+        """
+        content_hash = self.content_hash(file_content)
+        
+        urls = self._existing_variant_urls(content_hash)
+        if urls:
+            self._touch_content(content_hash)
+            placeholder = await self._load_placeholder(content_hash)
+            return {"content_hash": content_hash, "urls": urls, "placeholder": placeholder, "reused": True}
+        
+        content_dir = self.get_content_dir(content_hash)
+        content_dir.mkdir(parents=True, exist_ok=True)
+        
+        image = Image.open(io.BytesIO(file_content))
+        placeholder = self.make_placeholder(image)
+        await self._save_placeholder(content_hash, placeholder)
+        urls = await self._save_image_variants(image, content_dir, content_hash)
+        return {"content_hash": content_hash, "urls": urls, "placeholder": placeholder, "reused": False}
+    
+    async def release_content(self, content_hashes) -> Dict[str, Any]:
+        """
+        Содержимое, на которое больше не ссылаются, передается сборщику мусора.
+        Файлы не удаляются сразу: параллельная загрузка тех же байтов может снова
+        сослаться на них между проверкой ссылок и удалением. media_gc удалит их
+        после grace-периода, если ссылок так и не появится (store_image обновляет
+        mtime переиспользуемого содержимого).
+        """
+        released = sorted(set(h for h in content_hashes if h))
+        if released:
+            print(f"DEBUG: Содержимое без ссылок оставлено сборщику мусора: {len(released)}")
+        
+        return {
+            "status": "success",
+            "released": released,
+            "count": len(released)
+        }
+    
     async def upload_panorama(self, file_input, property_id: str) -> Dict[str, Any]:
         try:
             if hasattr(file_input, 'read'):
@@ -125,24 +255,23 @@ class MediaUploader:
             }
         
         try:
-            images_dir = self.media_path / "properties" / property_id
-            images_dir.mkdir(parents=True, exist_ok=True)
-            
             uploaded_files = []
             
             for file in files:
                 file_content = await file.read()
-                file_id = str(uuid.uuid4())
-                
-                image = Image.open(io.BytesIO(file_content))
-                urls = await self._save_image_variants(image, images_dir, file_id)
+                stored = await self.store_image(file_content)
+                file_id = stored["content_hash"]
+                urls = stored["urls"]
                 
                 uploaded_files.append({
                     'file_id': file_id,
+                    'content_hash': file_id,
                     'filename': f"{file_id}.jpg",
                     'original_name': file.filename,
                     'urls': urls,
-                    'url': urls.get('large', '')
+                    'url': urls.get('large', ''),
+                    'placeholder': stored["placeholder"],
+                    'reused': stored["reused"]
                 })
                 
                 await file.seek(0)
@@ -162,6 +291,12 @@ class MediaUploader:
             }
     
     async def delete_property_images(self, property_id: str) -> Dict[str, Any]:
+        # id становится именем каталога: без точек и слешей, иначе rmtree уйдет выше media/properties
+        if not MEDIA_ID_PATTERN.fullmatch(str(property_id)):
+            return {
+                "status": "error",
+                "message": "Invalid media id"
+            }
         try:
             property_dir = self.media_path / "properties" / property_id
             if property_dir.exists():
@@ -1,4 +1,5 @@
 import uuid
+import shutil
 import logging
 from datetime import datetime
 from typing import Optional, Dict, Any, Union
@@ -98,4 +99,24 @@ class PanoramaProcessor:
         finally:
             await file.seek(0)
 
+    async def delete_panorama_files(self, file_id: str) -> int:
+        """
+        Удаляет варианты и тайлы панорамы по file_id.
+        Каталог панорамы зависит от того, кто ее загружал, поэтому ищем по всем.
+        """
+        if not file_id:
+            return 0
+        
+        panoramas_dir = media_uploader.media_path / "panoramas"
+        deleted = 0
+        for variant_path in panoramas_dir.glob(f"*/{file_id}_*"):
+            variant_path.unlink(missing_ok=True)
+            deleted += 1
+        for tiles_dir in panoramas_dir.glob(f"*/tiles/{file_id}"):
+            shutil.rmtree(tiles_dir, ignore_errors=True)
+            deleted += 1
+        
+        logger.info(f"🗑️ Удалено файлов панорамы {file_id}: {deleted}")
+        return deleted
+
 panorama_processor = PanoramaProcessor() 
\ No newline at end of file
@@ -0,0 +1,251 @@
+import json
+import math
+import shutil
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+
+import numpy as np
+from PIL import Image
+
+from .media_uploader import media_uploader
+
+logger = logging.getLogger(__name__)
+
+
+class PanoramaTiler:
+    """
+    Нарезка эквидистантной панорамы на мультиразрешающую пирамиду тайлов
+    в формате multires Pannellum (грани куба f/r/b/l/u/d, уровни 1..maxLevel).
+
+    Уровень 1 - самая маленькая грань, её просмотрщик показывает сразу,
+    более детальные тайлы подгружаются только для видимой области.
+    """
+
+    TILE_SIZE = 512
+    FALLBACK_SIZE = 1024
+    QUALITY = 85
+    TILES_DIR = "tiles"
+    MANIFEST_NAME = "manifest.json"
+
+    # Направление луча для точки (u, v) грани, u - вправо, v - вниз, оба в [-1, 1].
+    # Оси: x - вправо, y - вверх, z - вперед (центр эквидистантного изображения).
+    FACE_VECTORS: Dict[str, Callable] = {
+        'f': lambda u, v: (u, -v, np.ones_like(u)),
+        'r': lambda u, v: (np.ones_like(u), -v, -u),
+        'b': lambda u, v: (-u, -v, -np.ones_like(u)),
+        'l': lambda u, v: (-np.ones_like(u), -v, u),
+        'u': lambda u, v: (u, np.ones_like(u), v),
+        'd': lambda u, v: (u, -np.ones_like(u), -v),
+    }
+
+    def __init__(self, media_path: Optional[Path] = None):
+        self.media_path = Path(media_path) if media_path else media_uploader.media_path
+
+    def url_to_path(self, url: str) -> Optional[Path]:
+        """Преобразует URL вида /media/... в путь на диске"""
+        if not url or not url.startswith("/media/"):
+            return None
+        return self.media_path / url[len("/media/"):]
+
+    def path_to_url(self, path: Path) -> str:
+        relative_path = str(path.relative_to(self.media_path)).replace("\\", "/")
+        return f"/media/{relative_path}"
+
+    def get_tiles_dir(self, original_url: str, file_id: str) -> Optional[Path]:
+        """Каталог тайлов лежит рядом с вариантами панорамы: .../tiles/{file_id}"""
+        original_path = self.url_to_path(original_url)
+        if not original_path:
+            return None
+        return original_path.parent / self.TILES_DIR / file_id
+
+    @staticmethod
+    def get_cube_size(width: int) -> int:
+        # Та же формула, что и в generate.py из Pannellum: грань куба ~ ширина / pi, кратно 8
+        return 8 * int(width / math.pi / 8)
+
+    def get_levels(self, cube_size: int) -> int:
+        levels = int(math.ceil(math.log(float(cube_size) / self.TILE_SIZE, 2))) + 1
+        if levels > 1 and round(cube_size / 2 ** (levels - 2)) == self.TILE_SIZE:
+            levels -= 1
+        return max(levels, 1)
+
+    def _render_face(self, pixels: np.ndarray, face: str, size: int) -> Image.Image:
+        """Проецирует эквидистантное изображение на грань куба (билинейная интерполяция)"""
+        height, width = pixels.shape[:2]
+
+        grid = (np.arange(size, dtype=np.float32) + 0.5) / size * 2 - 1
+        u, v = np.meshgrid(grid, grid)
+        x, y, z = self.FACE_VECTORS[face](u, v)
+
+        lon = np.arctan2(x, z)
+        lat = np.arctan2(y, np.hypot(x, z))
+
+        px = (lon / (2 * np.pi) + 0.5) * width - 0.5
+        py = (0.5 - lat / np.pi) * height - 0.5
+
+        x0 = np.floor(px).astype(np.int64)
+        y0 = np.floor(py).astype(np.int64)
+        fx = (px - x0)[..., None]
+        fy = (py - y0)[..., None]
+
+        # По долготе изображение замкнуто, по широте - обрезаем на полюсах
+        x1 = (x0 + 1) % width
+        x0 = x0 % width
+        y1 = np.clip(y0 + 1, 0, height - 1)
+        y0 = np.clip(y0, 0, height - 1)
+
+        top = pixels[y0, x0].astype(np.float32) * (1 - fx) + pixels[y0, x1].astype(np.float32) * fx
+        bottom = pixels[y1, x0].astype(np.float32) * (1 - fx) + pixels[y1, x1].astype(np.float32) * fx
+        face_pixels = top * (1 - fy) + bottom * fy
+
+        return Image.fromarray(np.clip(face_pixels + 0.5, 0, 255).astype(np.uint8), 'RGB')
+
+    def generate_tiles(self, source_path: Path, output_dir: Path) -> Dict[str, Any]:
+        """
+        Строит пирамиду тайлов и резервные грани для source_path в output_dir.
+        Возвращает манифест (он же сохраняется в manifest.json).
+        """
+        image = Image.open(source_path)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        cube_size = self.get_cube_size(image.width)
+        levels = self.get_levels(cube_size)
+        pixels = np.asarray(image)
+
+        # Пишем во временный каталог и подменяем целиком, чтобы просмотрщик
+        # никогда не видел наполовину нарезанную пирамиду
+        tmp_dir = output_dir.with_name(output_dir.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        (tmp_dir / "fallback").mkdir(parents=True)
+        for level in range(1, levels + 1):
+            (tmp_dir / str(level)).mkdir()
+
+        tiles_count = 0
+        for face in self.FACE_VECTORS:
+            face_image = self._render_face(pixels, face, cube_size)
+
+            fallback_size = min(self.FALLBACK_SIZE, cube_size)
+            face_image.resize((fallback_size, fallback_size), Image.Resampling.LANCZOS).save(
+                tmp_dir / "fallback" / f"{face}.jpg", format='JPEG', quality=self.QUALITY, optimize=True
+            )
+
+            size = cube_size
+            for level in range(levels, 0, -1):
+                if size != face_image.width:
+                    face_image = face_image.resize((size, size), Image.Resampling.LANCZOS)
+                tiles = int(math.ceil(float(size) / self.TILE_SIZE))
+                for row in range(tiles):
+                    for col in range(tiles):
+                        box = (
+                            col * self.TILE_SIZE,
+                            row * self.TILE_SIZE,
+                            min((col + 1) * self.TILE_SIZE, size),
+                            min((row + 1) * self.TILE_SIZE, size),
+                        )
+                        face_image.crop(box).save(
+                            tmp_dir / str(level) / f"{face}{row}_{col}.jpg",
+                            format='JPEG', quality=self.QUALITY, optimize=True
+                        )
+                        tiles_count += 1
+                size = int(size / 2)
+
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        tmp_dir.rename(output_dir)
+
+        manifest = {
+            "status": "ready",
+            "generated_at": datetime.now().isoformat(),
+            "source_dimensions": f"{image.width}x{image.height}",
+            "tiles_count": tiles_count,
+            "config": {
+                "basePath": self.path_to_url(output_dir),
+                "path": "/%l/%s%y_%x",
+                "fallbackPath": "/fallback/%s",
+                "extension": "jpg",
+                "tileResolution": self.TILE_SIZE,
+                "maxLevel": levels,
+                "cubeResolution": cube_size,
+            },
+        }
+
+        with open(output_dir / self.MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        return manifest
+
+    def build_tiles(self, model_name: str, object_id: int, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Фоновая задача: нарезает панораму объекта (Property или ServiceCard) и
+        записывает манифест в tour_360_metadata["multires"].
+
+        Выполняется вне обработчика запроса (BackgroundTasks запускает синхронные
+        функции в пуле потоков), поэтому открывает собственную сессию БД.
+        """
+        from database import SessionLocal
+        from app import models
+
+        model = getattr(models, model_name)
+        db = SessionLocal()
+        try:
+            obj = db.query(model).filter(model.id == object_id).first()
+            if not obj or obj.tour_360_file_id != file_id:
+                logger.info(f"⏭️ Панорама {file_id} уже заменена или удалена, нарезка не нужна")
+                return None
+
+            source_path = self.url_to_path(obj.tour_360_original_url)
+            output_dir = self.get_tiles_dir(obj.tour_360_original_url, file_id)
+            if not source_path or not source_path.exists():
+                logger.error(f"❌ Исходный файл панорамы не найден: {obj.tour_360_original_url}")
+                manifest = {"status": "failed", "error": "source not found"}
+            else:
+                logger.info(f"🧩 Нарезка панорамы {file_id} на тайлы: {output_dir}")
+                try:
+                    manifest = self.generate_tiles(source_path, output_dir)
+                    logger.info(f"✅ Тайлы панорамы {file_id} готовы: {manifest['tiles_count']} шт.")
+                except Exception as e:
+                    logger.exception(f"❌ Ошибка нарезки панорамы {file_id}: {str(e)}")
+                    manifest = {"status": "failed", "error": str(e)}
+
+            # Панораму могли заменить, пока шла нарезка
+            db.refresh(obj)
+            if obj.tour_360_file_id != file_id:
+                if output_dir and output_dir.exists():
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                return None
+
+            metadata = json.loads(obj.tour_360_metadata) if obj.tour_360_metadata else {}
+            metadata["multires"] = manifest
+            obj.tour_360_metadata = json.dumps(metadata, ensure_ascii=False)
+            db.commit()
+            return manifest
+        finally:
+            db.close()
+
+
+def get_multires_config(tour_360_metadata: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Возвращает конфигурацию multiRes для Pannellum, если тайлы уже готовы"""
+    if not tour_360_metadata:
+        return None
+    try:
+        metadata = json.loads(tour_360_metadata)
+    except (TypeError, ValueError):
+        return None
+    multires = metadata.get("multires") if isinstance(metadata, dict) else None
+    if not multires or multires.get("status") != "ready":
+        return None
+    return multires.get("config")
+
+
+def mark_multires_pending(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Отмечает в метаданных, что нарезка тайлов поставлена в очередь"""
+    metadata = dict(metadata or {})
+    metadata["multires"] = {"status": "pending"}
+    return metadata
+
+
+panorama_tiler = PanoramaTiler()
@@ -0,0 +1,123 @@
+"""
+Хеширование и проверка паролей вне event loop.
+
+Одна проверка bcrypt занимает 100-300 мс процессорного времени. Если вызвать
+ее прямо в async обработчике, на это время останавливаются все остальные
+запросы и WebSocket соединения воркера. Поэтому bcrypt выполняется в
+отдельном небольшом пуле потоков (bcrypt отпускает GIL), а число одновременно
+ожидающих проверок ограничено. При наплыве входов лишние запросы сразу
+получают отказ, вместо того чтобы копить очередь.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.utils.security import get_password_hash, verify_and_update_password
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь проверок паролей заполнена или ожидание слишком долгое"""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Password hasher is busy")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_size: int, queue_timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._loop = loop
+        return self._semaphore
+
+    async def _run(self, func: Callable, *args) -> Any:
+        semaphore = self._get_semaphore()
+        # Счетчики меняются без await между проверкой и увеличением, поэтому лимит точный
+        if self.waiting + self.running >= self.workers + self.queue_size:
+            self.rejected += 1
+            logger.warning(f"⚠️ Очередь проверки паролей заполнена ({self.queue_size}), запрос отклонен")
+            raise PasswordHasherBusy()
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"⚠️ Проверка пароля ждала дольше {self.queue_timeout} с, запрос отклонен")
+            raise PasswordHasherBusy()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Проверяет пароль. Вторым значением возвращает новый хеш, если сохраненный
+        посчитан с другой стоимостью (AUTH_BCRYPT_ROUNDS) - его нужно записать в БД.
+        """
+        valid, new_hash = await self._run(verify_and_update_password, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    async def verify_user(self, db, user, password: str) -> bool:
+        """Проверяет пароль пользователя и при необходимости сохраняет пересчитанный хеш"""
+        valid, new_hash = await self.verify(password, user.hashed_password)
+        if valid and new_hash:
+            try:
+                user.hashed_password = new_hash
+                db.commit()
+                logger.info(f"🔐 Хеш пароля пользователя {user.id} пересчитан с новой стоимостью")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Не удалось сохранить пересчитанный хеш пароля: {e}")
+        return valid
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+
+password_hasher = PasswordHasher(
+    settings.AUTH_HASH_WORKERS,
+    settings.AUTH_HASH_QUEUE_SIZE,
+    settings.AUTH_HASH_QUEUE_TIMEOUT_SECONDS,
+)
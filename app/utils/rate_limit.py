@@ -0,0 +1,434 @@
+"""
+Ограничение частоты запросов (скользящее окно) для дорогих эндпоинтов:
+отправка SMS кода, проверка кода, вход, инициация Telegram авторизации.
+
+Счетчик скользящего окна хранит для ключа только два числа - попытки в
+текущем и предыдущем фиксированном окне; оценка за последние window секунд:
+    previous * (доля предыдущего окна, попавшая в скользящее) + current
+Проверка - O(1) по времени и памяти на ключ.
+
+MemoryRateLimitBackend - счетчики в памяти процесса, разбитые на шарды со
+своими блокировками; ключи истекают сами (через два окна без попыток), размер
+шарда ограничен. RedisRateLimitBackend - те же счетчики в Redis (INCR + EXPIRE),
+общие для всех воркеров (RATE_LIMIT_STORE_URL=redis://...).
+Отклоненные попытки не учитываются: за любые window секунд проходит не больше
+limit попыток, и ожидание после отказа не растет от повторов.
+
+Для "не чаще раза в N секунд" скользящее окно не подходит (оценка с долей
+предыдущего окна держит ключ почти два окна) - для этого Cooldown: ключ с
+истечением через N секунд, в Redis - SET NX EX.
+
+Лимиты подключаются декоратором:
+
+    @router.post("/send-code")
+    @rate_limit(
+        Cooldown("sms_phone", 60, key="phone", field="contact"),
+        RateLimit("sms_ip", 20, 3600, key="ip"),
+    )
+    async def send_code(...):
+"""
+import functools
+import inspect
+import json
+import logging
+import math
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend(ABC):
+    """Базовый интерфейс хранилища счетчиков"""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, int]:
+        """
+        Учитывает попытку, если она укладывается в лимит.
+        Возвращает (разрешена ли, через сколько секунд повторить).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def cooldown(self, key: str, seconds: int) -> Tuple[bool, int]:
+        """
+        Ставит паузу на seconds секунд, если ее еще нет.
+        Возвращает (разрешена ли, через сколько секунд пауза закончится).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def undo(self, key: str, window: int):
+        """Снимает попытку, учтенную hit в текущем окне (запрос не выполнен)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release(self, key: str):
+        """Снимает паузу, поставленную cooldown"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reset(self, key: str, window: int):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+def get_sliding_count(previous: int, current: int, window: int, now: float) -> float:
+    elapsed = now % window
+    return previous * (window - elapsed) / window + current
+
+
+def get_retry_after(previous: int, current: int, limit: int, window: int, now: float) -> int:
+    """Через сколько секунд следующая попытка уложится в лимит (если не будет новых)"""
+    left = window - now % window
+    if previous and current + 1 <= limit:
+        # Хватит того, что доля предыдущего окна уменьшится еще в этом окне
+        delay = left - (limit - current - 1) * window / previous
+        if delay < left:
+            return max(1, math.ceil(delay))
+    # Ждем следующего окна, в котором текущие попытки станут предыдущими
+    delay = left + (max(0.0, window - (limit - 1) * window / current) if current else 0.0)
+    return max(1, math.ceil(delay))
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    SHARDS = 16
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys_per_shard = max(1, max_keys // self.SHARDS)
+        # Шард: ключ -> [номер текущего окна, попытки в нем, попытки в предыдущем, момент истечения]
+        self._shards: List["OrderedDict[str, list]"] = [OrderedDict() for _ in range(self.SHARDS)]
+        self._locks = [threading.Lock() for _ in range(self.SHARDS)]
+        self.evicted = 0
+
+    def _get_shard(self, key: str) -> int:
+        return hash(key) % self.SHARDS
+
+    def _expire(self, shard: "OrderedDict[str, list]", now: float):
+        # Ключи упорядочены по последнему обращению: истекшие собираются с начала
+        while shard:
+            key, entry = next(iter(shard.items()))
+            if entry[3] > now and len(shard) <= self.max_keys_per_shard:
+                break
+            shard.popitem(last=False)
+            if entry[3] > now:
+                self.evicted += 1
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_index = int(now // window)
+        index = self._get_shard(key)
+        with self._locks[index]:
+            shard = self._shards[index]
+            entry = shard.get(key)
+            if entry is None:
+                entry = [window_index, 0, 0, 0.0]
+                shard[key] = entry
+            else:
+                shard.move_to_end(key)
+                if entry[0] != window_index:
+                    # Окно сменилось: текущее становится предыдущим (или обнуляется, если прошло больше окна)
+                    entry[2] = entry[1] if entry[0] == window_index - 1 else 0
+                    entry[1] = 0
+                    entry[0] = window_index
+
+            allowed = get_sliding_count(entry[2], entry[1] + 1, window, now) <= limit
+            if allowed:
+                entry[1] += 1
+            entry[3] = (window_index + 2) * window
+            previous, current = entry[2], entry[1]
+            self._expire(shard, now)
+
+        if not allowed:
+            return False, get_retry_after(previous, current, limit, window, now)
+        return True, 0
+
+    async def cooldown(self, key: str, seconds: int) -> Tuple[bool, int]:
+        now = time.time()
+        index = self._get_shard(key)
+        with self._locks[index]:
+            shard = self._shards[index]
+            entry = shard.get(key)
+            if entry is not None and entry[3] > now:
+                return False, max(1, math.ceil(entry[3] - now))
+            # Пауза хранится как запись счетчика без окна: истекает и вытесняется так же
+            shard[key] = [None, 0, 0, now + seconds]
+            shard.move_to_end(key)
+            self._expire(shard, now)
+        return True, 0
+
+    async def undo(self, key: str, window: int):
+        index = self._get_shard(key)
+        with self._locks[index]:
+            entry = self._shards[index].get(key)
+            if entry is not None and entry[0] == int(time.time() // window) and entry[1] > 0:
+                entry[1] -= 1
+
+    async def release(self, key: str):
+        index = self._get_shard(key)
+        with self._locks[index]:
+            self._shards[index].pop(key, None)
+
+    async def reset(self, key: str, window: int):
+        index = self._get_shard(key)
+        with self._locks[index]:
+            self._shards[index].pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": sum(len(shard) for shard in self._shards), "evicted": self.evicted}
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Счетчики окон в Redis: ключ на окно, INCR и EXPIRE в одной транзакции"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:", client=None):
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+
+    def _get_client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_index = int(now // window)
+        current_key = f"{self.prefix}{key}:{window_index}"
+        previous_key = f"{self.prefix}{key}:{window_index - 1}"
+        async with self._get_client().pipeline(transaction=True) as pipe:
+            pipe.incr(current_key)
+            pipe.expire(current_key, window * 2)
+            pipe.get(previous_key)
+            current, _, previous = await pipe.execute()
+        previous = int(previous or 0)
+
+        if get_sliding_count(previous, current, window, now) > limit:
+            # Отклоненная попытка не учитывается
+            await self._get_client().decr(current_key)
+            return False, get_retry_after(previous, current - 1, limit, window, now)
+        return True, 0
+
+    async def cooldown(self, key: str, seconds: int) -> Tuple[bool, int]:
+        client = self._get_client()
+        cooldown_key = f"{self.prefix}{key}"
+        if await client.set(cooldown_key, int(time.time()), nx=True, ex=seconds):
+            return True, 0
+        ttl = await client.ttl(cooldown_key)
+        return False, max(1, ttl)
+
+    async def undo(self, key: str, window: int):
+        client = self._get_client()
+        current_key = f"{self.prefix}{key}:{int(time.time() // window)}"
+        # Ключ окна уже с TTL; если окно сменилось, ключа нет и снимать нечего
+        if int(await client.get(current_key) or 0) > 0:
+            await client.decr(current_key)
+
+    async def release(self, key: str):
+        await self._get_client().delete(f"{self.prefix}{key}")
+
+    async def reset(self, key: str, window: int):
+        window_index = int(time.time() // window)
+        await self._get_client().delete(
+            f"{self.prefix}{key}:{window_index}", f"{self.prefix}{key}:{window_index - 1}"
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_rate_limit_backend(url: Optional[str] = None) -> RateLimitBackend:
+    """Хранилище по настройке RATE_LIMIT_STORE_URL: redis://... или пусто для одного процесса"""
+    url = url if url is not None else settings.RATE_LIMIT_STORE_URL
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRateLimitBackend(url, prefix=settings.RATE_LIMIT_KEY_PREFIX)
+    return MemoryRateLimitBackend(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+
+
+rate_limit_backend = create_rate_limit_backend()
+
+
+def normalize_identity(value: Any) -> Optional[str]:
+    """Телефон - только цифры (+996 555... и 996555... один ключ), email - в нижнем регистре"""
+    value = str(value or "").strip().lower()
+    if not value:
+        return None
+    if "@" in value:
+        return value
+    digits = re.sub(r"\D", "", value)
+    return digits or None
+
+
+class RateLimit:
+    """
+    Лимит: не больше limit попыток за window секунд на один ключ.
+    key - по чему считать: "ip" (адрес клиента; за nginx - из X-Forwarded-For,
+    uvicorn --proxy-headers и FORWARDED_ALLOW_IPS), "phone" (поле формы field,
+    телефон или email), "user" (id пользователя из токена).
+    """
+
+    KEYS = ("ip", "phone", "user")
+
+    def __init__(self, name: str, limit: int, window: int, key: str = "ip", field: Optional[str] = None):
+        if key not in self.KEYS:
+            raise ValueError(f"Unknown rate limit key: {key}")
+        if key == "phone" and not field:
+            raise ValueError("Rate limit by phone needs the form field name")
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.key = key
+        self.field = field
+
+    def get_key(self, request: Request, arguments: Dict[str, Any]) -> Optional[str]:
+        if self.key == "ip":
+            identity = request.client.host if request.client else None
+        elif self.key == "phone":
+            identity = normalize_identity(arguments.get(self.field))
+        else:
+            from app.api import deps
+            principal = deps.get_request_principal(request)
+            identity = principal.user_id if principal else None
+        return f"{self.name}:{identity}" if identity is not None else None
+
+    async def check(self, backend: RateLimitBackend, key: str) -> Tuple[bool, int]:
+        return await backend.hit(key, self.limit, self.window)
+
+    async def undo(self, backend: RateLimitBackend, key: str):
+        await backend.undo(key, self.window)
+
+
+class Cooldown(RateLimit):
+    """Не чаще одной попытки в seconds секунд на ключ (например, повторная отправка кода)"""
+
+    def __init__(self, name: str, seconds: int, key: str = "ip", field: Optional[str] = None):
+        super().__init__(name, 1, seconds, key=key, field=field)
+
+    async def check(self, backend: RateLimitBackend, key: str) -> Tuple[bool, int]:
+        return await backend.cooldown(key, self.window)
+
+    async def undo(self, backend: RateLimitBackend, key: str):
+        await backend.release(key)
+
+
+def get_rate_limited_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"success": False, "error": f"Слишком много попыток. Повторите через {retry_after} с"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def check_rate_limits(
+    request: Request, arguments: Dict[str, Any], limits
+) -> Tuple[Optional[int], List[Tuple[RateLimit, str]]]:
+    """
+    Проверяет все лимиты. Возвращает (Retry-After первого превышенного или None,
+    учтенные попытки). Паузы (Cooldown) проверяются последними: пауза ставится,
+    только если прошли остальные лимиты. Если какой-то лимит превышен, уже
+    учтенные попытки снимаются - отклоненный запрос не учитывается нигде.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return None, []
+    acquired: List[Tuple[RateLimit, str]] = []
+    for limit in sorted(limits, key=lambda limit: isinstance(limit, Cooldown)):
+        key = limit.get_key(request, arguments)
+        if key is None:
+            continue
+        try:
+            allowed, retry_after = await limit.check(rate_limit_backend, key)
+        except Exception as e:
+            # Недоступное хранилище счетчиков не должно ломать вход
+            logger.error(f"❌ Ошибка хранилища лимитов: {e}")
+            return None, acquired
+        if not allowed:
+            logger.warning(f"⚠️ Превышен лимит {limit.name} для {key} (повтор через {retry_after} с)")
+            await undo_rate_limits(acquired)
+            return retry_after, []
+        acquired.append((limit, key))
+    return None, acquired
+
+
+async def undo_rate_limits(acquired: List[Tuple[RateLimit, str]]):
+    for limit, key in acquired:
+        try:
+            await limit.undo(rate_limit_backend, key)
+        except Exception as e:
+            logger.error(f"❌ Ошибка хранилища лимитов: {e}")
+
+
+def is_failed_response(result: Any) -> bool:
+    """Ответ эндпоинта об ошибке: статус >= 400 или {"success": false}"""
+    if isinstance(result, Response):
+        if result.status_code >= 400:
+            return True
+        if not isinstance(result, JSONResponse):
+            return False
+        try:
+            result = json.loads(result.body)
+        except ValueError:
+            return False
+    return isinstance(result, dict) and result.get("success") is False
+
+
+def rate_limit(*limits: RateLimit, refund_failed: bool = False) -> Callable:
+    """
+    Декоратор async эндпоинта FastAPI. Если у эндпоинта нет параметра Request,
+    он добавляется в сигнатуру (FastAPI его передаст) и не доходит до функции.
+
+    refund_failed=True - для отправки кодов: если эндпоинт упал или ответил
+    ошибкой (код не отправлен), попытка снимается со всех лимитов, в том числе
+    пауза. Для входа не подходит: неудачные попытки входа должны учитываться.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        request_param = next(
+            (param.name for param in signature.parameters.values() if param.annotation is Request),
+            None,
+        )
+        injected = request_param is None
+        if injected:
+            request_param = "_rate_limit_request"
+            signature = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            ])
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.pop(request_param) if injected else kwargs[request_param]
+            retry_after, acquired = await check_rate_limits(request, kwargs, limits)
+            if retry_after is not None:
+                return get_rate_limited_response(retry_after)
+            if not refund_failed:
+                return await func(*args, **kwargs)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                await undo_rate_limits(acquired)
+                raise
+            if is_failed_response(result):
+                await undo_rate_limits(acquired)
+            return result
+
+        wrapper.__signature__ = signature
+        return wrapper
+
+    return decorator
@@ -1,11 +1,18 @@
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Union, Optional, Tuple
 
 from jose import jwt
 from passlib.context import CryptContext
 from config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Хеши с другой стоимостью считаются устаревшими и пересчитываются при входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.AUTH_BCRYPT_ROUNDS,
+)
 
 ALGORITHM = settings.ALGORITHM
 
@@ -28,5 +35,12 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверяет пароль; если хеш устарел, вторым значением возвращает новый хеш"""
+    if not hashed_password:
+        return False, None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password) 
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Небольшой кеш строк пользователей для проверки авторизации.
+
+Почти каждый запрос начинается с поиска текущего пользователя по id из токена.
+Кеш хранит отсоединенные копии строк (LRU с ограниченным временем жизни) и
+присоединяет их к сессии запроса через merge(load=False) - без SELECT.
+Изменения и удаления пользователей через ORM сбрасывают запись сразу,
+массовые UPDATE/DELETE по таблице users очищают кеш целиком; изменения из
+других процессов видны не позже чем через AUTH_USER_CACHE_TTL_SECONDS.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app.models.user import User
+from config import settings
+
+
+class UserCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # id пользователя -> (момент истечения по time.monotonic, отсоединенная копия строки)
+        self._items: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _detached_copy(user: User) -> User:
+        values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        copy = User(**values)
+        make_transient_to_detached(copy)
+        return copy
+
+    def _get(self, user_id: int) -> Optional[User]:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[user_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(user_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, user: User):
+        copy = self._detached_copy(user)
+        with self._lock:
+            self._items[user.id] = (time.monotonic() + self.ttl, copy)
+            self._items.move_to_end(user.id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def load(self, db: Session, user_id: int) -> Optional[User]:
+        """Пользователь в сессии db: из кеша без запроса или из БД"""
+        cached = self._get(user_id)
+        if cached is not None:
+            return db.merge(cached, load=False)
+
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is not None:
+            self.put(user)
+        return user
+
+    async def load_async(self, db: AsyncSession, user_id: int) -> Optional[User]:
+        """То же для AsyncSession"""
+        cached = self._get(user_id)
+        if cached is not None:
+            return await db.merge(cached, load=False)
+
+        user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+        if user is not None:
+            self.put(user)
+        return user
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Сбрасывает одного пользователя или (без id) весь кеш"""
+        with self._lock:
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_TTL_SECONDS, settings.AUTH_USER_CACHE_SIZE)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_after_bulk(context):
+    if context.mapper is not None and context.mapper.class_ is User:
+        user_cache.invalidate()
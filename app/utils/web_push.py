@@ -0,0 +1,97 @@
+import os
+import json
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    from pywebpush import webpush, WebPushException
+except ImportError:
+    webpush = None
+    WebPushException = Exception
+    print("Warning: pywebpush not installed. Push notifications will not work.")
+
+# Get VAPID keys from environment variables
+VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY")
+VAPID_PUBLIC_KEY = os.environ.get("VAPID_PUBLIC_KEY")
+VAPID_CLAIMS = {
+    "sub": "mailto:admin@wazir.ru"
+}
+
+# Ответы push-сервиса, после которых подписка больше не действительна
+EXPIRED_STATUS_CODES = (404, 410)
+
+
+def save_subscription(db, subscription_data: Dict[str, Any], user_id: Optional[int] = None,
+                      user_agent: Optional[str] = None) -> bool:
+    """Сохраняет подписку (или обновляет существующую с тем же endpoint). True - если новая"""
+    from app.models.push_subscription import PushSubscription
+
+    endpoint = subscription_data["endpoint"]
+    subscription = db.query(PushSubscription).filter(PushSubscription.endpoint == endpoint).first()
+    is_new = subscription is None
+    if is_new:
+        subscription = PushSubscription(endpoint=endpoint)
+        db.add(subscription)
+    subscription.user_id = user_id
+    subscription.subscription = json.dumps(subscription_data)
+    subscription.user_agent = (user_agent or "")[:255] or None
+    db.commit()
+    return is_new
+
+
+def remove_subscription(db, endpoint: str) -> bool:
+    from app.models.push_subscription import PushSubscription
+
+    deleted = db.query(PushSubscription).filter(PushSubscription.endpoint == endpoint).delete()
+    db.commit()
+    return bool(deleted)
+
+
+def send_push(db, notification_data: Dict[str, Any], user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Отправляет уведомление подпискам пользователей user_ids (или всем, если None).
+    Вызов webpush блокирующий - из асинхронного кода запускать в пуле потоков.
+    Возвращает число успешно отправленных уведомлений.
+    """
+    from app.models.push_subscription import PushSubscription
+
+    if not VAPID_PRIVATE_KEY or webpush is None:
+        print("VAPID keys not configured, cannot send notifications")
+        return 0
+
+    query = db.query(PushSubscription)
+    if user_ids is not None:
+        query = query.filter(PushSubscription.user_id.in_(list(user_ids)))
+
+    sent = 0
+    expired = []
+    for subscription in query.all():
+        try:
+            webpush(
+                subscription_info=json.loads(subscription.subscription),
+                data=json.dumps(notification_data),
+                vapid_private_key=VAPID_PRIVATE_KEY,
+                vapid_claims=dict(VAPID_CLAIMS)
+            )
+            sent += 1
+        except Exception as e:
+            print(f"Error sending notification: {e}")
+            response = getattr(e, "response", None)
+            if response is not None and getattr(response, "status_code", 0) in EXPIRED_STATUS_CODES:
+                expired.append(subscription.id)
+
+    # Удаляем просроченные подписки
+    if expired:
+        db.query(PushSubscription).filter(PushSubscription.id.in_(expired)).delete(synchronize_session=False)
+        db.commit()
+    return sent
+
+
+def send_push_in_new_session(notification_data: Dict[str, Any], user_ids: Optional[Iterable[int]] = None) -> int:
+    """send_push со своей сессией БД - для фоновых задач"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return send_push(db, notification_data, user_ids)
+    finally:
+        db.close()
@@ -0,0 +1,315 @@
+"""
+Шина рассылки сообщений WebSocket между воркерами.
+
+Каждый воркер держит только свои соединения (ConnectionManager.active_connections),
+поэтому сообщение для пользователя публикуется в его канал, а доставляет его тот
+воркер, у которого есть соединения этого пользователя. Воркер подписан только на
+каналы пользователей, подключенных к нему.
+
+- InProcessBackplane - один процесс (по умолчанию, без внешних зависимостей).
+- RedisBackplane - Redis Pub/Sub, для нескольких воркеров uvicorn.
+
+Там же хранятся очереди сообщений для пользователей без соединений (офлайн),
+чтобы их мог выдать любой воркер, к которому пользователь подключится.
+"""
+import json
+import uuid
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Обработчик входящих сообщений: (канал, полезная нагрузка)
+MessageHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """Базовый интерфейс шины"""
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.channels: Set[str] = set()
+        self._handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+
+    @abstractmethod
+    async def subscribe(self, channel: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def change_presence(self, user_id: str, delta: int):
+        """Изменяет число соединений пользователя (по всем воркерам)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_presence(self, user_ids) -> Dict[str, bool]:
+        """Онлайн ли пользователи (есть ли у них соединения на каком-либо воркере)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def push_offline(self, user_id: str, message: Dict[str, Any]) -> int:
+        """Добавляет сообщение в офлайн-очередь пользователя, возвращает ее длину"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def pop_offline(self, user_id: str) -> List[Dict[str, Any]]:
+        """Забирает и очищает офлайн-очередь пользователя"""
+        raise NotImplementedError
+
+    async def close(self):
+        self.channels.clear()
+
+    async def _dispatch(self, channel: str, payload: Dict[str, Any]):
+        if not self._handler:
+            return
+        try:
+            await self._handler(channel, payload)
+        except Exception as e:
+            logger.error(f"❌ Ошибка доставки сообщения из канала {channel}: {e}")
+
+
+class InProcessBackplane(Backplane):
+    """Шина внутри одного процесса: публикация сразу вызывает обработчик"""
+
+    def __init__(self):
+        super().__init__()
+        self._presence: Dict[str, int] = {}
+        self._offline: Dict[str, Deque[Dict[str, Any]]] = {}
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        if channel in self.channels:
+            await self._dispatch(channel, payload)
+
+    async def change_presence(self, user_id: str, delta: int):
+        user_id = str(user_id)
+        count = self._presence.get(user_id, 0) + delta
+        if count > 0:
+            self._presence[user_id] = count
+        else:
+            self._presence.pop(user_id, None)
+
+    async def get_presence(self, user_ids) -> Dict[str, bool]:
+        return {str(user_id): str(user_id) in self._presence for user_id in user_ids}
+
+    async def push_offline(self, user_id: str, message: Dict[str, Any]) -> int:
+        # Старые сообщения вытесняются, они все равно есть в БД
+        queue = self._offline.setdefault(str(user_id), deque(maxlen=settings.CHAT_OFFLINE_QUEUE_MAX))
+        queue.append(message)
+        return len(queue)
+
+    async def pop_offline(self, user_id: str) -> List[Dict[str, Any]]:
+        return list(self._offline.pop(str(user_id), ()))
+
+
+class RedisBackplane(Backplane):
+    """
+    Шина на Redis Pub/Sub. Публикация - PUBLISH в канал пользователя,
+    чтение - одна фоновая задача на воркер с SUBSCRIBE только на нужные каналы.
+    При обрыве соединения подписки восстанавливаются.
+
+    Присутствие: у каждого воркера свой хеш пользователь -> число соединений
+    с TTL и отметка в общем sorted set живых воркеров. Воркер раз в треть TTL
+    переписывает хеш из своих счетчиков (заодно восстанавливая его после
+    перезапуска Redis), при остановке удаляет. Соединения упавшего воркера
+    перестают считаться через CHAT_PRESENCE_TTL_SECONDS.
+    """
+
+    RECONNECT_DELAY = 1.0
+    RECONNECT_DELAY_MAX = 30.0
+
+    def __init__(self, url: str, client=None):
+        super().__init__()
+        self.url = url
+        self._client = client
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Соединения пользователей на этом воркере - источник для продления записи присутствия
+        self._presence: Dict[str, int] = {}
+        self.presence_ttl = settings.CHAT_PRESENCE_TTL_SECONDS
+        self.presence_workers_key = f"{settings.CHAT_PRESENCE_KEY}:workers"
+        self.presence_key = f"{settings.CHAT_PRESENCE_KEY}:worker:{self.worker_id}"
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._reader = asyncio.create_task(self._read_loop())
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+        await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        await self._client.publish(channel, json.dumps(payload, ensure_ascii=False, default=str))
+
+    async def change_presence(self, user_id: str, delta: int):
+        user_id = str(user_id)
+        count = self._presence.get(user_id, 0) + delta
+        async with self._client.pipeline(transaction=True) as pipe:
+            if count > 0:
+                self._presence[user_id] = count
+                pipe.hset(self.presence_key, user_id, count)
+            else:
+                self._presence.pop(user_id, None)
+                pipe.hdel(self.presence_key, user_id)
+            pipe.expire(self.presence_key, self.presence_ttl)
+            pipe.zadd(self.presence_workers_key, {self.worker_id: time.time()})
+            await pipe.execute()
+
+    async def get_presence(self, user_ids) -> Dict[str, bool]:
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return {}
+        workers = await self._client.zrangebyscore(
+            self.presence_workers_key, time.time() - self.presence_ttl, "+inf"
+        )
+        online = dict.fromkeys(user_ids, False)
+        if not workers:
+            return online
+        async with self._client.pipeline(transaction=False) as pipe:
+            for worker_id in workers:
+                if isinstance(worker_id, bytes):
+                    worker_id = worker_id.decode()
+                pipe.hmget(f"{settings.CHAT_PRESENCE_KEY}:worker:{worker_id}", user_ids)
+            for counts in await pipe.execute():
+                for user_id, count in zip(user_ids, counts):
+                    if count and int(count) > 0:
+                        online[user_id] = True
+        return online
+
+    async def refresh_presence(self):
+        """Переписывает запись присутствия воркера и продлевает ее TTL"""
+        now = time.time()
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.presence_key)
+            if self._presence:
+                pipe.hset(self.presence_key, mapping=self._presence)
+                pipe.expire(self.presence_key, self.presence_ttl)
+            pipe.zadd(self.presence_workers_key, {self.worker_id: now})
+            # Упавшие воркеры больше не продлевают отметку - убираем их из списка
+            pipe.zremrangebyscore(self.presence_workers_key, "-inf", now - self.presence_ttl)
+            await pipe.execute()
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self.refresh_presence()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка продления присутствия в Redis: {e}")
+            await asyncio.sleep(self.presence_ttl / 3)
+
+    def get_offline_key(self, user_id) -> str:
+        return f"{settings.CHAT_OFFLINE_KEY_PREFIX}{user_id}"
+
+    async def push_offline(self, user_id: str, message: Dict[str, Any]) -> int:
+        key = self.get_offline_key(user_id)
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, json.dumps(message, ensure_ascii=False, default=str))
+            pipe.ltrim(key, -settings.CHAT_OFFLINE_QUEUE_MAX, -1)
+            pipe.expire(key, settings.CHAT_OFFLINE_QUEUE_TTL_SECONDS)
+            pipe.llen(key)
+            results = await pipe.execute()
+        return int(results[-1])
+
+    async def pop_offline(self, user_id: str) -> List[Dict[str, Any]]:
+        key = self.get_offline_key(user_id)
+        # LRANGE и DEL в одной транзакции: очередь выдается только одному воркеру
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key)
+            items, _ = await pipe.execute()
+        return [json.loads(item) for item in items]
+
+    async def _read_loop(self):
+        delay = self.RECONNECT_DELAY
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    # Пока нет подписок, читать нечего
+                    await asyncio.sleep(0.1)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+                delay = self.RECONNECT_DELAY
+                if not message or message.get("type") != "message":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                await self._dispatch(channel, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения Redis Pub/Sub: {e}, повтор через {delay} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+                try:
+                    # Новое соединение и повторная подписка на каналы воркера
+                    await self._pubsub.reset()
+                    if self.channels:
+                        await self._pubsub.subscribe(*self.channels)
+                except Exception as reconnect_error:
+                    logger.error(f"❌ Не удалось переподписаться на каналы: {reconnect_error}")
+
+    async def close(self):
+        for task in (self._reader, self._heartbeat):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reader = self._heartbeat = None
+        if self._pubsub:
+            await self._pubsub.reset()
+        if self._client:
+            # Соединения этого воркера больше не считаются онлайн
+            try:
+                async with self._client.pipeline(transaction=True) as pipe:
+                    pipe.delete(self.presence_key)
+                    pipe.zrem(self.presence_workers_key, self.worker_id)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"❌ Ошибка удаления присутствия воркера: {e}")
+            self._presence.clear()
+            await self._client.aclose()
+        await super().close()
+
+
+def create_backplane(url: Optional[str] = None) -> Backplane:
+    """Шина по настройке CHAT_BACKPLANE_URL: redis://... или пусто для одного процесса"""
+    url = url if url is not None else settings.CHAT_BACKPLANE_URL
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    return InProcessBackplane()
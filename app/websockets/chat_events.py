@@ -0,0 +1,164 @@
+import asyncio
+import threading
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+from app.utils.db_replicas import use_primary
+from config import settings
+
+
+class ChatEventHub:
+    """
+    Служебные события чата: присутствие, набор текста и отметки о прочтении.
+
+    События не отправляются сразу, а копятся и раз в тик (CHAT_EVENT_TICK_SECONDS)
+    уходят получателям:
+    - набор текста - только последнее состояние на пару (получатель, отправитель);
+    - присутствие - только если состояние пользователя изменилось с прошлого тика,
+      поэтому быстрые переподключения мобильных клиентов не создают шума;
+    - прочтение - одна "водяная отметка" (прочитано до message_id) на пару
+      собеседников: все отметки за тик записываются в БД одной транзакцией,
+      а отправителю уходит одно событие read_receipt.
+    """
+
+    def __init__(self, manager, tick_seconds: float):
+        self.manager = manager
+        self.tick_seconds = tick_seconds
+
+        # получатель -> ключ -> событие
+        self._pending_events: Dict[str, Dict[Hashable, Dict[str, Any]]] = {}
+        self._pending_presence: Set[str] = set()
+        self._last_presence: Dict[str, bool] = {}
+        # (читатель, собеседник) -> (до какого message_id прочитано, нужно ли писать в БД)
+        self._pending_reads: Dict[Tuple[int, int], Tuple[int, bool]] = {}
+        # Отметки о прочтении приходят и из синхронных эндпоинтов (пул потоков)
+        self._reads_lock = threading.Lock()
+
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Отметки о прочтении пишутся в БД до рассылки, поэтому сохраняются,
+        # даже если шина уже недоступна
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"ERROR: Ошибка отправки событий чата при остановке: {e}")
+
+    # --- Прием событий ---
+
+    def typing(self, sender_id, receiver_id, is_typing: bool):
+        event = {
+            "type": "typing",
+            "chat_id": self.manager.get_chat_id(sender_id, receiver_id),
+            "user_id": int(sender_id),
+            "is_typing": bool(is_typing),
+        }
+        self._pending_events.setdefault(str(receiver_id), {})[("typing", str(sender_id))] = event
+
+    def presence_changed(self, user_id):
+        self._pending_presence.add(str(user_id))
+
+    def mark_read(self, reader_id: int, other_user_id: int, message_id: int, persist: bool = True):
+        """
+        Читатель прочитал входящие от other_user_id до message_id включительно.
+        persist=False - сообщения уже отмечены в БД, нужно только уведомить отправителя.
+        """
+        key = (int(reader_id), int(other_user_id))
+        with self._reads_lock:
+            current_id, current_persist = self._pending_reads.get(key, (0, False))
+            self._pending_reads[key] = (max(current_id, int(message_id)), current_persist or persist)
+
+    # --- Отправка ---
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"ERROR: Ошибка отправки событий чата: {e}")
+
+    async def flush(self):
+        await self._flush_reads()
+        await self._flush_presence()
+
+        pending_events, self._pending_events = self._pending_events, {}
+        for receiver_id, events in pending_events.items():
+            for event in events.values():
+                await self.manager.publish_event(receiver_id, event)
+
+    async def _flush_presence(self):
+        if not self._pending_presence:
+            return
+        user_ids, self._pending_presence = self._pending_presence, set()
+        states = await self.manager.backplane.get_presence(user_ids)
+        for user_id, online in states.items():
+            if self._last_presence.get(user_id, False) == online:
+                continue
+            if online:
+                self._last_presence[user_id] = True
+            else:
+                self._last_presence.pop(user_id, None)
+            await self.manager.publish_presence(user_id, online)
+
+    async def _flush_reads(self):
+        with self._reads_lock:
+            reads, self._pending_reads = self._pending_reads, {}
+        if not reads:
+            return
+
+        to_persist = [(reader_id, other_id, up_to) for (reader_id, other_id), (up_to, persist) in reads.items() if persist]
+        if to_persist:
+            try:
+                await self._persist_reads(to_persist)
+            except Exception as e:
+                print(f"ERROR: Ошибка записи отметок о прочтении: {e}")
+
+        for (reader_id, other_id), (up_to, _) in reads.items():
+            await self.manager.publish_event(str(other_id), {
+                "type": "read_receipt",
+                "chat_id": self.manager.get_chat_id(reader_id, other_id),
+                "user_id": reader_id,
+                "up_to_message_id": up_to,
+            })
+
+    async def _persist_reads(self, reads):
+        """Все отметки о прочтении за тик - одной транзакцией в async сессии"""
+        from database import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as db:
+            await db.run_sync(self._persist_reads_sync, reads)
+
+    def _persist_reads_sync(self, db, reads):
+        from sqlalchemy import or_, and_
+        from app.models.chat import AppChatModel, AppChatMessageModel
+
+        # Сообщения, которые отмечаются прочитанными, могли еще не дойти до реплики
+        use_primary(db)
+        for reader_id, other_id, up_to in reads:
+            chat = db.query(AppChatModel).filter(
+                or_(
+                    and_(AppChatModel.user1_id == reader_id, AppChatModel.user2_id == other_id),
+                    and_(AppChatModel.user1_id == other_id, AppChatModel.user2_id == reader_id)
+                )
+            ).order_by(AppChatModel.id).first()
+            if not chat:
+                continue
+            updated = db.query(AppChatMessageModel).filter(
+                AppChatMessageModel.chat_id == chat.id,
+                AppChatMessageModel.sender_id == other_id,
+                AppChatMessageModel.id <= up_to,
+                AppChatMessageModel.is_read == False
+            ).update({AppChatMessageModel.is_read: True}, synchronize_session=False)
+            AppChatModel.record_read(db, chat, reader_id, updated)
+        db.commit()
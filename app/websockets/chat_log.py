@@ -0,0 +1,329 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import fcntl
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+class ChatLog:
+    """
+    Журнал сообщений чатов только на добавление.
+
+    Каждая комната - каталог с JSONL-сегментами (000001.jsonl, 000002.jsonl, ...).
+    Новое сообщение дописывается одной строкой в текущий сегмент, поэтому
+    стоимость записи O(1) и не зависит от объема истории.
+
+    - Запись идет в фоновом потоке: обработчик только кладет сообщение в очередь.
+    - fsync выполняется один раз на пачку, не чаще FSYNC_INTERVAL секунд.
+    - Индекс id -> (сегмент, смещение) в памяти дает дедупликацию за O(1).
+    - Запись в сегмент под flock, так что несколько процессов не портят файл;
+      возможные дубликаты между процессами отбрасываются при загрузке и компакции.
+    - Закрытые сегменты комнаты периодически сливаются в один (компакция).
+      Файл блокировки комнаты: запись и загрузка держат его разделяемо,
+      компакция - эксклюзивно, поэтому воркеры не удаляют сегменты, которые
+      другой процесс еще читает или дописывает.
+
+    Объект создается без обращения к диску; перенос старого файла, загрузка
+    и поток записи запускаются в start() (lifespan приложения).
+    """
+
+    SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+    FSYNC_INTERVAL = 0.05
+    BATCH_MAX_MESSAGES = 500
+    COMPACT_MIN_SEGMENTS = 4
+    COMPACT_INTERVAL = 300
+
+    ROOM_NAME_RE = re.compile(r"[^0-9A-Za-z_-]")
+    LOCK_NAME = ".lock"
+
+    def __init__(self, log_dir: Path = PROJECT_ROOT / "chat_log",
+                 legacy_file: Optional[Path] = PROJECT_ROOT / "chat_messages.json"):
+        self.log_dir = Path(log_dir)
+        self.legacy_file = Path(legacy_file) if legacy_file else None
+
+        # Сообщения в памяти по комнатам (как раньше chat_messages) и индекс для дедупликации
+        self.rooms: Dict[str, List[dict]] = {}
+        self.index: Dict[str, Dict[str, Tuple[int, int]]] = {}
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._last_compaction = time.monotonic()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+
+    def start(self):
+        """Переносит chat_messages.json, загружает журнал и запускает поток записи"""
+        if self._writer is not None:
+            return
+        # Переносит файл один воркер: остальные ждут блокировку и видят, что файла уже нет
+        with self._room_lock(self.log_dir, fcntl.LOCK_EX):
+            self._migrate_legacy_file()
+        self._load()
+
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="chat-log-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # --- Пути и сегменты ---
+
+    def _room_dir(self, room: str) -> Path:
+        return self.log_dir / self.ROOM_NAME_RE.sub("_", room)
+
+    @staticmethod
+    def _segment_name(segment: int) -> str:
+        return f"{segment:06d}.jsonl"
+
+    @contextmanager
+    def _room_lock(self, room_dir: Path, mode: int):
+        """flock на файл блокировки комнаты: LOCK_SH - запись и чтение, LOCK_EX - компакция"""
+        room_dir.mkdir(parents=True, exist_ok=True)
+        with open(room_dir / self.LOCK_NAME, "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _segments(self, room_dir: Path) -> List[int]:
+        if not room_dir.exists():
+            return []
+        return sorted(int(p.stem) for p in room_dir.glob("*.jsonl") if p.stem.isdigit())
+
+    # --- Загрузка ---
+
+    def _migrate_legacy_file(self):
+        """Однократно переносит старый chat_messages.json в сегменты журнала"""
+        if not self.legacy_file or not self.legacy_file.exists():
+            return
+        try:
+            data = self.legacy_file.read_text(encoding="utf-8")
+            legacy_rooms = json.loads(data) if data.strip() else {}
+            for room, messages in legacy_rooms.items():
+                if self._segments(self._room_dir(room)):
+                    continue
+                room_dir = self._room_dir(room)
+                room_dir.mkdir(parents=True, exist_ok=True)
+                with open(room_dir / self._segment_name(1), "wb") as f:
+                    for message in messages:
+                        if isinstance(message, dict):
+                            f.write(self._encode(room, message))
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.legacy_file.rename(self.legacy_file.with_name(self.legacy_file.name + ".migrated"))
+            print(f"DEBUG: chat_messages.json перенесен в журнал чатов, комнат: {len(legacy_rooms)}")
+        except Exception as e:
+            print(f"ERROR: Ошибка при переносе chat_messages.json в журнал: {e}")
+
+    def _load(self):
+        for room_dir in sorted(p for p in self.log_dir.iterdir() if p.is_dir()):
+            with self._room_lock(room_dir, fcntl.LOCK_SH):
+                for segment in self._segments(room_dir):
+                    with open(room_dir / self._segment_name(segment), "rb") as f:
+                        offset = 0
+                        for line in f:
+                            line_offset = offset
+                            offset += len(line)
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                # Недописанная строка после сбоя - пропускаем
+                                continue
+                            self._remember(record["room"], record["message"], (segment, line_offset),
+                                           record.get("dedupe", True))
+        print(f"DEBUG: Журнал чатов загружен. Комнат: {len(self.rooms)}")
+
+    def _remember(self, room: str, message: dict, position: Tuple[int, int], deduplicate: bool = True) -> bool:
+        room_index = self.index.setdefault(room, {})
+        message_id = message.get("id")
+        if message_id is not None:
+            key = str(message_id)
+            if deduplicate and key in room_index:
+                return False
+            room_index[key] = position
+        self.rooms.setdefault(room, []).append(message)
+        return True
+
+    # --- Публичный API ---
+
+    def append(self, room: str, message: dict, deduplicate: bool = True) -> bool:
+        """Добавляет сообщение в комнату. Возвращает False, если id уже есть"""
+        with self._lock:
+            if not self._remember(room, message, (0, -1), deduplicate):
+                return False
+        self._queue.put((room, message, deduplicate))
+        return True
+
+    def get_messages(self, room: str) -> List[dict]:
+        return self.rooms.get(room, [])
+
+    def has_message(self, room: str, message_id) -> bool:
+        return str(message_id) in self.index.get(room, {})
+
+    def flush(self):
+        """Дожидается записи всех сообщений из очереди на диск"""
+        if self._writer is None:
+            return
+        self._queue.join()
+
+    def close(self):
+        if self._closed or self._writer is None:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        self._writer = None
+
+    # --- Фоновая запись ---
+
+    def _writer_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.COMPACT_INTERVAL)
+            except queue.Empty:
+                self._compact_all()
+                continue
+
+            batch = [item]
+            # Собираем пачку: все, что накопилось за FSYNC_INTERVAL
+            deadline = time.monotonic() + self.FSYNC_INTERVAL
+            while item is not None and len(batch) < self.BATCH_MAX_MESSAGES:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            stop = batch[-1] is None
+            records = [record for record in batch if record is not None]
+            try:
+                self._write_batch(records)
+            except Exception as e:
+                print(f"ERROR: Ошибка записи журнала чатов: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                return
+            if time.monotonic() - self._last_compaction > self.COMPACT_INTERVAL:
+                self._compact_all()
+
+    @staticmethod
+    def _encode(room: str, message: dict, deduplicate: bool = True) -> bytes:
+        record = {"room": room, "message": message}
+        if not deduplicate:
+            record["dedupe"] = False
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _write_batch(self, records: List[Tuple[str, dict, bool]]):
+        by_room: Dict[str, List[Tuple[dict, bool]]] = {}
+        for room, message, deduplicate in records:
+            by_room.setdefault(room, []).append((message, deduplicate))
+
+        for room, messages in by_room.items():
+            room_dir = self._room_dir(room)
+            with self._room_lock(room_dir, fcntl.LOCK_SH):
+                self._append_to_room(room, room_dir, messages)
+
+    def _append_to_room(self, room: str, room_dir: Path, messages: List[Tuple[dict, bool]]):
+        segments = self._segments(room_dir)
+        segment = segments[-1] if segments else 1
+        segment_path = room_dir / self._segment_name(segment)
+
+        if segment_path.exists() and segment_path.stat().st_size >= self.SEGMENT_MAX_BYTES:
+            segment += 1
+            segment_path = room_dir / self._segment_name(segment)
+
+        with open(segment_path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                for message, deduplicate in messages:
+                    line = self._encode(room, message, deduplicate)
+                    f.write(line)
+                    message_id = message.get("id")
+                    if message_id is not None:
+                        self.index[room][str(message_id)] = (segment, offset)
+                    offset += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # --- Компакция ---
+
+    def _compact_all(self):
+        self._last_compaction = time.monotonic()
+        for room in list(self.rooms.keys()):
+            try:
+                self._compact_room(room)
+            except Exception as e:
+                print(f"ERROR: Ошибка компакции журнала комнаты {room}: {e}")
+
+    def _compact_room(self, room: str):
+        """Сливает закрытые сегменты комнаты в один, убирая дубликаты"""
+        room_dir = self._room_dir(room)
+        if len(self._segments(room_dir)) <= self.COMPACT_MIN_SEGMENTS:
+            return
+        with self._room_lock(room_dir, fcntl.LOCK_EX):
+            self._compact_locked(room, room_dir)
+
+    def _compact_locked(self, room: str, room_dir: Path):
+        # Список сегментов перечитывается под блокировкой: другой воркер мог уже сжать комнату
+        for stale_path in room_dir.glob("*.compact"):
+            stale_path.unlink()
+        segments = self._segments(room_dir)
+        # Последний сегмент открыт на запись - его не трогаем
+        sealed = segments[:-1]
+        if len(sealed) < self.COMPACT_MIN_SEGMENTS:
+            return
+
+        target = sealed[0]
+        target_path = room_dir / self._segment_name(target)
+        tmp_path = room_dir / f"{self._segment_name(target)}.{os.getpid()}.compact"
+
+        seen = set()
+        positions: Dict[str, Tuple[int, int]] = {}
+        with open(tmp_path, "wb") as out:
+            offset = 0
+            for segment in sealed:
+                with open(room_dir / self._segment_name(segment), "rb") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        message_id = record["message"].get("id")
+                        if message_id is not None and record.get("dedupe", True):
+                            if str(message_id) in seen:
+                                continue
+                            seen.add(str(message_id))
+                            positions[str(message_id)] = (target, offset)
+                        out.write(line)
+                        offset += len(line)
+            out.flush()
+            os.fsync(out.fileno())
+
+        os.replace(tmp_path, target_path)
+        for segment in sealed[1:]:
+            os.remove(room_dir / self._segment_name(segment))
+
+        with self._lock:
+            self.index.setdefault(room, {}).update(positions)
+        print(f"DEBUG: Компакция журнала комнаты {room}: {len(sealed)} сегментов -> 1")
+
+
+chat_log = ChatLog()
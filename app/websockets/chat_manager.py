@@ -1,34 +1,270 @@
+from collections import OrderedDict
 from fastapi import WebSocket
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Set, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-from app.models.chat import AppChatModel, AppChatMessageModel
 from datetime import datetime
 import json
+import asyncio
+
+from config import settings
+from app.websockets.chat_log import chat_log
+from app.websockets.backplane import Backplane, create_backplane
+from app.websockets.send_queue import ConnectionSender
+from app.websockets.message_writer import message_writer
+from app.websockets.chat_events import ChatEventHub
+from app.websockets.offline_queue import OfflineDelivery
+from app.utils.db_replicas import use_primary
 
 
 class ConnectionManager:
-    def __init__(self):
+    # Сколько подтвержденных пар собеседников держать в памяти
+    PARTNER_CACHE_SIZE = 10000
+
+    def __init__(self, backplane: Backplane = None):
+        # Соединения только этого воркера; доставка между воркерами идет через шину
         self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.chat_messages: Dict[str, List[dict]] = {}
-        
-        # Загружаем сохраненные сообщения при запуске
-        self.load_messages_from_file()
+        # Исходящая очередь и писатель для каждого соединения
+        self.senders: Dict[WebSocket, ConnectionSender] = {}
+        self.slow_consumers_disconnected = 0
+        # Подписки на присутствие: за кем следят соединения этого воркера
+        self.presence_watchers: Dict[str, Set[WebSocket]] = {}
+        self.watched_users: Dict[WebSocket, Set[str]] = {}
+        # Сообщения в памяти общие с журналом чатов (загружаются из сегментов при старте)
+        self.chat_messages: Dict[str, List[dict]] = chat_log.rooms
+        self.backplane = backplane or create_backplane()
+        # Пары пользователей, у которых есть общий чат (набор текста и присутствие - только им)
+        self._partner_pairs: "OrderedDict[Tuple[int, int], bool]" = OrderedDict()
+        self._backplane_started = False
+        self._backplane_lock = asyncio.Lock()
+        # Присутствие, набор текста и прочтение - с накоплением по тикам
+        self.events = ChatEventHub(self, settings.CHAT_EVENT_TICK_SECONDS)
+        # Сообщения для пользователей без соединений и push-уведомления о них
+        self.offline = OfflineDelivery(self, settings.CHAT_OFFLINE_PUSH_DEBOUNCE_SECONDS)
+    
+    def get_channel(self, user_id) -> str:
+        """Канал шины для пользователя"""
+        return f"{settings.CHAT_BACKPLANE_CHANNEL_PREFIX}{user_id}"
+    
+    def get_presence_channel(self, user_id) -> str:
+        """Канал шины с изменениями присутствия пользователя"""
+        return f"{settings.CHAT_PRESENCE_CHANNEL_PREFIX}{user_id}"
+    
+    async def start_backplane(self):
+        if self._backplane_started:
+            return
+        async with self._backplane_lock:
+            if not self._backplane_started:
+                await self.backplane.start(self._deliver)
+                self.events.start()
+                self._backplane_started = True
+    
+    async def close_backplane(self):
+        # Накопленные отметки о прочтении дописываем в БД, даже если шина не запускалась
+        await self.events.close()
+        if self._backplane_started:
+            await self.offline.close()
+            await self.backplane.close()
+            self._backplane_started = False
         
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
-        if user_id not in self.active_connections:
+        await self.start_backplane()
+        is_first_connection = user_id not in self.active_connections
+        if is_first_connection:
             self.active_connections[user_id] = []
         self.active_connections[user_id].append(websocket)
+        self.senders[websocket] = ConnectionSender(
+            websocket,
+            max_size=settings.CHAT_SEND_QUEUE_SIZE,
+            policy=settings.CHAT_SEND_QUEUE_POLICY,
+            send_timeout=settings.CHAT_SEND_TIMEOUT_SECONDS,
+            on_close=lambda sender: self._on_sender_closed(sender, user_id),
+        )
+        # Подписываемся на канал пользователя, только пока у воркера есть его соединения
+        if is_first_connection:
+            await self.backplane.subscribe(self.get_channel(user_id))
+        await self.backplane.change_presence(user_id, 1)
+        self.events.presence_changed(user_id)
+        
+        # Сообщения, пришедшие без соединений, отдаем одним кадром
+        offline_messages = await self.offline.drain(user_id)
+        if offline_messages:
+            await self.send_personal_message({
+                "type": "offline_messages",
+                "messages": offline_messages,
+            }, websocket)
     
     def disconnect(self, websocket: WebSocket, user_id: str):
-        if user_id in self.active_connections:
+        sender = self.senders.pop(websocket, None)
+        if sender:
+            sender.close()
+        self._unwatch_presence(websocket)
+        # Соединение могло быть уже убрано при отключении медленного клиента
+        if user_id in self.active_connections and websocket in self.active_connections[user_id]:
             self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
+            is_last_connection = not self.active_connections[user_id]
+            if is_last_connection:
                 del self.active_connections[user_id]
+            asyncio.ensure_future(self._connection_closed(user_id, is_last_connection))
+    
+    async def _connection_closed(self, user_id: str, is_last_connection: bool):
+        await self.backplane.change_presence(user_id, -1)
+        self.events.presence_changed(user_id)
+        # Пользователь мог переподключиться, пока задача ждала запуска
+        if is_last_connection and user_id not in self.active_connections:
+            await self.backplane.unsubscribe(self.get_channel(user_id))
+    
+    async def get_chat_partners(self, user_id, other_ids) -> Set[str]:
+        """Те из other_ids, с кем у user_id есть общий чат"""
+        user_id = int(user_id)
+        others = set()
+        for other_id in other_ids:
+            try:
+                others.add(int(other_id))
+            except (TypeError, ValueError):
+                continue
+
+        partners = set()
+        missing = []
+        for other_id in others:
+            pair = message_writer.get_pair(user_id, other_id)
+            if pair in self._partner_pairs:
+                self._partner_pairs.move_to_end(pair)
+                partners.add(other_id)
+            else:
+                missing.append(other_id)
+
+        if missing:
+            for other_id in await self._query_chat_partners(user_id, missing):
+                partners.add(other_id)
+                self._partner_pairs[message_writer.get_pair(user_id, other_id)] = True
+            while len(self._partner_pairs) > self.PARTNER_CACHE_SIZE:
+                self._partner_pairs.popitem(last=False)
+        return {str(other_id) for other_id in partners}
+
+    async def _query_chat_partners(self, user_id: int, other_ids: List[int]) -> Set[int]:
+        from sqlalchemy import select, or_, and_
+        from database import AsyncSessionLocal
+        from app.models.chat import AppChatModel
+
+        async with AsyncSessionLocal() as db:
+            # Чат мог быть создан только что - на реплике его может еще не быть
+            use_primary(db)
+            rows = await db.execute(
+                select(AppChatModel.user1_id, AppChatModel.user2_id).where(or_(
+                    and_(AppChatModel.user1_id == user_id, AppChatModel.user2_id.in_(other_ids)),
+                    and_(AppChatModel.user2_id == user_id, AppChatModel.user1_id.in_(other_ids)),
+                ))
+            )
+            return {user2_id if user1_id == user_id else user1_id for user1_id, user2_id in rows}
+
+    async def watch_presence(self, websocket: WebSocket, watcher_id, user_ids):
+        """
+        Подписывает соединение на присутствие собеседников и сразу сообщает текущее.
+        Чужие пользователи пропускаются, всего на соединение - не больше CHAT_PRESENCE_WATCH_MAX.
+        """
+        watched = self.watched_users.get(websocket, set())
+        available = settings.CHAT_PRESENCE_WATCH_MAX - len(watched)
+        if available <= 0 or not isinstance(user_ids, list):
+            return
+        requested = [str(user_id) for user_id in user_ids if str(user_id) not in watched][:available]
+        partners = await self.get_chat_partners(watcher_id, requested)
+        user_ids = [user_id for user_id in requested if user_id in partners]
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            watchers = self.presence_watchers.setdefault(user_id, set())
+            is_first_watcher = not watchers
+            watchers.add(websocket)
+            self.watched_users.setdefault(websocket, set()).add(user_id)
+            if is_first_watcher:
+                await self.backplane.subscribe(self.get_presence_channel(user_id))
+        
+        states = await self.backplane.get_presence(user_ids)
+        for user_id, online in states.items():
+            await self.send_personal_message(self.get_presence_event(user_id, online), websocket)
+    
+    def _unwatch_presence(self, websocket: WebSocket):
+        for user_id in self.watched_users.pop(websocket, set()):
+            watchers = self.presence_watchers.get(user_id)
+            if watchers is None:
+                continue
+            watchers.discard(websocket)
+            if not watchers:
+                del self.presence_watchers[user_id]
+                asyncio.ensure_future(self._release_presence_channel(user_id))
+    
+    async def _release_presence_channel(self, user_id: str):
+        if user_id not in self.presence_watchers:
+            await self.backplane.unsubscribe(self.get_presence_channel(user_id))
+    
+    @staticmethod
+    def get_presence_event(user_id, online: bool) -> dict:
+        return {"type": "presence", "user_id": int(user_id), "online": online}
+    
+    async def publish_event(self, user_id, event: dict):
+        """Отправляет служебное событие всем соединениям пользователя (на любом воркере)"""
+        await self.backplane.publish(self.get_channel(user_id), {
+            "origin": self.backplane.worker_id,
+            "exclude": None,
+            "message": event,
+        })
+    
+    async def publish_presence(self, user_id, online: bool):
+        await self.backplane.publish(self.get_presence_channel(user_id), {
+            "origin": self.backplane.worker_id,
+            "message": self.get_presence_event(user_id, online),
+        })
+    
+    def _on_sender_closed(self, sender: ConnectionSender, user_id: str):
+        # Писатель закрылся сам (переполнение или ошибка отправки) - убираем соединение
+        if self.senders.get(sender.websocket) is sender:
+            self.slow_consumers_disconnected += 1
+            self.disconnect(sender.websocket, user_id)
+    
+    def get_send_queue_stats(self) -> dict:
+        """Метрики исходящих очередей соединений этого воркера"""
+        senders = list(self.senders.values())
+        return {
+            "connections": len(senders),
+            "policy": settings.CHAT_SEND_QUEUE_POLICY,
+            "max_size": settings.CHAT_SEND_QUEUE_SIZE,
+            "queued": sum(sender.depth for sender in senders),
+            "max_depth": max((sender.max_depth for sender in senders), default=0),
+            "sent": sum(sender.sent for sender in senders),
+            "dropped": sum(sender.dropped for sender in senders),
+            "coalesced": sum(sender.coalesced for sender in senders),
+            "slow_consumers_disconnected": self.slow_consumers_disconnected,
+            "offline": self.offline.stats(),
+        }
+    
+    async def _deliver(self, channel: str, payload: dict):
+        """Доставляет сообщение из шины локальным соединениям пользователя"""
+        if channel.startswith(settings.CHAT_PRESENCE_CHANNEL_PREFIX):
+            watched_user_id = channel[len(settings.CHAT_PRESENCE_CHANNEL_PREFIX):]
+            for connection in list(self.presence_watchers.get(watched_user_id, ())):
+                sender = self.senders.get(connection)
+                if sender:
+                    sender.send(payload["message"])
+            return
+        
+        user_id = channel[len(settings.CHAT_BACKPLANE_CHANNEL_PREFIX):]
+        # Исключать соединение имеет смысл только на воркере, который его передал
+        exclude = payload.get("exclude") if payload.get("origin") == self.backplane.worker_id else None
+        for connection in list(self.active_connections.get(user_id, [])):
+            if id(connection) == exclude:
+                continue
+            sender = self.senders.get(connection)
+            if sender:
+                # Не ждем отправки: сообщение уходит через очередь соединения
+                sender.send(payload["message"])
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        sender = self.senders.get(websocket)
+        if sender:
+            sender.send(message)
+        else:
+            await websocket.send_json(message)
     
     async def broadcast(self, message: dict, exclude: WebSocket = None):
         # Получаем ID получателя
@@ -47,10 +283,18 @@ class ConnectionManager:
             else:
                 print(f"ERROR: Не удалось определить sender_id или receiver_id в сообщении: {message}")
         
-        # Отправляем сообщение всем соединениям получателя
-        for connection in self.active_connections.get(receiver_id, []):
-            if connection != exclude:
-                await connection.send_json(message)
+        # Получатель не подключен ни к одному воркеру - сообщение ждет его в офлайн-очереди
+        if message.get("type") == "new_message":
+            states = await self.backplane.get_presence([receiver_id])
+            if not states.get(str(receiver_id)):
+                await self.offline.enqueue(receiver_id, message)
+        
+        # Публикуем в канал получателя: доставит воркер, к которому он подключен
+        await self.backplane.publish(self.get_channel(receiver_id), {
+            "origin": self.backplane.worker_id,
+            "exclude": id(exclude) if exclude is not None else None,
+            "message": message,
+        })
     
     def is_user_online(self, user_id: str) -> bool:
         return user_id in self.active_connections and len(self.active_connections[user_id]) > 0
@@ -73,57 +317,16 @@ class ConnectionManager:
         # Формируем уникальный идентификатор чата в формате "user1_id-user2_id"
         return f"{user1_id}-{user2_id}"
     
-    async def save_message_to_db(self, message_data: dict, db: Session):
+    async def save_message_to_db(self, message_data: dict, db: Session = None):
+        """
+        Сохраняет сообщение через групповую запись (message_writer) и возвращает его
+        после commit. Параметр db оставлен для совместимости и не используется.
+        """
+        sender_id = message_data.get("sender_id")
+        receiver_id = message_data.get("receiver_id")
+        content = message_data.get("content")
         try:
-            sender_id = message_data["sender_id"]
-            receiver_id = message_data["receiver_id"]
-            content = message_data["content"]
-            
-            # Находим или создаем чат между отправителем и получателем
-            chat = db.query(AppChatModel).filter(
-                or_(
-                    and_(AppChatModel.user1_id == sender_id, AppChatModel.user2_id == receiver_id),
-                    and_(AppChatModel.user1_id == receiver_id, AppChatModel.user2_id == sender_id)
-                )
-            ).first()
-            
-            if not chat:
-                # Создаем новый чат
-                chat = AppChatModel(
-                    user1_id=sender_id,
-                    user2_id=receiver_id
-                )
-                db.add(chat)
-                db.commit()
-                db.refresh(chat)
-            
-            # Создаем новое сообщение
-            current_time = datetime.now()
-            db_message = AppChatMessageModel(
-                chat_id=chat.id,
-                sender_id=sender_id,
-                content=content,
-                is_read=False,
-                created_at=current_time  # Явно задаем время создания
-            )
-            
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            
-            # Проверяем, что created_at не None
-            timestamp = current_time.isoformat() if db_message.created_at is None else db_message.created_at.isoformat()
-            
-            # Возвращаем сообщение в формате JSON
-            return {
-                "id": db_message.id,
-                "chat_id": db_message.chat_id,
-                "sender_id": db_message.sender_id,
-                "receiver_id": receiver_id,  # Добавляем receiver_id для удобства
-                "content": db_message.content,
-                "timestamp": timestamp,
-                "is_read": db_message.is_read
-            }
+            return await message_writer.submit(message_data)
         except Exception as e:
             print(f"ERROR: Ошибка при сохранении сообщения в базу данных: {e}")
             
@@ -146,58 +349,16 @@ class ConnectionManager:
             }
             return temp_message
     
-    def load_messages_from_file(self):
-        """Загружает сообщения из JSON-файла"""
-        try:
-            import os
-            import json
-            
-            if os.path.exists("chat_messages.json"):
-                with open("chat_messages.json", "r", encoding="utf-8") as f:
-                    data = f.read()
-                    if data.strip():  # проверяем, что файл не пустой
-                        self.chat_messages = json.loads(data)
-                        print(f"DEBUG: Загружены сохраненные сообщения чатов. Доступные комнаты: {list(self.chat_messages.keys())}")
-                        for room, messages in self.chat_messages.items():
-                            print(f"DEBUG: Комната {room}: {len(messages)} сообщений")
-                            # Выводим первое и последнее сообщение для отладки
-                            if messages:
-                                print(f"DEBUG: Первое сообщение: {messages[0].get('content', 'Нет контента')}")
-                                if len(messages) > 1:
-                                    print(f"DEBUG: Последнее сообщение: {messages[-1].get('content', 'Нет контента')}")
-            else:
-                print("DEBUG: Файл с сообщениями не найден")
-        except Exception as e:
-            print(f"ERROR: Ошибка при загрузке сообщений из файла: {e}")
-            self.chat_messages = {}
-    
     def save_messages_to_file(self):
-        """Сохраняет сообщения в JSON-файл"""
-        try:
-            import json
-            with open("chat_messages.json", "w", encoding="utf-8") as f:
-                json.dump(self.chat_messages, f, ensure_ascii=False, indent=2)
-            print(f"DEBUG: Сообщения сохранены в файл. Всего комнат: {len(self.chat_messages)}")
-        except Exception as e:
-            print(f"ERROR: Ошибка при сохранении сообщений в файл: {e}")
+        """Дожидается записи журнала чатов на диск (сообщения пишутся по одному при добавлении)"""
+        chat_log.flush()
     
     def add_message_to_memory(self, chat_id: str, message: dict):
-        """Добавляет сообщение в память и сохраняет в файл"""
-        if chat_id not in self.chat_messages:
-            self.chat_messages[chat_id] = []
-        
-        # Проверяем, есть ли уже сообщение с таким ID
-        for existing_msg in self.chat_messages[chat_id]:
-            if existing_msg.get("id") == message.get("id"):
-                print(f"DEBUG: Сообщение с ID {message.get('id')} уже существует, пропускаем")
-                return
-        
-        # Добавляем сообщение в память
-        self.chat_messages[chat_id].append(message)
+        """Добавляет сообщение в память и дописывает его в журнал чатов"""
+        if not chat_log.append(chat_id, message):
+            print(f"DEBUG: Сообщение с ID {message.get('id')} уже существует, пропускаем")
+            return
         print(f"DEBUG: Добавлено сообщение в комнату {chat_id}: {message.get('content')}")
-        
-        # Сохраняем в файл после добавления нового сообщения
-        self.save_messages_to_file()
 
 
 manager = ConnectionManager()
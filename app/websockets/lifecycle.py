@@ -0,0 +1,192 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import WebSocket
+
+from config import settings
+
+
+class ConnectionInfo:
+    __slots__ = ("websocket", "endpoint", "user_id", "connected_at", "last_seen", "send", "on_evict")
+
+    def __init__(self, websocket: WebSocket, endpoint: str, user_id: Optional[str],
+                 send: Optional[Callable[[dict], Any]], on_evict: Optional[Callable[[], None]]):
+        self.websocket = websocket
+        self.endpoint = endpoint
+        self.user_id = user_id
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.send = send
+        self.on_evict = on_evict
+
+
+class ConnectionLifecycle:
+    """
+    Учет всех WebSocket соединений воркера: heartbeat, отключение простаивающих
+    и лимиты на число соединений.
+
+    Раз в heartbeat_interval каждому соединению уходит {"type": "ping"}; клиент
+    отвечает {"type": "pong"}, но живым соединение считает любой входящий кадр
+    (touch). Соединение без входящих кадров дольше idle_timeout считается
+    мертвым (мобильный клиент ушел в фон, полуоткрытый TCP) и закрывается.
+
+    Лимиты:
+    - max_connections - общий бюджет воркера, сверх него новые соединения
+      отклоняются с кодом 1013;
+    - max_per_user - при превышении закрывается самое старое соединение
+      пользователя (обычно это уже мертвый сокет после переподключения).
+    """
+
+    PING_MESSAGE = {"type": "ping"}
+    # Коды закрытия
+    IDLE_CLOSE_CODE = 1001
+    OVER_USER_LIMIT_CLOSE_CODE = 1008
+    OVER_CAPACITY_CLOSE_CODE = 1013
+    CLOSE_TIMEOUT = 5.0
+
+    def __init__(self, heartbeat_interval: float, idle_timeout: float, max_connections: int, max_per_user: int):
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+
+        self.connections: Dict[WebSocket, ConnectionInfo] = {}
+        # пользователь -> его соединения, от старых к новым
+        self.user_connections: Dict[str, List[WebSocket]] = {}
+
+        self.rejected = 0
+        self.evicted_idle = 0
+        self.evicted_over_user_limit = 0
+
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def admit(self, websocket: WebSocket, endpoint: str, user_id=None,
+                    send: Optional[Callable[[dict], Any]] = None,
+                    on_evict: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Регистрирует соединение (до accept). False - лимит воркера исчерпан,
+        соединение уже закрыто. send - как отправлять ping (по умолчанию send_json),
+        on_evict - что сделать при принудительном отключении.
+        """
+        self._ensure_started()
+        if len(self.connections) >= self.max_connections:
+            self.rejected += 1
+            print(f"DEBUG: Лимит WebSocket соединений ({self.max_connections}) исчерпан, {endpoint} отклонен")
+            await websocket.close(code=self.OVER_CAPACITY_CLOSE_CODE)
+            return False
+
+        user_id = str(user_id) if user_id is not None else None
+        if user_id is not None:
+            user_connections = self.user_connections.setdefault(user_id, [])
+            while len(user_connections) >= self.max_per_user:
+                self.evicted_over_user_limit += 1
+                self.evict(user_connections[0], self.OVER_USER_LIMIT_CLOSE_CODE)
+            self.user_connections.setdefault(user_id, []).append(websocket)
+
+        self.connections[websocket] = ConnectionInfo(websocket, endpoint, user_id, send, on_evict)
+        return True
+
+    def touch(self, websocket: WebSocket):
+        """Отмечает входящий кадр от клиента"""
+        info = self.connections.get(websocket)
+        if info:
+            info.last_seen = time.monotonic()
+
+    def release(self, websocket: WebSocket) -> Optional[ConnectionInfo]:
+        info = self.connections.pop(websocket, None)
+        if info and info.user_id is not None:
+            user_connections = self.user_connections.get(info.user_id)
+            if user_connections and websocket in user_connections:
+                user_connections.remove(websocket)
+                if not user_connections:
+                    del self.user_connections[info.user_id]
+        return info
+
+    def evict(self, websocket: WebSocket, code: int):
+        """Принудительно отключает соединение, не дожидаясь его цикла приема"""
+        info = self.release(websocket)
+        if info is None:
+            return
+        if info.on_evict:
+            try:
+                info.on_evict()
+            except Exception as e:
+                print(f"ERROR: Ошибка при отключении WebSocket {info.endpoint}: {e}")
+        asyncio.ensure_future(self._close(websocket, code))
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                print(f"ERROR: Ошибка heartbeat WebSocket: {e}")
+
+    async def heartbeat(self):
+        now = time.monotonic()
+        pings = []
+        for info in list(self.connections.values()):
+            if now - info.last_seen > self.idle_timeout:
+                self.evicted_idle += 1
+                print(f"DEBUG: WebSocket {info.endpoint} простаивает {now - info.last_seen:.0f} сек, отключаем")
+                self.evict(info.websocket, self.IDLE_CLOSE_CODE)
+                continue
+            pings.append(self._ping(info))
+        if pings:
+            await asyncio.gather(*pings)
+
+    async def _ping(self, info: ConnectionInfo):
+        try:
+            if info.send:
+                result = info.send(self.PING_MESSAGE)
+                if inspect.isawaitable(result):
+                    await asyncio.wait_for(result, timeout=self.heartbeat_interval)
+            else:
+                await asyncio.wait_for(info.websocket.send_json(self.PING_MESSAGE), timeout=self.heartbeat_interval)
+        except Exception:
+            # Соединение, в которое не уходит ping, будет отключено по простою
+            pass
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        by_endpoint: Dict[str, int] = {}
+        for info in self.connections.values():
+            by_endpoint[info.endpoint] = by_endpoint.get(info.endpoint, 0) + 1
+        return {
+            "connections": len(self.connections),
+            "max_connections": self.max_connections,
+            "max_per_user": self.max_per_user,
+            "users": len(self.user_connections),
+            "by_endpoint": by_endpoint,
+            "rejected": self.rejected,
+            "evicted_idle": self.evicted_idle,
+            "evicted_over_user_limit": self.evicted_over_user_limit,
+        }
+
+
+connection_lifecycle = ConnectionLifecycle(
+    heartbeat_interval=settings.WS_HEARTBEAT_INTERVAL_SECONDS,
+    idle_timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+    max_connections=settings.WS_MAX_CONNECTIONS,
+    max_per_user=settings.WS_MAX_CONNECTIONS_PER_USER,
+)
@@ -0,0 +1,236 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+
+from app.utils.db_replicas import use_primary
+from config import settings
+
+
+class MessageWriter:
+    """
+    Групповая запись сообщений чата в БД.
+
+    Сообщения со всех сокетов копятся в очереди и раз в FLUSH_INTERVAL
+    (или по набору BATCH_MAX_MESSAGES) записываются одной транзакцией в пуле
+    потоков, не блокируя цикл событий. submit() возвращает сохраненное сообщение
+    только после commit, поэтому подтверждение отправителю идет после записи.
+
+    id чатов для пар пользователей кешируются в памяти (LRU), промахи
+    разрешаются одним запросом на всю пачку.
+
+    Сообщения проверяются в submit() до очереди; если пачка все же не
+    записалась (например, FK на удаленного пользователя), сообщения пишутся
+    по одному и ошибку получает только отправитель проблемного.
+    """
+
+    def __init__(self, flush_interval: float, batch_max_messages: int, chat_cache_size: int):
+        self.flush_interval = flush_interval
+        self.batch_max_messages = batch_max_messages
+        self.chat_cache_size = chat_cache_size
+
+        self._chat_ids: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.messages = 0
+
+    @staticmethod
+    def get_pair(user1_id: int, user2_id: int) -> Tuple[int, int]:
+        return (min(user1_id, user2_id), max(user1_id, user2_id))
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    @staticmethod
+    def validate(message_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Проверяет сообщение до очереди: некорректное не должно ронять запись всей пачки"""
+        try:
+            sender_id = int(message_data["sender_id"])
+            receiver_id = int(message_data["receiver_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("sender_id и receiver_id должны быть целыми числами")
+        content = message_data.get("content")
+        if not isinstance(content, str):
+            raise ValueError("content должен быть строкой")
+        return {**message_data, "sender_id": sender_id, "receiver_id": receiver_id, "content": content}
+
+    async def submit(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Ставит сообщение в очередь на запись и ждет commit его пачки"""
+        message_data = self.validate(message_data)
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message_data, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            # Собираем все, что пришло за flush_interval
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_max_messages:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        try:
+            results = await self._write_batch([data for data, _ in batch])
+        except Exception as e:
+            print(f"ERROR: Ошибка групповой записи {len(batch)} сообщений: {e}")
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # Пачка откатилась целиком - пишем сообщения по одному,
+            # чтобы ошибку получил только отправитель проблемного сообщения
+            for item in batch:
+                await self._flush([item])
+            return
+
+        self.batches += 1
+        self.messages += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        try:
+            return await self._write_batch_once(batch)
+        except IntegrityError:
+            # Чат из кеша мог быть удален - сбрасываем кеш и повторяем один раз
+            self._chat_ids.clear()
+            return await self._write_batch_once(batch)
+
+    async def _write_batch_once(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Async сессия: запись не занимает поток пула, транзакция откатывается при выходе из блока
+        from database import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(self._write_batch_sync, batch)
+
+    def _resolve_chat_ids(self, db, pairs) -> Dict[Tuple[int, int], int]:
+        """id чатов для пар пользователей: из кеша, затем одним запросом, затем создание"""
+        from app.models.chat import AppChatModel
+
+        chat_ids = {pair: self._chat_ids[pair] for pair in pairs if pair in self._chat_ids}
+        missing = [pair for pair in pairs if pair not in chat_ids]
+
+        if missing:
+            conditions = []
+            for user1_id, user2_id in missing:
+                conditions.append(and_(AppChatModel.user1_id == user1_id, AppChatModel.user2_id == user2_id))
+                conditions.append(and_(AppChatModel.user1_id == user2_id, AppChatModel.user2_id == user1_id))
+            rows = (
+                db.query(AppChatModel.id, AppChatModel.user1_id, AppChatModel.user2_id)
+                .filter(or_(*conditions))
+                .order_by(AppChatModel.id)
+                .all()
+            )
+            for chat_id, user1_id, user2_id in rows:
+                # Если по ошибке чатов несколько, берем самый старый, как и раньше .first()
+                chat_ids.setdefault(self.get_pair(user1_id, user2_id), chat_id)
+
+        new_chats = [AppChatModel(user1_id=pair[0], user2_id=pair[1]) for pair in missing if pair not in chat_ids]
+        if new_chats:
+            db.add_all(new_chats)
+            db.flush()
+            for chat in new_chats:
+                chat_ids[(chat.user1_id, chat.user2_id)] = chat.id
+
+        for pair, chat_id in chat_ids.items():
+            self._chat_ids[pair] = chat_id
+            self._chat_ids.move_to_end(pair)
+        while len(self._chat_ids) > self.chat_cache_size:
+            self._chat_ids.popitem(last=False)
+        return chat_ids
+
+    def _write_batch_sync(self, db, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        from app.models.chat import AppChatModel, AppChatMessageModel
+
+        # Поиск чата - только в основной БД: чат, созданный только что, на реплике
+        # может еще отсутствовать, и для пары создался бы второй чат
+        use_primary(db)
+
+        pairs = [self.get_pair(int(data["sender_id"]), int(data["receiver_id"])) for data in batch]
+        chat_ids = self._resolve_chat_ids(db, set(pairs))
+
+        current_time = datetime.now()
+        db_messages = []
+        for data, pair in zip(batch, pairs):
+            db_messages.append(AppChatMessageModel(
+                chat_id=chat_ids[pair],
+                sender_id=int(data["sender_id"]),
+                content=data["content"],
+                is_read=False,
+                created_at=current_time
+            ))
+        db.add_all(db_messages)
+        db.flush()
+
+        # Сводка чатов: один UPDATE на чат для всей пачки
+        by_chat: Dict[int, list] = {}
+        for db_message in db_messages:
+            by_chat.setdefault(db_message.chat_id, []).append(db_message)
+        chats = db.query(AppChatModel).filter(AppChatModel.id.in_(by_chat.keys())).all()
+        for chat in chats:
+            AppChatModel.record_messages(db, chat, by_chat[chat.id])
+
+        db.commit()
+
+        timestamp = current_time.isoformat()
+        return [
+            {
+                "id": db_message.id,
+                "chat_id": db_message.chat_id,
+                "sender_id": db_message.sender_id,
+                "receiver_id": data["receiver_id"],
+                "content": db_message.content,
+                "timestamp": timestamp,
+                "is_read": False
+            }
+            for data, db_message in zip(batch, db_messages)
+        ]
+
+    async def close(self):
+        """Дописывает накопленные сообщения и останавливает писателя"""
+        if self._task and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "messages": self.messages,
+            "cached_chats": len(self._chat_ids),
+        }
+
+
+message_writer = MessageWriter(
+    flush_interval=settings.CHAT_WRITE_FLUSH_INTERVAL_SECONDS,
+    batch_max_messages=settings.CHAT_WRITE_BATCH_MAX_MESSAGES,
+    chat_cache_size=settings.CHAT_WRITE_CHAT_CACHE_SIZE,
+)
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.utils.web_push import send_push_in_new_session
+
+PUSH_ICON = "/static/layout/assets/img/logo_non.png"
+PUSH_PREVIEW_LENGTH = 100
+
+
+class OfflineDelivery:
+    """
+    Доставка сообщений пользователям без открытых соединений.
+
+    Сообщение кладется в офлайн-очередь пользователя в шине (общая для воркеров).
+    Через debounce_seconds после первого сообщения уходит ОДНО push-уведомление
+    на все накопившиеся сообщения, если пользователь так и не подключился.
+    При подключении очередь выдается одним кадром offline_messages.
+    """
+
+    def __init__(self, manager, debounce_seconds: float):
+        self.manager = manager
+        self.debounce_seconds = debounce_seconds
+        # пользователь -> отложенная отправка push
+        self._timers: Dict[str, asyncio.Task] = {}
+        # пользователь -> (число сообщений в очереди, последнее сообщение)
+        self._pending: Dict[str, tuple] = {}
+
+        self.queued = 0
+        self.pushes_sent = 0
+
+    async def enqueue(self, user_id, message: Dict[str, Any]):
+        user_id = str(user_id)
+        count = await self.manager.backplane.push_offline(user_id, message)
+        self.queued += 1
+        self._pending[user_id] = (count, message)
+        if user_id not in self._timers:
+            self._timers[user_id] = asyncio.create_task(self._push_later(user_id))
+
+    async def drain(self, user_id) -> List[Dict[str, Any]]:
+        """Забирает очередь пользователя и отменяет отложенный push"""
+        user_id = str(user_id)
+        self._cancel_timer(user_id)
+        return await self.manager.backplane.pop_offline(user_id)
+
+    def _cancel_timer(self, user_id: str):
+        self._pending.pop(user_id, None)
+        timer = self._timers.pop(user_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+    async def _push_later(self, user_id: str):
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            pending = self._pending.get(user_id)
+            self._timers.pop(user_id, None)
+            self._pending.pop(user_id, None)
+            if not pending:
+                return
+
+            # Пользователь мог подключиться к другому воркеру - тогда push не нужен
+            states = await self.manager.backplane.get_presence([user_id])
+            if states.get(user_id):
+                return
+
+            count, last_frame = pending
+            notification = self.get_notification(count, last_frame)
+            if notification is None:
+                return
+            await run_in_threadpool(send_push_in_new_session, notification, [int(user_id)])
+            self.pushes_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"ERROR: Ошибка отправки push-уведомления пользователю {user_id}: {e}")
+
+    @staticmethod
+    def get_notification(count: int, frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        message = frame.get("message") or {}
+        sender_id = message.get("sender_id")
+        if sender_id is None:
+            return None
+
+        content = str(message.get("content") or "")
+        if len(content) > PUSH_PREVIEW_LENGTH:
+            content = content[:PUSH_PREVIEW_LENGTH - 1] + "…"
+
+        return {
+            "title": "Новое сообщение" if count <= 1 else f"Новых сообщений: {count}",
+            "body": content,
+            "icon": PUSH_ICON,
+            "url": f"/mobile/chat/{sender_id}",
+        }
+
+    async def close(self):
+        for user_id in list(self._timers):
+            self._cancel_timer(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "pending_pushes": len(self._timers),
+            "pushes_sent": self.pushes_sent,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from fastapi import WebSocket
+
+
+class QueuePolicy:
+    """Что делать, если очередь соединения переполнена"""
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+    ALL = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class ConnectionSender:
+    """
+    Ограниченная исходящая очередь одного WebSocket и задача-писатель для нее.
+
+    send() не блокируется: сообщение кладется в очередь, а отправку выполняет
+    отдельная задача, поэтому зависший клиент не задерживает доставку другим
+    соединениям и цикл приема отправителя.
+
+    Политики при переполнении:
+    - drop_oldest - выбрасывается самое старое сообщение;
+    - coalesce - служебные события (набор текста, присутствие, прочтение, ping) с тем же
+      ключом заменяют уже стоящие в очереди, иначе как drop_oldest;
+    - disconnect - медленный клиент отключается.
+    """
+
+    # Типы событий, для которых клиенту важно только последнее состояние
+    COALESCE_TYPES = {"typing", "presence", "read_receipt", "ping"}
+    # Код закрытия для медленного клиента: "Try Again Later"
+    SLOW_CONSUMER_CLOSE_CODE = 1013
+
+    def __init__(self, websocket: WebSocket, max_size: int, policy: str, send_timeout: float,
+                 on_close: Optional[Callable[["ConnectionSender"], None]] = None):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy if policy in QueuePolicy.ALL else QueuePolicy.DROP_OLDEST
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+
+        self.queue: Deque[Tuple[Optional[Hashable], Dict[str, Any]]] = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.closed = False
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    @classmethod
+    def get_coalesce_key(cls, message: Dict[str, Any]) -> Optional[Hashable]:
+        message_type = message.get("type")
+        if message_type not in cls.COALESCE_TYPES:
+            return None
+        return (message_type, message.get("chat_id"), message.get("user_id"))
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        """Ставит сообщение в очередь. Возвращает False, если оно не будет доставлено"""
+        if self.closed:
+            return False
+
+        key = self.get_coalesce_key(message) if self.policy == QueuePolicy.COALESCE else None
+        if key is not None:
+            for index, (queued_key, _) in enumerate(self.queue):
+                if queued_key == key:
+                    self.queue[index] = (key, message)
+                    self.coalesced += 1
+                    return True
+
+        if len(self.queue) >= self.max_size:
+            self.dropped += 1
+            if self.policy == QueuePolicy.DISCONNECT:
+                print(f"DEBUG: Очередь соединения переполнена ({self.max_size}), отключаем медленного клиента")
+                self.close(self.SLOW_CONSUMER_CLOSE_CODE)
+                return False
+            self.queue.popleft()
+
+        self.queue.append((key, message))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        while not self.closed:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, message = self.queue.popleft()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(message), timeout=self.send_timeout)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"DEBUG: Ошибка отправки в WebSocket, соединение закрывается: {e}")
+                self.close(self.SLOW_CONSUMER_CLOSE_CODE)
+
+    def close(self, code: Optional[int] = None):
+        """Останавливает писателя; с code дополнительно закрывает сокет"""
+        if self.closed:
+            return
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        self._wakeup.set()
+        if code is not None:
+            asyncio.ensure_future(self._close_websocket(code))
+        if self.on_close:
+            self.on_close(self)
+
+    async def _close_websocket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,131 @@
+"""
+Накладные расходы middleware авторизации на один запрос.
+
+Сравнивает приложение без middleware, прежний AuthenticationMiddleware на
+BaseHTTPMiddleware со списком префиксов и текущий ASGI middleware с деревом
+правил. Запросы подаются напрямую в ASGI приложение (без сети и HTTP клиента),
+поэтому разница во времени - это стоимость самого middleware.
+
+Запуск из корня проекта:
+    python -m benchmarks.auth_middleware --requests 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+from datetime import timedelta
+
+from fastapi.responses import PlainTextResponse, RedirectResponse
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import Route
+
+from app.api import deps
+from app.api.auth_middleware import AuthenticationMiddleware
+from app.utils.security import create_access_token
+
+
+class LegacyAuthenticationMiddleware(BaseHTTPMiddleware):
+    """Прежняя реализация (до перехода на ASGI), только для сравнения"""
+
+    public_paths = [
+        '/mobile/auth', '/mobile/register', '/mobile/register/verify', '/mobile/register/profile',
+        '/mobile/reset', '/mobile/reset/verify', '/mobile/reset/password',
+        '/api/v1/auth/login', '/api/v1/auth/check-exists', '/api/v1/auth/send-code',
+        '/api/v1/auth/verify-code', '/api/v1/auth/register', '/api/v1/auth/reset-password',
+        '/api/v1/telegram/initiate', '/api/v1/telegram/verify-phone', '/api/v1/telegram/verify-code',
+        '/api/v1/telegram/status', '/api/v1/telegram/force-reset', '/favicon.ico',
+        '/mobile/test-websocket', '/mobile/ws/', '/api/v1/chat/',
+        '/admin/login', '/superadmin/login', '/companies/login',
+    ]
+
+    async def dispatch(self, request, call_next):
+        if request.url.path.startswith('/static/'):
+            return await call_next(request)
+        if request.url.path.startswith('/api/'):
+            return await call_next(request)
+        if any(request.url.path.startswith(path) for path in self.public_paths) or '/api/v1/chat/' in request.url.path:
+            return await call_next(request)
+
+        print(f"DEBUG: Checking auth for path: {request.url.path}")
+        print(f"DEBUG: Cookie token: {request.cookies.get('access_token')}")
+        print(f"DEBUG: Auth header: {request.headers.get('Authorization')}")
+        principal = deps.get_request_principal(request)
+        print(f"DEBUG: Token payload: {principal.payload if principal else None}")
+        if principal is None:
+            return RedirectResponse('/mobile/auth', status_code=303)
+        return await call_next(request)
+
+
+async def endpoint(request):
+    return PlainTextResponse("ok")
+
+
+def build_app(middleware=None):
+    app = Starlette(routes=[Route("/{path:path}", endpoint)])
+    return middleware(app) if middleware else app
+
+
+def make_scope(path: str, token: str = None):
+    headers = [(b"host", b"bench")]
+    if token:
+        headers.append((b"cookie", f"access_token={token}".encode()))
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "headers": headers, "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+
+async def run_requests(app, scope, count: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await app(dict(scope, state={}), receive, send)
+    return time.perf_counter() - started
+
+
+async def main_async(count: int):
+    token = create_access_token(1, expires_delta=timedelta(hours=1))
+    cases = [
+        ("static", make_scope("/static/layout/assets/css/style.css")),
+        ("api", make_scope("/api/v1/properties/")),
+        ("public page", make_scope("/mobile/auth")),
+        ("protected page", make_scope("/mobile/profile", token)),
+    ]
+    apps = [
+        ("bare", build_app()),
+        ("BaseHTTPMiddleware", build_app(LegacyAuthenticationMiddleware)),
+        ("ASGI + trie", build_app(AuthenticationMiddleware)),
+    ]
+
+    print(f"{'case':<16}" + "".join(f"{name:>22}" for name, _ in apps))
+    for case, scope in cases:
+        timings = []
+        for _, app in apps:
+            # Прогрев и подавление DEBUG вывода прежней реализации
+            with contextlib.redirect_stdout(io.StringIO()):
+                await run_requests(app, scope, min(count, 500))
+                timings.append(await run_requests(app, scope, count) / count * 1e6)
+        bare = timings[0]
+        row = f"{case:<16}{bare:>19.1f} us"
+        for value in timings[1:]:
+            row += f"{value:>10.1f} us ({value - bare:+6.1f})"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость middleware авторизации на запрос")
+    parser.add_argument("--requests", type=int, default=20000, help="Число запросов на каждый случай")
+    args = parser.parse_args()
+    asyncio.run(main_async(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,17 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str
+    # Async движок (aiomysql / aiosqlite); пусто - выводится из DATABASE_URL
+    DATABASE_ASYNC_URL: Optional[str] = None
+    # Соединения с БД на все воркеры: делятся поровну между WEB_CONCURRENCY воркерами,
+    # доля воркера - пополам между синхронным движком (пул потоков) и async движком
+    DB_MAX_CONNECTIONS: int = 100
+    WEB_CONCURRENCY: int = 1
+    # Реплики только для чтения (через запятую); пусто - все запросы в DATABASE_URL
+    DATABASE_REPLICA_URLS: Union[List[str], str] = []
+    # Реплика с большим отставанием выводится из ротации; столько же клиент после записи читает из основной БД
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_CHECK_SECONDS: float = 5.0
     
     # JWT Auth
     SECRET_KEY: str
@@ -25,6 +36,10 @@ class Settings(BaseSettings):
     
     # Media
     MEDIA_DIR: str = "media"
+    # On-demand ресайз (/media/r/{w}x{h}/{path}) и его дисковый LRU-кеш
+    MEDIA_RESIZE_WIDTHS: List[int] = [150, 300, 400, 800, 1200, 1920]
+    MEDIA_RESIZE_CACHE_DIR: str = "cache/resized"
+    MEDIA_RESIZE_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
     
     # CORS
     BACKEND_CORS_ORIGINS: Union[List[str], str] = ["*"]
@@ -41,7 +56,14 @@ class Settings(BaseSettings):
     # Devino SMS Settings
     DEVINO_API_URL: str = "https://phoneverification.devinotele.com"
     DEVINO_API_KEY: Optional[str] = None  # Получается из переменной окружения DEVINO_API_KEY
-    DEVINO_TIMEOUT: int = 30
+    DEVINO_TIMEOUT: int = 10
+    
+    # Исходящие HTTP запросы к провайдерам: таймауты и автомат (после N ошибок подряд
+    # запросы к провайдеру сразу отклоняются на HTTP_BREAKER_RECOVERY_SECONDS)
+    HTTP_TELEGRAM_TIMEOUT_SECONDS: float = 10.0
+    HTTP_FX_TIMEOUT_SECONDS: float = 5.0
+    HTTP_BREAKER_FAILURE_THRESHOLD: int = 5
+    HTTP_BREAKER_RECOVERY_SECONDS: float = 30.0
     
     # SMS Debug Settings
     DEBUG_SMS: bool = True
@@ -52,6 +74,75 @@ class Settings(BaseSettings):
     TELEGRAM_BOT_TOKEN: Optional[str] = None
     TELEGRAM_BOT_USERNAME: Optional[str] = None
     TELEGRAM_CODE_EXPIRY_MINUTES: int = 5
+    # Где работает бот: "process" - отдельный процесс, который запускает и перезапускает
+    # один из веб-воркеров; "external" - процесс запускается снаружи (python telegram_bot.py);
+    # "embedded" - внутри веб-процесса (только для разработки с одним воркером); "off"
+    TELEGRAM_BOT_MODE: str = "process"
+    # Unix сокет процесса бота: через него веб-воркеры работают с кодами, если AUTH_CODE_STORE_URL пуст
+    TELEGRAM_BOT_IPC_PATH: str = "/tmp/wazir-telegram-bot.sock"
+    TELEGRAM_BOT_IPC_TIMEOUT_SECONDS: float = 2.0
+    # Выставляется самим процессом бота (telegram_bot.py), вручную не задается
+    TELEGRAM_BOT_PROCESS: bool = False
+    # Очередь исходящих сообщений бота: сообщений в секунду всего и в один чат (с запасом
+    # от лимитов Bot API 30/с и 1/с), размер очереди, попытки и сколько секунд сообщение актуально
+    TELEGRAM_OUTBOX_GLOBAL_RATE: float = 25.0
+    TELEGRAM_OUTBOX_CHAT_RATE: float = 1.0
+    TELEGRAM_OUTBOX_CHAT_BURST: int = 3
+    TELEGRAM_OUTBOX_QUEUE_SIZE: int = 5000
+    TELEGRAM_OUTBOX_MAX_ATTEMPTS: int = 5
+    TELEGRAM_OUTBOX_MAX_AGE_SECONDS: float = 300.0
+    # Хранилище кодов подтверждения и сессий авторизации: redis://host:6379/0, пусто - в памяти процесса
+    AUTH_CODE_STORE_URL: Optional[str] = None
+    AUTH_CODE_STORE_PREFIX: str = "auth:"
+    # Пароли: стоимость bcrypt (хеши с другой стоимостью пересчитываются при входе),
+    # потоки для хеширования, сколько проверок может ждать очереди и сколько секунд
+    AUTH_BCRYPT_ROUNDS: int = 12
+    AUTH_HASH_WORKERS: int = 2
+    AUTH_HASH_QUEUE_SIZE: int = 32
+    AUTH_HASH_QUEUE_TIMEOUT_SECONDS: float = 5.0
+    # Ограничение частоты отправки кодов и входа: redis://host:6379/0 - общие счетчики
+    # для всех воркеров, пусто - в памяти процесса (не больше RATE_LIMIT_MAX_KEYS ключей)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_STORE_URL: Optional[str] = None
+    RATE_LIMIT_KEY_PREFIX: str = "ratelimit:"
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    # Кеш пользователей для проверки авторизации: сколько секунд строка считается свежей и сколько строк держать
+    AUTH_USER_CACHE_TTL_SECONDS: float = 30.0
+    AUTH_USER_CACHE_SIZE: int = 1024
+    
+    # WebSocket: интервал ping, отключение без входящих кадров, лимиты соединений воркера
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = 25.0
+    WS_IDLE_TIMEOUT_SECONDS: float = 75.0
+    WS_MAX_CONNECTIONS: int = 10000
+    WS_MAX_CONNECTIONS_PER_USER: int = 5
+    
+    # Chat Settings
+    # Шина WebSocket между воркерами: redis://host:6379/0, пусто - один процесс
+    CHAT_BACKPLANE_URL: Optional[str] = None
+    CHAT_BACKPLANE_CHANNEL_PREFIX: str = "chat:user:"
+    CHAT_PRESENCE_CHANNEL_PREFIX: str = "chat:presence:"
+    CHAT_PRESENCE_KEY: str = "chat:presence"
+    # Присутствие в Redis - своя запись у каждого воркера, продлевается раз в треть TTL;
+    # записи упавшего воркера истекают через CHAT_PRESENCE_TTL_SECONDS
+    CHAT_PRESENCE_TTL_SECONDS: int = 60
+    # Сколько собеседников одно соединение может отслеживать (presence_subscribe)
+    CHAT_PRESENCE_WATCH_MAX: int = 200
+    # Период отправки накопленных событий (набор текста, присутствие, прочтение)
+    CHAT_EVENT_TICK_SECONDS: float = 0.25
+    # Офлайн-очередь сообщений: размер, время жизни, задержка перед одним общим push
+    CHAT_OFFLINE_KEY_PREFIX: str = "chat:offline:"
+    CHAT_OFFLINE_QUEUE_MAX: int = 100
+    CHAT_OFFLINE_QUEUE_TTL_SECONDS: int = 7 * 24 * 3600
+    CHAT_OFFLINE_PUSH_DEBOUNCE_SECONDS: float = 10.0
+    # Исходящая очередь каждого WebSocket: размер, политика при переполнении
+    # (drop_oldest, coalesce, disconnect) и таймаут одной отправки
+    CHAT_SEND_QUEUE_SIZE: int = 100
+    CHAT_SEND_QUEUE_POLICY: str = "coalesce"
+    CHAT_SEND_TIMEOUT_SECONDS: float = 10.0
+    # Групповая запись сообщений чата в БД: интервал, размер пачки, кеш id чатов
+    CHAT_WRITE_FLUSH_INTERVAL_SECONDS: float = 0.005
+    CHAT_WRITE_BATCH_MAX_MESSAGES: int = 500
+    CHAT_WRITE_CHAT_CACHE_SIZE: int = 10000
     
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
@@ -61,6 +152,14 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
 
+    @validator("DATABASE_REPLICA_URLS", pre=True)
+    def assemble_replica_urls(cls, v: Union[str, List[str]]) -> List[str]:
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        elif isinstance(v, (list, str)):
+            return v
+        raise ValueError(v)
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
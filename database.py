@@ -1,29 +1,113 @@
+from typing import Tuple
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
+from app.utils.db_replicas import Replica, ReplicaRouter, RoutingSession
 
 # Создаем URL подключения к базе данных
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
 print(f"DEBUG: Подключаемся к БД: {SQLALCHEMY_DATABASE_URL}")
 
-# Создаем движок SQLAlchemy с параметрами для MySQL
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,  # Проверяем соединения перед использованием
-    pool_recycle=300,    # Переиспользуем соединения каждые 5 минут
-    pool_timeout=30,     # Таймаут ожидания соединения из пула
-    connect_args={
-        "connect_timeout": 10,  # Таймаут подключения к MySQL
-        "read_timeout": 60,     # Увеличиваем таймаут чтения до 60 сек
-        "write_timeout": 60,    # Увеличиваем таймаут записи до 60 сек
-        "autocommit": True,     # Автокоммит для избежания блокировок
-    }
+# Async драйверы для синхронных адресов из DATABASE_URL
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def get_pool_limits() -> Tuple[int, int]:
+    """
+    (pool_size, max_overflow) одного движка воркера: DB_MAX_CONNECTIONS делится
+    между воркерами (WEB_CONCURRENCY), доля воркера - между синхронным и async движком
+    """
+    per_engine = max(2, settings.DB_MAX_CONNECTIONS // max(1, settings.WEB_CONCURRENCY) // 2)
+    pool_size = max(1, per_engine // 2)
+    return pool_size, per_engine - pool_size
+
+
+def get_async_database_url(url: str) -> str:
+    """mysql+pymysql://... -> mysql+aiomysql://..., sqlite:///... -> sqlite+aiosqlite:///..."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Нет async драйвера для {url.get_backend_name()}, задайте DATABASE_ASYNC_URL")
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+POOL_SIZE, MAX_OVERFLOW = get_pool_limits()
+
+
+def create_sync_engine(url: str):
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_engine(url)
+    # Создаем движок SQLAlchemy с параметрами для MySQL
+    return create_engine(
+        url,
+        pool_pre_ping=True,  # Проверяем соединения перед использованием
+        pool_recycle=300,    # Переиспользуем соединения каждые 5 минут
+        pool_timeout=30,     # Таймаут ожидания соединения из пула
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        connect_args={
+            "connect_timeout": 10,  # Таймаут подключения к MySQL
+            "read_timeout": 60,     # Увеличиваем таймаут чтения до 60 сек
+            "write_timeout": 60,    # Увеличиваем таймаут записи до 60 сек
+            "autocommit": True,     # Автокоммит для избежания блокировок
+        }
+    )
+
+
+def create_async_db_engine(url: str):
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_timeout=30,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        connect_args={
+            "connect_timeout": 10,
+            "autocommit": True,
+        }
+    )
+
+
+engine = create_sync_engine(SQLALCHEMY_DATABASE_URL)
+
+# Async движок для async def обработчиков: запросы не блокируют event loop
+SQLALCHEMY_ASYNC_DATABASE_URL = settings.DATABASE_ASYNC_URL or get_async_database_url(SQLALCHEMY_DATABASE_URL)
+async_engine = create_async_db_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+
+# Реплики для чтения: у каждой свой сервер, поэтому лимиты пула те же, что у основной БД
+replica_router = ReplicaRouter(
+    [
+        Replica(
+            make_url(url).render_as_string(hide_password=True),
+            create_sync_engine(url),
+            create_async_db_engine(get_async_database_url(url)),
+        )
+        for url in settings.DATABASE_REPLICA_URLS
+    ],
+    max_lag=settings.DB_REPLICA_MAX_LAG_SECONDS,
+    check_seconds=settings.DB_REPLICA_CHECK_SECONDS,
 )
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Создаем фабрику сессий: без реплик RoutingSession работает как обычная Session
+SessionLocal = sessionmaker(class_=RoutingSession, router=replica_router, autocommit=False, autoflush=False, bind=engine)
+
+# Объекты остаются доступными после commit: в async сессии ленивой перезагрузки нет
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, sync_session_class=RoutingSession, router=replica_router, async_mode=True,
+    autoflush=False, expire_on_commit=False,
+)
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
@@ -34,4 +118,10 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+# Dependency для async обработчиков
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -17,26 +17,31 @@ from pathlib import Path
 import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Depends, Form, status, HTTPException, Query, WebSocket, WebSocketDisconnect, Response, UploadFile, File, APIRouter
+from fastapi import FastAPI, Request, Depends, Form, status, HTTPException, Query, WebSocket, WebSocketDisconnect, Response, UploadFile, File, APIRouter, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, or_, and_, asc, text
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, desc, or_, and_, asc, text, select, update
 from sqlalchemy.types import String
 
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from jose import jwt as pyjwt
 
 from config import settings
 from api.v1.api import api_router
+from api.v1.endpoints import media_resize
 from app.api import deps
-from app.utils.security import verify_password
+from app.api.auth_middleware import AuthenticationMiddleware
+from app.utils.password_hasher import password_hasher, PasswordHasherBusy
+from app.utils.http_clients import http_clients
+from app.utils.db_replicas import ReadYourWritesMiddleware, use_primary
+from database import async_engine, replica_router
 from app import models
 from app.models.user import User
 from app.models.token import TokenPayload
@@ -44,7 +49,9 @@ from app.models.chat import AppChatModel, AppChatMessageModel
 from app.models.chat_message import ChatMessage
 from app.models.property import PropertyImage
 from app.websockets.chat_manager import ConnectionManager as WebSocketManager
-from app.utils.image_helper import get_valid_image_url
+from app.websockets.chat_log import chat_log
+from app.utils.image_helper import get_valid_image_url, CARD_IMAGE_WIDTH
+from app.utils.panorama_tiler import panorama_tiler, mark_multires_pending
 from app.models.property import PropertyCategory
 from app.models.service import ServiceCategory, ServiceCard, ServiceCardImage
 
@@ -156,48 +163,93 @@ async def lifespan(app: FastAPI):
     # else:
     #     print("Telegram бот не запущен (не настроен или недоступен)")
     
-    # 🔥 ПРИНУДИТЕЛЬНЫЙ ЗАПУСК ПРОСТОГО БОТА 🔥
-    print("🚀 Принудительный запуск простого Telegram бота...")
-    try:
-        # Проверяем настройки
-        if not settings.TELEGRAM_BOT_TOKEN:
-            print("❌ TELEGRAM_BOT_TOKEN не настроен!")
-        elif not settings.TELEGRAM_BOT_USERNAME:
-            print("❌ TELEGRAM_BOT_USERNAME не настроен!")
-        else:
-            print(f"✅ Настройки найдены: @{settings.TELEGRAM_BOT_USERNAME}")
+    # Telegram бот работает отдельным процессом (один поллер на все воркеры);
+    # процесс запускает и перезапускает воркер, получивший блокировку
+    if settings.TELEGRAM_BOT_MODE == "process":
+        from app.services.telegram_bot_supervisor import bot_supervisor
+        await bot_supervisor.start()
+    elif settings.TELEGRAM_BOT_MODE == "embedded":
+        print("🚀 Запуск Telegram бота внутри веб-процесса...")
+        try:
+            # Проверяем настройки
+            if not settings.TELEGRAM_BOT_TOKEN:
+                print("❌ TELEGRAM_BOT_TOKEN не настроен!")
+            elif not settings.TELEGRAM_BOT_USERNAME:
+                print("❌ TELEGRAM_BOT_USERNAME не настроен!")
+            else:
+                print(f"✅ Настройки найдены: @{settings.TELEGRAM_BOT_USERNAME}")
             
-            # Импортируем бота принудительно
-            try:
-                from telegram_bot import sms_bot
-                print("✅ telegram_bot импортирован успешно")
+                # Импортируем бота принудительно
+                try:
+                    from telegram_bot import sms_bot
+                    print("✅ telegram_bot импортирован успешно")
                 
-                # Запускаем бота в отдельной задаче БЕЗ ОЖИДАНИЯ
-                asyncio.create_task(sms_bot.start_bot())
-                print("✅ Задача запуска бота создана")
+                    # Запускаем бота в отдельной задаче БЕЗ ОЖИДАНИЯ
+                    asyncio.create_task(sms_bot.start_bot())
+                    print("✅ Задача запуска бота создана")
                 
-                # Даем боту время запуститься
-                await asyncio.sleep(1)
+                    # Даем боту время запуститься
+                    await asyncio.sleep(1)
                 
-            except ImportError as e:
-                print(f"❌ Ошибка импорта telegram_bot: {e}")
-            except Exception as e:
-                print(f"❌ Ошибка запуска бота: {e}")
-                import traceback
-                print(f"❌ Traceback: {traceback.format_exc()}")
-    except Exception as e:
-        print(f"❌ Критическая ошибка при запуске бота: {e}")
+                except ImportError as e:
+                    print(f"❌ Ошибка импорта telegram_bot: {e}")
+                except Exception as e:
+                    print(f"❌ Ошибка запуска бота: {e}")
+                    import traceback
+                    print(f"❌ Traceback: {traceback.format_exc()}")
+        except Exception as e:
+            print(f"❌ Критическая ошибка при запуске бота: {e}")
+    else:
+        print(f"🤖 Telegram бот не запускается веб-процессом (TELEGRAM_BOT_MODE={settings.TELEGRAM_BOT_MODE})")
+    
+    # Журнал сообщений чатов: перенос chat_messages.json, загрузка и поток записи
+    chat_log.start()
+    
+    # Фоновая проверка отставания реплик БД (без DATABASE_REPLICA_URLS ничего не делает)
+    await replica_router.start()
+    
+    # Шина чата и тики событий (прочтение из HTTP эндпоинтов) - без ожидания первого WebSocket
+    from app.websockets.chat_manager import manager as chat_manager
+    await chat_manager.start_backplane()
     
     print("🚀 Приложение запущено")
     yield
     
-    # Останавливаем простой бот
-    print("🛑 Остановка простого Telegram бота...")
+    # Останавливаем Telegram бот
+    print("🛑 Остановка Telegram бота...")
+    try:
+        if settings.TELEGRAM_BOT_MODE == "process":
+            from app.services.telegram_bot_supervisor import bot_supervisor
+            await bot_supervisor.close()
+        elif settings.TELEGRAM_BOT_MODE == "embedded":
+            from telegram_bot import sms_bot
+            await sms_bot.stop_bot()
+    except Exception as e:
+        print(f"❌ Ошибка остановки бота: {e}")
+    
+    # Дописываем накопленные сообщения чата и закрываем шину рассылки между воркерами
     try:
-        from telegram_bot import sms_bot
-        await sms_bot.stop_bot()
+        from app.websockets.chat_manager import manager as chat_manager
+        from app.websockets.message_writer import message_writer
+        from app.websockets.lifecycle import connection_lifecycle
+        await connection_lifecycle.close()
+        await message_writer.close()
+        await chat_manager.close_backplane()
     except Exception as e:
-        print(f"❌ Ошибка остановки простого бота: {e}")
+        print(f"❌ Ошибка остановки шины чата: {e}")
+    chat_log.close()
+    
+    from app.utils.password_hasher import password_hasher
+    from app.utils.rate_limit import rate_limit_backend
+    from app.utils.http_clients import http_clients
+    from app.services.telegram_outbox import telegram_outbox
+    password_hasher.close()
+    await rate_limit_backend.close()
+    await telegram_outbox.close()
+    await http_clients.close()
+    # Пул async движка закрываем после писателя сообщений - он пишет через него
+    await async_engine.dispose()
+    await replica_router.close()
     
     print("🛑 Приложение завершено")
 
@@ -208,132 +260,6 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = pyjwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-# Класс для аутентификации HTTP запросов (но не WebSocket)
-class AuthenticationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Проверяем, является ли запрос WebSocket
-        if request.scope.get("type") == "websocket":
-            # Для WebSocket запросов пропускаем проверку
-            return await call_next(request)
-        
-        # Пути, доступные без авторизации
-        public_paths = [
-            '/mobile/auth',
-            '/mobile/register',
-            '/mobile/register/verify',
-            '/mobile/register/profile',
-            '/mobile/reset',
-            '/mobile/reset/verify',
-            '/mobile/reset/password',
-            '/api/v1/auth/login',
-            '/api/v1/auth/check-exists',
-            '/api/v1/auth/send-code',
-            '/api/v1/auth/verify-code',
-            '/api/v1/auth/register',
-            '/api/v1/auth/reset-password',
-            '/api/v1/telegram/initiate',
-            '/api/v1/telegram/verify-phone',
-            '/api/v1/telegram/verify-code',
-            '/api/v1/telegram/status',
-            '/api/v1/telegram/force-reset',
-            '/favicon.ico',
-            '/mobile/test-websocket',
-            '/mobile/ws/',
-            '/api/v1/chat/',  # Chat API general path
-            '/admin/login',   # Admin login page
-            '/superadmin/login',  # SuperAdmin login page
-            '/companies/login',   # Company login page
-        ]
-        
-        # Для статических файлов разрешаем доступ
-        if request.url.path.startswith('/static/'):
-            return await call_next(request)
-            
-        # Для API запросов - НЕ ПРОВЕРЯЕМ ТОКЕН В MIDDLEWARE
-        # Пусть каждый API эндпоинт сам проверяет токен через deps.get_current_active_user
-        if request.url.path.startswith('/api/'):
-            # Разрешаем доступ к эндпоинтам авторизации без токена
-            if any(request.url.path.endswith(path) for path in [
-                '/login',
-                '/register',
-                '/check-exists',
-                '/send-code',
-                '/verify-code',
-                '/reset-password'
-            ]):
-                return await call_next(request)
-                
-            # ДЛЯ ВСЕХ ОСТАЛЬНЫХ API ЭНДПОИНТОВ - ПРОСТО ПРОПУСКАЕМ
-            # Аутентификация будет происходить через deps.get_current_active_user
-            return await call_next(request)
-            
-        if any(request.url.path.startswith(path) for path in public_paths) or '/api/v1/chat/' in request.url.path:
-            return await call_next(request)
-            
-        auth_token = request.cookies.get('access_token')
-        auth_header = request.headers.get('Authorization')
-        
-        print(f"DEBUG: Checking auth for path: {request.url.path}")
-        print(f"DEBUG: Cookie token: {auth_token}")
-        print(f"DEBUG: Auth header: {auth_header}")
-        
-        if auth_header and auth_header.startswith('Bearer '):
-            auth_token = auth_header.split(' ')[1]
-            print(f"DEBUG: Using token from header: {auth_token}")
-        
-        if not auth_token:
-            print("DEBUG: No token found")
-            if request.url.path.startswith('/admin/'):
-                return RedirectResponse('/admin/login', status_code=303)
-            elif request.url.path.startswith('/superadmin/'):
-                return RedirectResponse('/superadmin/login', status_code=303)
-            elif request.url.path.startswith('/companies/'):
-                return RedirectResponse('/companies/login', status_code=303)
-            # Для остальных маршрутов перенаправляем на страницу авторизации
-            return RedirectResponse('/mobile/auth', status_code=303)
-            
-        # Проверяем валидность токена
-        try:
-            payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            print(f"DEBUG: Token payload: {payload}")
-            if datetime.fromtimestamp(payload["exp"]) < datetime.utcnow():
-                print("DEBUG: Token expired")
-                if request.url.path.startswith('/admin/'):
-                    return RedirectResponse('/admin/login', status_code=303)
-                elif request.url.path.startswith('/superadmin/'):
-                    return RedirectResponse('/superadmin/login', status_code=303)
-                elif request.url.path.startswith('/companies/'):
-                    return RedirectResponse('/companies/login', status_code=303)
-                return RedirectResponse('/mobile/auth', status_code=303)
-                
-            # Для суперадмин-маршрутов проверяем, что пользователь является суперадминистратором
-            if request.url.path.startswith('/superadmin/') and not payload.get("is_superadmin"):
-                print("DEBUG: Non-superadmin user trying to access superadmin area")
-                return RedirectResponse('/superadmin/login', status_code=303)
-                
-            # Для админ-маршрутов проверяем, что пользователь является администратором
-            if request.url.path.startswith('/admin/') and not payload.get("is_admin"):
-                print("DEBUG: Non-admin user trying to access admin area")
-                return RedirectResponse('/admin/login', status_code=303)
-                
-            # Для маршрутов компаний проверяем, что пользователь является компанией
-            if request.url.path.startswith('/companies/') and not payload.get("is_company"):
-                print("DEBUG: Non-company user trying to access company area")
-                return RedirectResponse('/companies/login', status_code=303)
-                
-        except Exception as e:
-            print(f"DEBUG: Token validation error (cookie): {str(e)}")
-            if request.url.path.startswith('/admin/'):
-                return RedirectResponse('/admin/login', status_code=303)
-            elif request.url.path.startswith('/superadmin/'):
-                return RedirectResponse('/superadmin/login', status_code=303)
-            elif request.url.path.startswith('/companies/'):
-                return RedirectResponse('/companies/login', status_code=303)
-            return RedirectResponse('/mobile/auth', status_code=303)
-            
-        # Если токен валиден, пропускаем запрос дальше
-        return await call_next(request)
-
 # Кастомный JSON-энкодер для обработки datetime и других неподдерживаемых типов
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -347,6 +273,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Ресайз по запросу регистрируем до монтирования /media, иначе его перехватит StaticFiles
+app.include_router(media_resize.router)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/media", StaticFiles(directory="media"), name="media")
 
@@ -381,41 +310,15 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 # Добавляем мидлвар для проверки авторизации
 app.add_middleware(AuthenticationMiddleware)
 
+# После записи клиент какое-то время читает из основной БД, а не с реплик
+app.add_middleware(ReadYourWritesMiddleware, router=replica_router)
+
 # WebSocket Manager class
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.chat_messages: Dict[str, List[dict]] = {}
-        # Загружаем сохраненные сообщения, если файл существует
-        try:
-            if os.path.exists("chat_messages.json"):
-                with open("chat_messages.json", "r", encoding="utf-8") as f:
-                    data = f.read()
-                    if data.strip():  # проверяем, что файл не пустой
-                        self.chat_messages = json.loads(data)
-                        print(f"DEBUG: Загружены сохраненные сообщения чатов. Доступные комнаты: {list(self.chat_messages.keys())}")
-                        for room, messages in self.chat_messages.items():
-                            print(f"DEBUG: Комната {room}: {len(messages)} сообщений")
-                            # Выводим первое и последнее сообщение для отладки
-                            if messages:
-                                print(f"DEBUG: Первое сообщение: {messages[0].get('content', 'Нет контента')}")
-                                print(f"DEBUG: Последнее сообщение: {messages[-1].get('content', 'Нет контента')}")
-                    else:
-                        print("DEBUG: Файл с сообщениями пуст, создаем новый")
-                        with open("chat_messages.json", "w", encoding="utf-8") as f:
-                            json.dump({}, f, ensure_ascii=False, indent=2)
-            else:
-                print("DEBUG: Файл с сообщениями не найден, создаем новый")
-                with open("chat_messages.json", "w", encoding="utf-8") as f:
-                    json.dump({}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"DEBUG: Ошибка при загрузке сообщений: {e}")
-            # Создаем пустой файл в случае ошибки
-            try:
-                with open("chat_messages.json", "w", encoding="utf-8") as f:
-                    json.dump({}, f, ensure_ascii=False, indent=2)
-            except Exception as e2:
-                print(f"DEBUG: Не удалось создать пустой файл: {e2}")
+        # Сообщения в памяти общие с журналом чатов (загружаются из сегментов при старте)
+        self.chat_messages: Dict[str, List[dict]] = chat_log.rooms
 
     async def connect(self, websocket: WebSocket, room: str, accept_connection: bool = True):
         if accept_connection:
@@ -443,25 +346,13 @@ class ConnectionManager:
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         await websocket.send_json(message)
 
-    # Метод для сохранения сообщений в файл
+    # Метод для ожидания записи журнала чатов на диск
     def save_messages_to_file(self):
-        try:
-            with open("chat_messages.json", "w", encoding="utf-8") as f:
-                json.dump(self.chat_messages, f, ensure_ascii=False, indent=2)
-            print(f"DEBUG: Сообщения сохранены в файл. Всего комнат: {len(self.chat_messages)}")
-        except Exception as e:
-            print(f"ERROR: Ошибка при сохранении сообщений в файл: {e}")
+        chat_log.flush()
     
-    # Метод для добавления сообщения в память и сохранения в файл
+    # Метод для добавления сообщения в память и журнал чатов
     def add_message_to_memory(self, chat_id: str, message: dict):
-        if chat_id not in self.chat_messages:
-            self.chat_messages[chat_id] = []
-        
-        # Добавляем сообщение в память
-        self.chat_messages[chat_id].append(message)
-        
-        # Сохраняем в файл после добавления нового сообщения
-        self.save_messages_to_file()
+        chat_log.append(chat_id, message)
     
     async def broadcast(self, message: dict, room: str, exclude=None):
         # Если это сообщение чата, сохраняем его в памяти
@@ -476,29 +367,12 @@ class ConnectionManager:
                     await connection.send_json(message)
 
     def save_message(self, room: str, message: dict):
-        if room not in self.chat_messages:
-            self.chat_messages[room] = []
-        self.chat_messages[room].append(message)
-        # Сохраняем сообщения в файл для персистентности
-        try:
-            # Преобразуем datetime в строку для сериализации
-            serializable_messages = {}
-            for room_key, messages in self.chat_messages.items():
-                serializable_messages[room_key] = []
-                for msg in messages:
-                    # Копируем сообщение и обрабатываем timestamp, если нужно
-                    if isinstance(msg, dict):
-                        serializable_messages[room_key].append(msg)
-                    else:
-                        # Если сообщение не словарь, преобразуем его в строку
-                        serializable_messages[room_key].append(str(msg))
-            
-            with open("chat_messages.json", "w", encoding="utf-8") as f:
-                json.dump(serializable_messages, f, ensure_ascii=False, indent=2)
-                
-            print(f"DEBUG: Сохранено сообщение в комнату {room}, всего сообщений: {len(self.chat_messages[room])}")
-        except Exception as e:
-            print(f"DEBUG: Ошибка при сохранении сообщений: {e}")
+        # Дописываем одну строку в журнал вместо перезаписи всего файла.
+        # id здесь случайные и могут совпасть, поэтому без дедупликации
+        if not isinstance(message, dict):
+            message = {"content": str(message)}
+        chat_log.append(room, message, deduplicate=False)
+        print(f"DEBUG: Сохранено сообщение в комнату {room}, всего сообщений: {len(self.chat_messages[room])}")
 
     def get_messages(self, room: str) -> List[dict]:
         """Получить все сообщения для указанной комнаты"""
@@ -542,6 +416,7 @@ manager = ConnectionManager()
 from sqlalchemy.orm import Session
 from app.api import deps
 from app.websockets.chat_manager import manager as chat_manager
+from app.websockets.lifecycle import connection_lifecycle
 from jose import jwt as pyjwt
 
 @app.websocket("/mobile/ws/chat/{token}")
@@ -556,28 +431,41 @@ async def chat_websocket_endpoint(websocket: WebSocket, token: str):
         print(f"WebSocket auth error: {e}")
         await websocket.close(code=1008)
         return
+    
+    admitted = await connection_lifecycle.admit(
+        websocket, "chat", user_id,
+        send=lambda message: chat_manager.send_personal_message(message, websocket),
+        on_evict=lambda: chat_manager.disconnect(websocket, user_id),
+    )
+    if not admitted:
+        return
         
     await chat_manager.connect(websocket, user_id)
     
     try:
         while True:
             data = await websocket.receive_json()
+            connection_lifecycle.touch(websocket)
             message_type = data.get("type")
             
+            if message_type == "pong":
+                # Ответ на heartbeat: достаточно отметки о входящем кадре
+                continue
+            
             if message_type == "message":
-                db = next(deps.get_db())
                 message_data = {
                     "sender_id": int(user_id),
                     "receiver_id": data["receiver_id"],
                     "content": data["content"]
                 }
                 
-                saved_message = await chat_manager.save_message_to_db(message_data, db)
+                # Запись идет пачкой вместе с сообщениями других сокетов, ответ - после commit
+                saved_message = await chat_manager.save_message_to_db(message_data)
                 
-                await websocket.send_json({
+                await chat_manager.send_personal_message({
                     "type": "message_sent",
                     "message": saved_message
-                })
+                }, websocket)
                 
                 # Добавляем получателя в данные для отправки
                 broadcast_message = {
@@ -586,19 +474,35 @@ async def chat_websocket_endpoint(websocket: WebSocket, token: str):
                     "receiver_id": data["receiver_id"]
                 }
                 await chat_manager.broadcast(broadcast_message)
+            
+            elif message_type == "typing":
+                # Состояние набора текста уходит собеседнику (только если есть общий чат) на ближайшем тике
+                if await chat_manager.get_chat_partners(user_id, [data["receiver_id"]]):
+                    chat_manager.events.typing(user_id, data["receiver_id"], data.get("is_typing", True))
+            
+            elif message_type == "read":
+                # Прочитаны входящие от user_id до message_id включительно
+                chat_manager.events.mark_read(int(user_id), int(data["user_id"]), int(data["message_id"]))
+            
+            elif message_type == "presence_subscribe":
+                await chat_manager.watch_presence(websocket, user_id, data.get("user_ids", []))
     except WebSocketDisconnect:
         chat_manager.disconnect(websocket, user_id)
     except Exception as e:
         print(f"WebSocket error: {e}")
         chat_manager.disconnect(websocket, user_id)
+    finally:
+        connection_lifecycle.release(websocket)
 
 @app.websocket("/mobile/ws/test")
 async def websocket_test_endpoint(websocket: WebSocket):
     print("WebSocket test connection request")
+    if not await connection_lifecycle.admit(websocket, "test"):
+        return
     await websocket.accept()
     print("WebSocket test connection accepted")
     
-    try:
+    async def send_test_messages():
         while True:
             # Отправляем тестовое сообщение каждые 5 секунд
             test_message = {
@@ -608,8 +512,20 @@ async def websocket_test_endpoint(websocket: WebSocket):
             }
             await websocket.send_text(json.dumps(test_message))
             await asyncio.sleep(5)
+    
+    sender_task = asyncio.create_task(send_test_messages())
+    try:
+        # Читаем входящие кадры, чтобы замечать pong и закрытие со стороны клиента
+        while True:
+            await websocket.receive_text()
+            connection_lifecycle.touch(websocket)
     except WebSocketDisconnect:
         print("WebSocket test connection disconnected")
+    except Exception as e:
+        print(f"WebSocket test connection error: {e}")
+    finally:
+        sender_task.cancel()
+        connection_lifecycle.release(websocket)
 
 @app.websocket("/superadmin/ws/logs")
 async def logs_websocket_endpoint(websocket: WebSocket):
@@ -617,9 +533,30 @@ async def logs_websocket_endpoint(websocket: WebSocket):
     import asyncio
     from datetime import datetime
     
+    from starlette.concurrency import run_in_threadpool
+    
+    if not await connection_lifecycle.admit(websocket, "superadmin_logs"):
+        return
     await websocket.accept()
     print("SuperAdmin logs WebSocket connection established")
     
+    process = None
+    reader_task = None
+    
+    async def stream_logs():
+        while True:
+            # Читаем строку из логов в пуле потоков, чтобы не блокировать цикл событий
+            line = await run_in_threadpool(process.stdout.readline)
+            if line:
+                log_entry = {
+                    "timestamp": datetime.now().isoformat(),
+                    "message": line.strip(),
+                    "level": "INFO"  # Можно добавить определение уровня лога
+                }
+                await websocket.send_text(json.dumps(log_entry))
+            else:
+                await asyncio.sleep(0.1)
+    
     try:
         # Запускаем процесс для получения логов Docker
         process = subprocess.Popen(
@@ -629,28 +566,23 @@ async def logs_websocket_endpoint(websocket: WebSocket):
             universal_newlines=True,
             bufsize=1
         )
+        reader_task = asyncio.create_task(stream_logs())
         
+        # Читаем входящие кадры: pong на heartbeat и закрытие со стороны клиента
         while True:
-            # Читаем строку из логов
-            line = process.stdout.readline()
-            if line:
-                log_entry = {
-                    "timestamp": datetime.now().isoformat(),
-                    "message": line.strip(),
-                    "level": "INFO"  # Можно добавить определение уровня лога
-                }
-                await websocket.send_text(json.dumps(log_entry))
-            else:
-                await asyncio.sleep(0.1)
+            await websocket.receive_text()
+            connection_lifecycle.touch(websocket)
                 
     except WebSocketDisconnect:
         print("SuperAdmin logs WebSocket connection disconnected")
-        if 'process' in locals():
-            process.terminate()
     except Exception as e:
         print(f"Error in logs WebSocket: {e}")
-        if 'process' in locals():
+    finally:
+        if reader_task:
+            reader_task.cancel()
+        if process:
             process.terminate()
+        connection_lifecycle.release(websocket)
 
 # Корневой маршрут - перенаправление на мобильную версию
 @app.get("/", response_class=RedirectResponse)
@@ -718,40 +650,15 @@ async def mobile_register_verify(request: Request, db: Session = Depends(deps.ge
             if not phone.startswith('+'):
                 phone = '+' + phone
             
-            # Проверяем, есть ли уже активный код для этого телефона
-            existing_code = None
-            try:
-                from api.v1.endpoints.telegram_auth import load_verification_codes, save_verification_codes
-                codes = load_verification_codes()
-                
-                if phone in codes:
-                    stored_data = codes[phone]
-                    time_diff = datetime.now() - stored_data['timestamp']
-                    if time_diff <= timedelta(minutes=2):
-                        existing_code = stored_data['code']
-                        print(f"🔄 Используем существующий код {existing_code} для {phone}")
-                
-                # Генерируем новый код только если нет активного
-                if not existing_code:
-                    codes[phone] = {
-                        'code': code,
-                        'timestamp': datetime.now(),
-                        'user_id': None
-                    }
-                    save_verification_codes(codes)
-                    print(f"✅ Сгенерирован новый код {code} для {phone}")
-                else:
-                    code = existing_code
-                    
-            except Exception as e:
-                print(f"❌ Ошибка работы с кодами: {e}")
-                # Сохраняем код в память как fallback
-                if not hasattr(mobile_register_verify, '_codes'):
-                    mobile_register_verify._codes = {}
-                mobile_register_verify._codes[phone] = {
-                    'code': code,
-                    'timestamp': datetime.now()
-                }
+            # Код младше 2 минут переиспользуется (его же отдаст бот), иначе создается новый
+            from starlette.concurrency import run_in_threadpool
+            from app.utils.code_store import get_or_create_verification_code
+            # Хранилище кодов может быть в процессе бота - ожидание ответа в пуле потоков
+            code, _, created = await run_in_threadpool(get_or_create_verification_code, phone, user_id=None)
+            if created:
+                print(f"✅ Сгенерирован новый код {code} для {phone}")
+            else:
+                print(f"🔄 Используем существующий код {code} для {phone}")
                 
         except Exception as e:
             print(f"❌ Ошибка генерации кода: {e}")
@@ -848,6 +755,7 @@ async def mobile_service_detail(request: Request, card_id: int, db: Session = De
     
     # Добавляем has_360_tour к service_card
     service_card.has_360_tour = service_card.has_360_tour()
+    service_card.tour_360_multires = service_card.get_360_multires()
     
     return templates.TemplateResponse("layout/service_detail.html", {
         "request": request,
@@ -863,26 +771,20 @@ async def mobile_profile(request: Request, tab: str = None, db: Session = Depend
     formatted_user_listings = []
     formatted_saved_listings = []
     
-    # Получаем токен из cookie
-    auth_token = request.cookies.get('access_token')
-    auth_header = request.headers.get('Authorization')
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        auth_token = auth_header.split(' ')[1]
+    # Токен уже проверен middleware, результат лежит в request.state
+    principal = deps.get_request_principal(request)
     
     # Получаем погоду и курс валюты для отображения в шапке
     weather = {"temperature": "+20°"}
     currency = {"value": "69.8"}
     
-    if auth_token:
+    if principal:
         try:
-            # Декодируем токен
-            payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            user_id = payload.get("sub")
+            user_id = principal.user_id
             
             if user_id:
-                # Получаем данные пользователя из БД
-                user = db.query(models.User).filter(models.User.id == user_id).first()
+                # Получаем данные пользователя (из кеша пользователей или БД)
+                user = deps.get_current_user_optional(request, db)
                 
                 if user:
                     print(f"DEBUG: Загружен пользователь: {user.email}, роль: {user.role}")
@@ -910,7 +812,8 @@ async def mobile_profile(request: Request, tab: str = None, db: Session = Depend
                                 "notes": prop.notes,  # Дата съемки 360
                                 "tour_360_url": prop.tour_360_url,
                                 "has_tour": bool(prop.tour_360_url or prop.tour_360_file_id),  # Обновленная логика проверки
-                                "image_url": get_valid_image_url(main_image.url if main_image else None)
+                                "image_url": get_valid_image_url(main_image.url if main_image else None, width=CARD_IMAGE_WIDTH),
+                                "image_placeholder": main_image.placeholder if main_image else None
                             })
                         
                         print(f"DEBUG: Найдено {len(formatted_user_listings)} объявлений пользователя")
@@ -948,7 +851,8 @@ async def mobile_profile(request: Request, tab: str = None, db: Session = Depend
                                     "status": prop.status,
                                     "tour_360_url": prop.tour_360_url,
                                     "has_tour": bool(prop.tour_360_url or prop.tour_360_file_id),  # Обновленная логика проверки
-                                    "image_url": get_valid_image_url(main_image.url if main_image else None)
+                                    "image_url": get_valid_image_url(main_image.url if main_image else None, width=CARD_IMAGE_WIDTH),
+                                    "image_placeholder": main_image.placeholder if main_image else None
                                 })
                             
                             print(f"DEBUG: Найдено {len(saved_listings)} сохраненных объявлений")
@@ -1012,22 +916,15 @@ async def mobile_create_listing(request: Request, db: Session = Depends(deps.get
     # Получаем текущего пользователя
     user = None
     
-    # Получаем токен из cookie
-    auth_token = request.cookies.get('access_token')
-    auth_header = request.headers.get('Authorization')
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        auth_token = auth_header.split(' ')[1]
+    # Токен уже проверен middleware, результат лежит в request.state
+    principal = deps.get_request_principal(request)
     
-    if auth_token:
+    if principal:
         try:
-            # Декодируем токен
-            payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            user_id = payload.get("sub")
+            # Получаем данные пользователя (из кеша пользователей или БД)
+            user = deps.get_current_user_optional(request, db)
             
-            if user_id:
-                # Получаем данные пользователя из БД
-                user = db.query(models.User).filter(models.User.id == user_id).first()
+            if user:
                 print(f"DEBUG: Загружен пользователь для создания объявления: {user.email}, роль: {user.role}")
                 
                 # Дополняем данные пользователя для корпоративных аккаунтов
@@ -1065,7 +962,7 @@ async def mobile_search(
     renovation: bool = None,
     parking: bool = None,
     q: str = None,
-    db: Session = Depends(deps.get_db)
+    db: AsyncSession = Depends(deps.get_async_db)
 ):
     print("\n===================================================")
     print("DEBUG: Параметры запроса:")
@@ -1084,10 +981,10 @@ async def mobile_search(
         category = "Недвижимость"
     
     # Формируем базовый запрос для получения активных объявлений
-    query = db.query(models.Property).filter(models.Property.status == 'active')
+    query = select(models.Property).where(models.Property.status == 'active')
     
     # Получаем все категории для выпадающего списка
-    categories = db.query(models.Category).all()
+    categories = (await db.execute(select(models.Category))).scalars().all()
     print(f"DEBUG: Загружены категории: {[cat.name for cat in categories]}")
     
     # Получаем общие категории товаров/услуг из JSON файла
@@ -1097,12 +994,12 @@ async def mobile_search(
     # Применяем фильтры, если они указаны
     if category and category != "Недвижимость":
         print(f"DEBUG: Применяем фильтр по категории: {category}")
-        query = query.join(models.Property.categories).filter(models.Category.name == category)
+        query = query.join(models.Property.categories).where(models.Category.name == category)
     
     # Поиск по ключевому слову в названии или адресе
     if q:
         search_term = f"%{q}%"
-        query = query.filter(or_(
+        query = query.where(or_(
             models.Property.title.ilike(search_term),
             models.Property.address.ilike(search_term),
             models.Property.description.ilike(search_term)
@@ -1110,44 +1007,44 @@ async def mobile_search(
     
     # Фильтры по цене
     if price_min is not None:
-        query = query.filter(models.Property.price >= price_min)
+        query = query.where(models.Property.price >= price_min)
     
     if price_max is not None:
-        query = query.filter(models.Property.price <= price_max)
+        query = query.where(models.Property.price <= price_max)
     
     # Фильтры по площади
     if min_area is not None:
-        query = query.filter(models.Property.area >= min_area)
+        query = query.where(models.Property.area >= min_area)
     
     if max_area is not None:
-        query = query.filter(models.Property.area <= max_area)
+        query = query.where(models.Property.area <= max_area)
     
     # Фильтр по количеству комнат
     if rooms is not None:
-        query = query.filter(models.Property.rooms == rooms)
+        query = query.where(models.Property.rooms == rooms)
     
     # Фильтры по этажу
     if min_floor is not None:
-        query = query.filter(models.Property.floor >= min_floor)
+        query = query.where(models.Property.floor >= min_floor)
     
     if max_floor is not None:
-        query = query.filter(models.Property.floor <= max_floor)
+        query = query.where(models.Property.floor <= max_floor)
     
     # Дополнительные фильтры
     if balcony is not None and balcony:
-        query = query.filter(models.Property.has_balcony == True)
+        query = query.where(models.Property.has_balcony == True)
     
     if furniture is not None and furniture:
-        query = query.filter(models.Property.has_furniture == True)
+        query = query.where(models.Property.has_furniture == True)
     
     if renovation is not None and renovation:
-        query = query.filter(models.Property.has_renovation == True)
+        query = query.where(models.Property.has_renovation == True)
     
     if parking is not None and parking:
-        query = query.filter(models.Property.has_parking == True)
+        query = query.where(models.Property.has_parking == True)
     
     # Получаем объявления с загрузкой изображений
-    properties_db = query.options(joinedload(models.Property.images)).all()
+    properties_db = (await db.execute(query.options(selectinload(models.Property.images)))).scalars().unique().all()
     
     # Форматируем данные для шаблона
     properties = []
@@ -1176,8 +1073,10 @@ async def mobile_search(
             "has_furniture": prop.has_furniture,
             "has_renovation": prop.has_renovation,
             "has_parking": prop.has_parking,
-            "image_url": get_valid_image_url(main_image.url if main_image else None),
+            "image_url": get_valid_image_url(main_image.url if main_image else None, width=CARD_IMAGE_WIDTH),
+            "image_placeholder": main_image.placeholder if main_image else None,
             "images": images,
+            "image_placeholders": [img.placeholder for img in prop.images],
             "images_count": len(images)
         })
     
@@ -1219,25 +1118,18 @@ async def mobile_support(request: Request):
     return templates.TemplateResponse("layout/support.html", {"request": request})
 
 @app.get("/mobile/property/{property_id}", response_class=HTMLResponse, name="property")
-async def mobile_property_detail(request: Request, property_id: int, db: Session = Depends(deps.get_db)):
+async def mobile_property_detail(request: Request, property_id: int, db: AsyncSession = Depends(deps.get_async_db)):
     # Получаем текущего пользователя, если он авторизован
-    current_user = None
-    token = request.cookies.get('access_token')
+    current_user = await deps.get_current_user_optional_async(request, db)
     
-    if token:
-        try:
-            payload = pyjwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            user_id = int(payload.get("sub"))
-            current_user = db.query(models.User).filter(models.User.id == user_id).first()
-        except Exception as e:
-            print(f"DEBUG: Ошибка при получении пользователя: {e}")
-    
-    # Получаем объявление из БД
-    property = db.query(models.Property).options(
-        joinedload(models.Property.owner),
-        joinedload(models.Property.images),
-        joinedload(models.Property.categories)
-    ).filter(models.Property.id == property_id).first()
+    # Получаем объявление из БД (связи загружаются сразу: в async сессии ленивой загрузки нет)
+    property = (await db.execute(
+        select(models.Property).options(
+            joinedload(models.Property.owner),
+            selectinload(models.Property.images),
+            selectinload(models.Property.categories)
+        ).where(models.Property.id == property_id)
+    )).scalars().first()
     
     if not property:
         return templates.TemplateResponse("404.html", {"request": request})
@@ -1261,8 +1153,17 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
             print(f"DEBUG: Пропускаем увеличение просмотров - объявление неактивно: {property.status}")
         
         if should_increment:
-            property.views = (property.views or 0) + 1
-            db.commit()
+            # Атомарный UPDATE сразу в основную БД, мимо сессии: объявление могло быть
+            # прочитано с отстающей реплики, а счетчик не должен переводить посетителя
+            # на чтение из основной БД
+            views = (property.views or 0) + 1
+            async with async_engine.begin() as connection:
+                await connection.execute(
+                    update(models.Property)
+                    .where(models.Property.id == property_id)
+                    .values(views=func.coalesce(models.Property.views, 0) + 1)
+                )
+            set_committed_value(property, "views", views)
             print(f"DEBUG: Увеличен счетчик просмотров для объявления {property_id}: {property.views}")
         
     except Exception as e:
@@ -1272,10 +1173,12 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
     # Проверяем, добавлено ли объявление в избранное
     is_favorite = False
     if current_user:
-        favorite = db.query(models.Favorite).filter(
-            models.Favorite.user_id == current_user.id,
-            models.Favorite.property_id == property.id
-        ).first()
+        favorite = (await db.execute(
+            select(models.Favorite.id).where(
+                models.Favorite.user_id == current_user.id,
+                models.Favorite.property_id == property.id
+            ).limit(1)
+        )).first()
         is_favorite = favorite is not None
     
     # Проверяем, является ли текущий пользователь владельцем
@@ -1287,25 +1190,29 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
         category = property.categories[0]
     
     # Получаем похожие объявления (того же типа, в том же городе)
-    similar_properties = db.query(models.Property).options(
-        joinedload(models.Property.images)
-    ).filter(
-        models.Property.id != property.id,
-        models.Property.city == property.city,
-        models.Property.status == models.PropertyStatus.ACTIVE  # Используем enum вместо строки
-    ).limit(5).all()
+    similar_properties = (await db.execute(
+        select(models.Property).options(
+            selectinload(models.Property.images)
+        ).where(
+            models.Property.id != property.id,
+            models.Property.city == property.city,
+            models.Property.status == models.PropertyStatus.ACTIVE  # Используем enum вместо строки
+        ).limit(5)
+    )).scalars().all()
     
     # Форматируем похожие объявления
     similar_properties_data = []
     for prop in similar_properties:
         # Обработка изображений для похожих объявлений
         main_image_url = "/static/layout/assets/img/property-placeholder.jpg"
+        main_image_placeholder = None
         
         # Сначала пробуем медиа-сервер
         if prop.images_data and isinstance(prop.images_data, list):
             for img_data in prop.images_data:
                 if isinstance(img_data, dict) and "urls" in img_data:
                     main_image_url = img_data["urls"].get("medium", img_data["urls"].get("original", ""))
+                    main_image_placeholder = img_data.get("placeholder")
                     if img_data.get("is_main", False):
                         break  # Используем главное изображение
         
@@ -1314,6 +1221,7 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
             main_image = next((img for img in prop.images if img.is_main), None) or prop.images[0]
             if main_image:
                 main_image_url = main_image.url
+                main_image_placeholder = main_image.placeholder
         
         similar_properties_data.append({
             "id": prop.id,
@@ -1322,7 +1230,8 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
             "address": prop.address,
             "rooms": prop.rooms,
             "area": prop.area,
-            "image_url": main_image_url
+            "image_url": main_image_url,
+            "image_placeholder": main_image_placeholder
         })
     
     # Форматируем данные для шаблона
@@ -1347,6 +1256,7 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
         "tour_360_thumbnail_url": property.tour_360_thumbnail_url,
         "tour_360_metadata": property.tour_360_metadata,
         "tour_360_uploaded_at": property.tour_360_uploaded_at,
+        "tour_360_multires": property.get_360_multires(),  # Тайлы для прогрессивной загрузки
         "has_360": bool(property.tour_360_url or property.tour_360_file_id),  # Добавляем поле has_360
         "rooms": property.rooms,
         "floor": property.floor,
@@ -1396,6 +1306,7 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
             if isinstance(img_data, dict) and "urls" in img_data:
                 images_list.append({
                     "url": img_data["urls"].get("medium", img_data["urls"].get("original", "")),
+                    "placeholder": img_data.get("placeholder"),
                     "is_main": img_data.get("is_main", False),
                     "from_media_server": True
                 })
@@ -1417,7 +1328,7 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
     
     # Если нет изображений с медиа-сервера, используем локальные
     if not images_list and property.images:
-        images_list = [{"url": img.url, "is_main": img.is_main, "from_media_server": False} for img in property.images]
+        images_list = [{"url": img.url, "placeholder": img.placeholder, "is_main": img.is_main, "from_media_server": False} for img in property.images]
     
     property_data["images"] = images_list
     
@@ -1430,10 +1341,9 @@ async def mobile_property_detail(request: Request, property_id: int, db: Session
         weather = {"temperature": "+20°"}
         
         # Попробуем получить курс доллара к сому
-        import requests
         try:
-            # Используем публичный API для курса валют
-            response = requests.get("https://api.exchangerate-api.com/v4/latest/USD", timeout=5)
+            # Используем публичный API для курса валют (общий клиент провайдера "fx")
+            response = await http_clients.request("fx", "GET", "/v4/latest/USD")
             if response.status_code == 200:
                 data = response.json()
                 kgs_rate = data.get("rates", {}).get("KGS", 87.5)
@@ -1555,8 +1465,7 @@ async def get_debug_info():
 async def get_currency_rate():
     """Получение актуального курса доллара к сому"""
     try:
-        import requests
-        response = requests.get("https://api.exchangerate-api.com/v4/latest/USD", timeout=5)
+        response = await http_clients.request("fx", "GET", "/v4/latest/USD")
         if response.status_code == 200:
             data = response.json()
             kgs_rate = data.get("rates", {}).get("KGS", 87.5)
@@ -1594,16 +1503,27 @@ class MessageReadRequest(BaseModel):
     message_id: int
 
 @app.post("/api/v1/chat/messages/read")
-async def mark_message_as_read(request: MessageReadRequest, db: Session = Depends(deps.get_db)):
+async def mark_message_as_read(read_request: MessageReadRequest, request: Request, db: Session = Depends(deps.get_db)):
     """ Маркировать сообщение как прочитанное """
     try:
-        # В реальном приложении здесь был бы код для обновления сообщения в базе данных
-        # Например: message = db.query(AppChatMessageModel).filter(AppChatMessageModel.id == request.message_id).first()
-        # if message:
-        #    message.is_read = True
-        #    db.commit()
-        print(f"DEBUG: Сообщение {request.message_id} отмечено как прочитанное")
-        return {"status": "success", "message": f"Сообщение {request.message_id} отмечено как прочитанное"}
+        # Сообщение только что пришло через WebSocket - на реплике его может еще не быть
+        use_primary(db)
+        current_user = deps.get_current_user_optional(request, db)
+        if not current_user:
+            return {"status": "error", "message": "Не авторизован"}
+        
+        message = db.query(AppChatMessageModel).filter(AppChatMessageModel.id == read_request.message_id).first()
+        if not message or message.sender_id == current_user.id:
+            return {"status": "error", "message": "Сообщение не найдено"}
+        
+        chat = db.query(AppChatModel).filter(AppChatModel.id == message.chat_id).first()
+        if not chat or current_user.id not in (chat.user1_id, chat.user2_id):
+            return {"status": "error", "message": "Нет доступа к сообщению"}
+        
+        # Отметка копится до ближайшего тика: запись в БД и read_receipt отправителю - пачкой
+        chat_manager.events.mark_read(current_user.id, message.sender_id, message.id)
+        print(f"DEBUG: Сообщение {read_request.message_id} отмечено как прочитанное")
+        return {"status": "success", "message": f"Сообщение {read_request.message_id} отмечено как прочитанное"}
     except Exception as e:
         print(f"ERROR: Ошибка при маркировке сообщения как прочитанное: {e}")
         return {"status": "error", "message": f"Ошибка при маркировке сообщения: {str(e)}"}
@@ -1689,42 +1609,17 @@ async def get_chat_messages(user_id: int, request: Request, db: Session = Depend
         # Получаем сообщения из памяти chat_manager
         messages = chat_manager.chat_messages.get(chat_id, [])
         
-        # Если сообщений нет в памяти, пробуем загрузить их из файла
-        if not messages and os.path.exists("chat_messages.json"):
-            try:
-                with open("chat_messages.json", "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    
-                    # Сначала пробуем найти сообщения по новому chat_id
-                    messages = data.get(chat_id, [])
-                    
-                    if not messages:
-                        # Если сообщений нет, пробуем найти сообщения по старому chat_id="4"
-                        # Это нужно для обратной совместимости со старыми сообщениями
-                        old_messages = data.get("4", [])
-                        
-                        # Фильтруем сообщения, относящиеся к этим пользователям
-                        filtered_messages = []
-                        for msg in old_messages:
-                            if (str(msg.get("sender_id")) == str(current_user_id) and str(msg.get("receiver_id")) == str(user_id)) or \
-                               (str(msg.get("sender_id")) == str(user_id) and str(msg.get("receiver_id")) == str(current_user_id)):
-                                # Обновляем chat_id для совместимости с новой системой
-                                msg["chat_id"] = chat_id
-                                filtered_messages.append(msg)
-                        
-                        # Используем отфильтрованные сообщения
-                        messages = filtered_messages
-                        
-                        # Сохраняем обновленные сообщения в памяти chat_manager
-                        if messages:
-                            for msg in messages:
-                                chat_manager.add_message_to_memory(chat_id, msg)
-                    
-                    print(f"DEBUG: Загружено {len(messages)} сообщений для чата {chat_id}")
-                    # В случае, если мы мигрировали сообщения, сохраняем их в файл
-                    chat_manager.save_messages_to_file()
-            except Exception as e:
-                print(f"DEBUG: Ошибка при загрузке сообщений из файла: {e}")
+        if not messages:
+            # Если сообщений нет, пробуем найти сообщения по старому chat_id="4"
+            # Это нужно для обратной совместимости со старыми сообщениями
+            # (журнал переносит их из chat_messages.json при первом запуске)
+            for msg in chat_manager.chat_messages.get("4", []):
+                if (str(msg.get("sender_id")) == str(current_user_id) and str(msg.get("receiver_id")) == str(user_id)) or \
+                   (str(msg.get("sender_id")) == str(user_id) and str(msg.get("receiver_id")) == str(current_user_id)):
+                    # Переносим сообщение в новый chat_id
+                    chat_manager.add_message_to_memory(chat_id, dict(msg, chat_id=chat_id))
+            messages = chat_manager.chat_messages.get(chat_id, [])
+            print(f"DEBUG: Загружено {len(messages)} сообщений для чата {chat_id}")
         
         print(f"DEBUG: Возвращаем {len(messages)} сообщений для чата с пользователем {user_id}")
         return messages
@@ -1750,7 +1645,16 @@ async def admin_login_post(
         models.User.role == models.UserRole.ADMIN
     ).first()
     
-    if not admin or not verify_password(password, admin.hashed_password):
+    try:
+        password_valid = bool(admin) and await password_hasher.verify_user(db, admin, password)
+    except PasswordHasherBusy:
+        return templates.TemplateResponse(
+            "admin/index.html",
+            {"request": request, "error": "Слишком много попыток входа, повторите через несколько секунд"},
+            status_code=503
+        )
+    
+    if not password_valid:
         return templates.TemplateResponse(
             "admin/index.html",
             {"request": request, "error": "Неверный email или пароль"}
@@ -2142,21 +2046,16 @@ async def admin_properties(
 
 # Функция для проверки доступа администратора
 async def check_admin_access(request: Request, db: Session):
-    auth_token = request.cookies.get('access_token')
-    if not auth_token:
+    principal = deps.get_request_principal(request)
+    if not principal:
         return RedirectResponse(url="/admin/login", status_code=303)
     
     try:
-        payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        if datetime.fromtimestamp(payload["exp"]) < datetime.utcnow():
-            return RedirectResponse(url="/admin/login", status_code=303)
-            
         # Проверяем, что пользователь является администратором
-        if not payload.get("is_admin"):
+        if not principal.is_admin:
             return RedirectResponse(url="/admin/login", status_code=303)
             
-        user_id = int(payload.get("sub"))
-        user = db.query(User).filter(User.id == user_id).first()
+        user = deps.get_current_user_optional(request, db)
         if not user:
             return RedirectResponse(url="/admin/login", status_code=303)
             
@@ -2447,19 +2346,12 @@ class SettingsModel(BaseModel):
 @app.post("/api/v1/settings")
 async def save_settings(settings: SettingsModel, request: Request, db: Session = Depends(deps.get_db)):
     # Проверяем авторизацию, но для этого API допускаем любого авторизованного пользователя
-    auth_token = request.cookies.get('access_token')
-    auth_header = request.headers.get('Authorization')
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        auth_token = auth_header.split(' ')[1]
-    
-    if not auth_token:
+    if not deps.get_request_token(request):
         return JSONResponse(status_code=401, content={"success": False, "error": "Требуется авторизация"})
     
     try:
-        # Проверяем валидность токена
-        payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        if datetime.fromtimestamp(payload["exp"]) < datetime.utcnow():
+        # Проверяем валидность токена (истекший токен не проходит проверку)
+        if not deps.get_request_principal(request):
             return JSONResponse(status_code=401, content={"success": False, "error": "Токен истек"})
         
         # В реальном приложении здесь бы сохраняли настройки в БД
@@ -2473,19 +2365,12 @@ async def save_settings(settings: SettingsModel, request: Request, db: Session =
 @app.post("/api/v1/settings/reset")
 async def reset_settings(request: Request, db: Session = Depends(deps.get_db)):
     # Проверяем авторизацию
-    auth_token = request.cookies.get('access_token')
-    auth_header = request.headers.get('Authorization')
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        auth_token = auth_header.split(' ')[1]
-    
-    if not auth_token:
+    if not deps.get_request_token(request):
         return JSONResponse(status_code=401, content={"success": False, "error": "Требуется авторизация"})
     
     try:
-        # Проверяем валидность токена
-        payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        if datetime.fromtimestamp(payload["exp"]) < datetime.utcnow():
+        # Проверяем валидность токена (истекший токен не проходит проверку)
+        if not deps.get_request_principal(request):
             return JSONResponse(status_code=401, content={"success": False, "error": "Токен истек"})
         
         # В реальном приложении здесь бы сбрасывали настройки к значениям по умолчанию
@@ -2497,21 +2382,16 @@ async def reset_settings(request: Request, db: Session = Depends(deps.get_db)):
 
 # Функция для проверки доступа суперадмина
 async def check_superadmin_access(request: Request, db: Session):
-    auth_token = request.cookies.get('access_token')
-    if not auth_token:
+    principal = deps.get_request_principal(request)
+    if not principal:
         return RedirectResponse(url="/superadmin/login", status_code=303)
     
     try:
-        payload = pyjwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        if datetime.fromtimestamp(payload["exp"]) < datetime.utcnow():
-            return RedirectResponse(url="/superadmin/login", status_code=303)
-            
         # Проверяем, что пользователь является суперадминистратором
-        if not payload.get("is_superadmin"):
+        if not principal.is_superadmin:
             return RedirectResponse(url="/superadmin/login", status_code=303)
             
-        user_id = int(payload.get("sub"))
-        user = db.query(User).filter(User.id == user_id).first()
+        user = deps.get_current_user_optional(request, db)
         if not user:
             return RedirectResponse(url="/superadmin/login", status_code=303)
             
@@ -2543,7 +2423,20 @@ async def superadmin_login_post(
     # Дополнительная проверка: только определенные email могут быть суперадминами
     superadmin_emails = ['superadmin@wazir.kg', 'admin@wazir.kg']
     
-    if not superadmin or not verify_password(password, superadmin.hashed_password) or username not in superadmin_emails:
+    try:
+        password_valid = (
+            bool(superadmin)
+            and username in superadmin_emails
+            and await password_hasher.verify_user(db, superadmin, password)
+        )
+    except PasswordHasherBusy:
+        return templates.TemplateResponse(
+            "superadmin/login.html",
+            {"request": request, "error": "Слишком много попыток входа, повторите через несколько секунд"},
+            status_code=503
+        )
+    
+    if not password_valid:
         return templates.TemplateResponse(
             "superadmin/login.html",
             {"request": request, "error": "Неверный логин или пароль суперадмина"}
@@ -3344,10 +3237,6 @@ async def superadmin_settings(request: Request, db: Session = Depends(deps.get_d
     })
 
 # API роуты для суперадмина
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 @app.post("/api/v1/superadmin/admins")
 async def create_admin(
     request: Request,
@@ -3374,8 +3263,8 @@ async def create_admin(
             if existing_phone:
                 return JSONResponse(status_code=400, content={"success": False, "message": "Пользователь с таким телефоном уже существует"})
         
-        # Хешируем пароль
-        hashed_password = pwd_context.hash(password)
+        # Хешируем пароль (в пуле потоков bcrypt, не блокируя event loop)
+        hashed_password = await password_hasher.hash(password)
         
         # Создаем нового администратора
         new_admin = models.User(
@@ -3394,6 +3283,12 @@ async def create_admin(
         print(f"DEBUG: Создан новый администратор: {email}")
         return JSONResponse(content={"success": True, "message": "Администратор создан успешно"})
         
+    except PasswordHasherBusy as e:
+        return JSONResponse(
+            status_code=503,
+            content={"success": False, "message": "Сервер перегружен, повторите через несколько секунд"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         print(f"ERROR: Ошибка создания администратора: {e}")
         db.rollback()
@@ -4034,7 +3929,7 @@ async def create_service_card(
                 # Удаление существующих файлов панорамы, если они есть
                 if service_card.tour_360_file_id:
                     try:
-                        await processor.delete_panorama_files(service_card.tour_360_file_id, str(service_card.id))
+                        await processor.delete_panorama_files(service_card.tour_360_file_id)
                     except Exception as e:
                         print(f"Ошибка удаления существующих файлов: {str(e)}")
                 
@@ -4095,6 +3990,7 @@ async def create_service_card(
 async def upload_service_card_360_file(
     card_id: int,
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(deps.get_db)
 ):
@@ -4123,13 +4019,16 @@ async def upload_service_card_360_file(
         service_card.tour_360_optimized_url = result['urls']['optimized']
         service_card.tour_360_preview_url = result['urls']['preview']
         service_card.tour_360_thumbnail_url = result['urls']['thumbnail']
-        service_card.tour_360_metadata = json.dumps(result['metadata'], ensure_ascii=False)
+        service_card.tour_360_metadata = json.dumps(mark_multires_pending(result['metadata']), ensure_ascii=False)
         service_card.tour_360_uploaded_at = datetime.now()
         service_card.tour_360_url = None
         
         db.commit()
         db.refresh(service_card)
         
+        # Нарезка на тайлы для прогрессивного просмотра - после ответа клиенту
+        background_tasks.add_task(panorama_tiler.build_tiles, "ServiceCard", service_card.id, result['file_id'])
+        
         return JSONResponse(content={
             "success": True,
             "message": "360° панорама успешно загружена и обработана",
@@ -4283,6 +4182,8 @@ async def upload_service_card_photos(
         
         # Удаляем старые изображения из БД
         old_images = db.query(ServiceCardImage).filter(ServiceCardImage.service_card_id == card_id).all()
+        old_hashes = [media_uploader.content_hash_from_url(img.url) for img in old_images]
+        old_hashes.append(media_uploader.content_hash_from_url(service_card.image_url))
         for old_image in old_images:
             db.delete(old_image)
         print(f"DEBUG: Удалено {len(old_images)} старых изображений")
@@ -4314,6 +4215,10 @@ async def upload_service_card_photos(
         
         db.commit()
         print(f"DEBUG: Сохранено {len(uploaded_images)} изображений в БД")
+        
+        # Файлы замененных фотографий удалит сборщик мусора, если на них больше никто не ссылается
+        release_result = await media_uploader.release_content(old_hashes)
+        print(f"DEBUG: Освобождено старых фотографий: {release_result['count']}")
         print("=== ЗАГРУЗКА ЗАВЕРШЕНА УСПЕШНО ===")
         
         return {
@@ -4448,6 +4353,8 @@ async def delete_service_card(
         if not service_card:
             return JSONResponse(status_code=404, content={"success": False, "error": "Заведение не найдено"})
         
+        old_urls = [img.url for img in db.query(ServiceCardImage).filter(ServiceCardImage.service_card_id == card_id).all()]
+        old_urls.append(service_card.image_url)
         db.query(ServiceCardImage).filter(ServiceCardImage.service_card_id == card_id).delete()
         
         try:
@@ -4461,6 +4368,11 @@ async def delete_service_card(
         db.delete(service_card)
         db.commit()
         
+        try:
+            await media_uploader.release_content([media_uploader.content_hash_from_url(url) for url in old_urls])
+        except Exception as e:
+            print(f"WARNING: Ошибка при освобождении изображений заведения: {str(e)}")
+        
         return {"success": True, "message": "Заведение успешно удалено"}
         
     except Exception as e:
@@ -4643,18 +4555,15 @@ async def test_quick_upload(photos: List[UploadFile] = File(...)):
 
 
 async def check_company_access(request: Request, db: Session):
-    auth_token = request.cookies.get('access_token')
-    if not auth_token:
+    principal = deps.get_request_principal(request)
+    if not principal:
         return RedirectResponse('/companies/login', status_code=303)
     
     try:
-        from jose import jwt
-        payload = jwt.decode(auth_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        
-        if not payload.get("is_company"):
+        if not principal.is_company:
             return RedirectResponse('/companies/login', status_code=303)
         
-        user = db.query(models.User).filter(models.User.id == payload["sub"]).first()
+        user = deps.get_current_user_optional(request, db)
         if not user or user.role != models.UserRole.COMPANY:
             return RedirectResponse('/companies/login', status_code=303)
         
@@ -4680,7 +4589,16 @@ async def company_login_post(
         models.User.role == models.UserRole.COMPANY
     ).first()
     
-    if not company or not verify_password(password, company.hashed_password):
+    try:
+        password_valid = bool(company) and await password_hasher.verify_user(db, company, password)
+    except PasswordHasherBusy:
+        return templates.TemplateResponse(
+            "companies/login.html",
+            {"request": request, "error": "Слишком много попыток входа, повторите через несколько секунд"},
+            status_code=503
+        )
+    
+    if not password_valid:
         return templates.TemplateResponse(
             "companies/login.html",
             {"request": request, "error": "Неверный email или пароль"}
@@ -4915,8 +4833,10 @@ async def mobile_search(
             "has_furniture": prop.has_furniture,
             "has_renovation": prop.has_renovation,
             "has_parking": prop.has_parking,
-            "image_url": get_valid_image_url(main_image.url if main_image else None),
+            "image_url": get_valid_image_url(main_image.url if main_image else None, width=CARD_IMAGE_WIDTH),
+            "image_placeholder": main_image.placeholder if main_image else None,
             "images": images,
+            "image_placeholders": [img.placeholder for img in prop.images],
             "images_count": len(images)
         })
     
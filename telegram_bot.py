@@ -1,12 +1,30 @@
 import asyncio
+import fcntl
 import logging
 import os
+import signal
+import time
 import nest_asyncio
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional
+
+if __name__ == "__main__":
+    # Отдельный процесс бота хранит коды у себя (до импорта настроек и хранилища)
+    os.environ["TELEGRAM_BOT_PROCESS"] = "1"
+
 from datetime import datetime, timedelta
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from config import settings
+from app.utils import code_store as code_store_module
+from app.utils.bot_ipc import BotIPCServer, get_code_store_handlers
+from app.services.telegram_outbox import telegram_outbox, PRIORITY_CODE, PRIORITY_NOTIFICATION
+from app.utils.code_store import (
+    CODE_KEY_PREFIX,
+    generate_verification_code,
+    get_or_create_verification_code,
+    get_verification_code,
+    verify_and_consume_code,
+)
 
 # УБРАНО: nest_asyncio.apply() - несовместимо с uvloop
 # nest_asyncio.apply()
@@ -32,9 +50,9 @@ class SMSBot:
     def __init__(self):
         self.application = None
         self.user_phone_mapping = {}  # user_id -> phone
-        self.verification_codes = {}  # phone -> code
+        # Коды подтверждения - в общем хранилище кодов (app.utils.code_store), его же читает API
         self.pending_verifications = {}  # phone -> user_id
-        self.bot_task = None
+        self.started_at = None
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /start"""
@@ -68,80 +86,19 @@ class SMSBot:
         if not phone.startswith('+'):
             phone = '+' + phone
             
-        # 🔥 ИСПРАВЛЕНО: Ищем СУЩЕСТВУЮЩИЙ код вместо генерации нового
-        code = None
-        message = None
-        
-        # Сначала проверяем в собственной памяти бота
-        if phone in self.verification_codes:
-            stored_data = self.verification_codes[phone]
-            time_diff = datetime.now() - stored_data['timestamp']
-            if time_diff <= timedelta(minutes=2):
-                code = stored_data['code']
-                time_left = 120 - int(time_diff.total_seconds())
-                message = (
-                    f"✅ Номер получен: {phone}\n"
-                    f"🔐 ВАШ КОД ПОДТВЕРЖДЕНИЯ: {code}\n\n"
-                    f"📝 Введите этот код в приложении для авторизации.\n"
-                    f"⏰ Код действителен ещё {time_left} секунд.\n\n"
-                    f"🔄 Это тот же код, что был сгенерирован ранее"
-                )
-                logger.info(f"🔄 Отправлен существующий код {code} для {phone}")
-            else:
-                # Код истек, удаляем его
-                del self.verification_codes[phone]
-        
-        # Если нет кода в памяти, ищем в файле
-        if not code:
-            try:
-                import json
-                import os
-                
-                codes_file = "verification_codes.json"
-                if os.path.exists(codes_file):
-                    with open(codes_file, 'r', encoding='utf-8') as f:
-                        file_codes = json.load(f)
-                        
-                    if phone in file_codes:
-                        stored_data = file_codes[phone]
-                        stored_time = datetime.fromisoformat(stored_data['timestamp'])
-                        time_diff = datetime.now() - stored_time
-                        
-                        if time_diff <= timedelta(minutes=2):
-                            code = stored_data['code']
-                            time_left = 120 - int(time_diff.total_seconds())
-                            message = (
-                                f"✅ Номер получен: {phone}\n"
-                                f"🔐 ВАШ КОД ПОДТВЕРЖДЕНИЯ: {code}\n\n"
-                                f"📝 Введите этот код в приложении для авторизации.\n"
-                                f"⏰ Код действителен ещё {time_left} секунд.\n\n"
-                                f"🔄 Код был сгенерирован при открытии страницы"
-                            )
-                            logger.info(f"📁 Отправлен код {code} из файла для {phone}")
-                            
-                            # Сохраняем в память бота для следующих запросов
-                            self.verification_codes[phone] = {
-                                'code': code,
-                                'timestamp': stored_time,
-                                'user_id': user_id
-                            }
-                        else:
-                            # Код истек, удаляем из файла
-                            del file_codes[phone]
-                            with open(codes_file, 'w', encoding='utf-8') as f:
-                                json.dump(file_codes, f, ensure_ascii=False, indent=2)
-                            
-            except Exception as e:
-                logger.error(f"❌ Ошибка чтения кода из файла: {e}")
-        
-        # Если все еще нет кода, генерируем новый
-        if not code:
-            code = self.generate_code()
-            self.verification_codes[phone] = {
-                'code': code,
-                'timestamp': datetime.now(),
-                'user_id': user_id
-            }
+        # Код, сгенерированный при открытии страницы, переиспользуется (2 минуты),
+        # иначе создается новый. Проверка и создание - одной операцией хранилища
+        code, time_left, created = get_or_create_verification_code(phone, user_id=user_id)
+        if not created:
+            message = (
+                f"✅ Номер получен: {phone}\n"
+                f"🔐 ВАШ КОД ПОДТВЕРЖДЕНИЯ: {code}\n\n"
+                f"📝 Введите этот код в приложении для авторизации.\n"
+                f"⏰ Код действителен ещё {time_left} секунд.\n\n"
+                f"🔄 Это тот же код, что был сгенерирован ранее"
+            )
+            logger.info(f"🔄 Отправлен существующий код {code} для {phone}")
+        else:
             message = (
                 f"✅ Номер получен: {phone}\n"
                 f"🔐 ВАШ КОД ПОДТВЕРЖДЕНИЯ: {code}\n\n"
@@ -151,8 +108,8 @@ class SMSBot:
             )
             logger.info(f"🆕 Сгенерирован новый код {code} для {phone}")
         
-        # Отправляем код пользователю
-        await update.message.reply_text(message)
+        # Отправляем код пользователю через очередь: коды идут раньше уведомлений и не упираются в 429
+        telegram_outbox.enqueue(update.effective_chat.id, message, PRIORITY_CODE)
         
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик текстовых сообщений"""
@@ -167,46 +124,26 @@ class SMSBot:
         
     def generate_code(self) -> str:
         """Генерация 4-значного кода"""
-        import random
-        return ''.join(random.choices('0123456789', k=4))
+        return generate_verification_code()
         
     def verify_code(self, phone: str, code: str) -> bool:
-        """Проверка кода подтверждения"""
-        if phone not in self.verification_codes:
-            return False
-        
-        stored_data = self.verification_codes[phone]
-        
-        # Проверяем, не истек ли код (5 минут)
-        if datetime.now() - stored_data['timestamp'] > timedelta(minutes=5):
-            del self.verification_codes[phone]
-            return False
-        
-        # Проверяем код
-        if stored_data['code'] == code:
-            # Удаляем код после успешной проверки
-            del self.verification_codes[phone]
-            return True
-        
-        return False
+        """Проверка кода подтверждения: истекшие коды удаляет хранилище, верный код удаляется сразу"""
+        return verify_and_consume_code(phone, code)
         
     def get_verification_code(self, phone: str) -> Optional[str]:
         """Получение кода для отладки"""
-        if phone in self.verification_codes:
-            return self.verification_codes[phone]['code']
-        return None
+        stored_data = get_verification_code(phone)
+        return stored_data['code'] if stored_data else None
         
     async def send_message_to_user(self, user_id: int, message: str) -> bool:
-        """Отправка сообщения пользователю"""
-        try:
-            await self.application.bot.send_message(chat_id=user_id, text=message)
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-            return False
+        """Отправка сообщения пользователю через очередь (ждет доставки)"""
+        delivered = await telegram_outbox.send(user_id, message, PRIORITY_NOTIFICATION)
+        if not delivered:
+            logger.error(f"Ошибка отправки сообщения пользователю {user_id}")
+        return delivered
             
     async def start_bot(self):
-        """Запуск бота с nest_asyncio"""
+        """Запуск поллинга в текущем event loop (без блокирующего run_polling)"""
         print("🚀 [BOT] Инициализация Telegram бота...")
         
         if not settings.TELEGRAM_BOT_TOKEN:
@@ -225,8 +162,9 @@ class SMSBot:
             self.application.add_handler(MessageHandler(filters.CONTACT, self.handle_contact))
             self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
             
-            # Запускаем бота в фоновой задаче с nest_asyncio
-            self.bot_task = asyncio.create_task(self.application.run_polling(allowed_updates=Update.ALL_TYPES))
+            await self.application.initialize()
+            await self.application.start()
+            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
             print("✅ [BOT] Telegram бот запущен успешно!")
             
         except Exception as e:
@@ -238,34 +176,100 @@ class SMSBot:
         """Остановка бота"""
         print("🛑 [BOT] Остановка Telegram бота...")
         try:
-            if hasattr(self, 'bot_task') and self.bot_task:
-                self.bot_task.cancel()
-                try:
-                    await self.bot_task
-                except asyncio.CancelledError:
-                    pass
-            
-            if hasattr(self, 'application') and self.application:
-                await self.application.stop()
+            if self.application:
+                if self.application.updater and self.application.updater.running:
+                    await self.application.updater.stop()
+                if self.application.running:
+                    await self.application.stop()
+                await self.application.shutdown()
+                self.application = None
                 
             print("✅ [BOT] Telegram бот остановлен успешно!")
         except Exception as e:
             print(f"❌ [BOT] Критическая ошибка остановки бота: {e}")
             logger.error(f"Критическая ошибка остановки бота: {e}")
             
-    async def main(self):
-        """Запуск бота (для отдельного использования)"""
-        await self.start_bot()
-        # Держим бота запущенным
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "polling": bool(self.application and self.application.updater and self.application.updater.running),
+            "uptime": round(time.monotonic() - self.started_at) if self.started_at else 0,
+            "codes": code_store_module.code_store.count(CODE_KEY_PREFIX),
+            "outbox": telegram_outbox.stats(),
+        }
+        
+    @staticmethod
+    def enqueue_message(chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+                        parse_mode: Optional[str] = None) -> bool:
+        """Сообщение от веб-воркера в очередь бота; True - принято"""
+        return telegram_outbox.enqueue(chat_id, text, priority, parse_mode) is not None
+        
+    def get_ipc_handlers(self) -> Dict[str, Callable]:
+        """Операции для веб-воркеров: хранилище кодов этого процесса и статус"""
+        handlers = get_code_store_handlers(code_store_module.code_store)
+        handlers["status"] = self.get_status
+        handlers["send_message"] = self.enqueue_message
+        return handlers
+        
+    async def _start_polling(self, stop: asyncio.Event):
+        """Запускает поллинг, при ошибке (сеть, Telegram) повторяет с растущей задержкой"""
+        delay = 5
+        while not stop.is_set():
+            try:
+                await self.start_bot()
+                return
+            except Exception:
+                await self.stop_bot()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                delay = min(delay * 2, 300)
+            
+    async def main(self) -> int:
+        """
+        Отдельный процесс бота: единственный поллер и IPC сокет, через который
+        веб-воркеры работают с кодами (app.utils.bot_ipc)
+        """
+        lock_file = open(settings.TELEGRAM_BOT_IPC_PATH + ".lock", "a")
         try:
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print("❌ [BOT] Процесс бота уже запущен")
+            return 1
+        
+        self.started_at = time.monotonic()
+        server = BotIPCServer(settings.TELEGRAM_BOT_IPC_PATH, self.get_ipc_handlers())
+        await server.start()
+        
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        
+        polling_task = None
+        if settings.TELEGRAM_BOT_TOKEN:
+            polling_task = asyncio.create_task(self._start_polling(stop))
+        else:
+            print("⚠️ [BOT] TELEGRAM_BOT_TOKEN не задан: поллинг выключен, обслуживаются только коды")
+        
+        try:
+            await stop.wait()
             logger.info("Получен сигнал остановки")
+        finally:
+            if polling_task:
+                polling_task.cancel()
+                try:
+                    await polling_task
+                except asyncio.CancelledError:
+                    pass
             await self.stop_bot()
+            await server.close()
+            await telegram_outbox.close()
+            lock_file.close()
+        return 0
 
 # Создаем глобальный экземпляр бота
 sms_bot = SMSBot()
 
 if __name__ == "__main__":
-    asyncio.run(sms_bot.main()) 
\ No newline at end of file
+    raise SystemExit(asyncio.run(sms_bot.main())) 
\ No newline at end of file
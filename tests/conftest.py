@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# Модули проекта импортируются от корня репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Минимальные настройки, без которых не импортируется config (БД в тестах не используется)
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("GOOGLE_MAPS", "test")
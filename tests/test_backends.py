@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.code_store import CodeStore, IPCCodeStore, MemoryCodeStore, RedisCodeStore
+from app.utils.rate_limit import MemoryRateLimitBackend, RateLimitBackend, RedisRateLimitBackend
+from app.websockets.backplane import Backplane, InProcessBackplane, RedisBackplane
+
+
+@pytest.mark.parametrize("create", [
+    MemoryCodeStore,
+    lambda: RedisCodeStore("redis://localhost", client=object()),
+    lambda: IPCCodeStore("/tmp/bot.sock"),
+    MemoryRateLimitBackend,
+    lambda: RedisRateLimitBackend("redis://localhost", client=object()),
+    InProcessBackplane,
+    lambda: RedisBackplane("redis://localhost", client=object()),
+])
+def test_backends_implement_the_interface(create):
+    create()
+
+
+@pytest.mark.parametrize("base", [CodeStore, RateLimitBackend, Backplane])
+def test_incomplete_backend_fails_at_instantiation(base):
+    incomplete = type("IncompleteBackend", (base,), {})
+    with pytest.raises(TypeError):
+        incomplete()
+
+
+def _redis_backplanes(count):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return [
+        RedisBackplane("redis://localhost", client=fakeredis.FakeAsyncRedis(server=server))
+        for _ in range(count)
+    ]
+
+
+def test_redis_backplane_delivers_published_messages():
+    sender, receiver = _redis_backplanes(2)
+
+    async def scenario():
+        received = asyncio.Queue()
+
+        async def handler(channel, payload):
+            await received.put((channel, payload))
+
+        await sender.start(handler)
+        await receiver.start(handler)
+        await receiver.subscribe("chat:user:5")
+        await sender.publish("chat:user:5", {"message": {"content": "hi"}})
+        message = await asyncio.wait_for(received.get(), timeout=5)
+        await sender.close()
+        await receiver.close()
+        return message
+
+    assert asyncio.run(scenario()) == ("chat:user:5", {"message": {"content": "hi"}})
+
+
+def test_redis_presence_of_stopped_and_crashed_workers():
+    first, second, observer = _redis_backplanes(3)
+
+    async def handler(channel, payload):
+        pass
+
+    async def scenario():
+        for backplane in (first, second, observer):
+            await backplane.start(handler)
+        await first.change_presence("5", 1)
+        await second.change_presence("6", 1)
+        assert await observer.get_presence(["5", "6", "7"]) == {"5": True, "6": True, "7": False}
+
+        # Остановленный воркер удаляет свою запись
+        await first.close()
+        assert await observer.get_presence(["5"]) == {"5": False}
+
+        # Упавший воркер не продлевает отметку - его соединения перестают считаться
+        await observer._client.zadd(observer.presence_workers_key, {second.worker_id: time.time() - 3600})
+        assert await observer.get_presence(["6"]) == {"6": False}
+
+        await second.close()
+        await observer.close()
+
+    asyncio.run(scenario())
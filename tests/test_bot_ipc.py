@@ -0,0 +1,47 @@
+import asyncio
+
+from config import settings
+from app.services import telegram_outbox as outbox_module
+from app.utils.bot_ipc import BotIPCServer
+
+
+def test_slow_bot_does_not_block_the_loop_and_timeout_is_not_resent(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.sock")
+    monkeypatch.setattr(settings, "TELEGRAM_BOT_MODE", "process")
+    monkeypatch.setattr(settings, "TELEGRAM_BOT_PROCESS", False)
+    monkeypatch.setattr(settings, "TELEGRAM_BOT_IPC_PATH", path)
+    monkeypatch.setattr(settings, "TELEGRAM_BOT_IPC_TIMEOUT_SECONDS", 0.3)
+    monkeypatch.setattr(outbox_module, "_bot_client", None)
+    enqueued = []
+    monkeypatch.setattr(outbox_module.telegram_outbox, "enqueue", lambda *args: enqueued.append(args))
+
+    async def slow_send_message(*args):
+        await asyncio.sleep(1)
+        return True
+
+    async def scenario():
+        server = BotIPCServer(path, {"send_message": slow_send_message})
+        await server.start()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        try:
+            accepted = await outbox_module.send_telegram_message(1, "code")
+        finally:
+            ticker_task.cancel()
+            outbox_module._bot_client.close()
+            await server.close()
+        return accepted, ticks
+
+    accepted, ticks = asyncio.run(scenario())
+
+    assert accepted is False
+    assert enqueued == []
+    # Пока ждали ответа бота, event loop продолжал работать
+    assert ticks >= 10
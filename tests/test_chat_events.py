@@ -0,0 +1,40 @@
+import asyncio
+
+from app.websockets.backplane import InProcessBackplane
+from app.websockets.chat_manager import ConnectionManager
+
+
+def _manager(persisted):
+    manager = ConnectionManager(backplane=InProcessBackplane())
+
+    async def persist_reads(reads):
+        persisted.extend(reads)
+
+    manager.events._persist_reads = persist_reads
+    return manager
+
+
+def test_reads_are_persisted_on_shutdown_without_backplane():
+    persisted = []
+    manager = _manager(persisted)
+    manager.events.mark_read(1, 2, 10)
+    manager.events.mark_read(1, 2, 15)
+
+    asyncio.run(manager.close_backplane())
+
+    assert persisted == [(1, 2, 15)]
+
+
+def test_reads_are_persisted_by_tick_before_any_websocket():
+    persisted = []
+    manager = _manager(persisted)
+    manager.events.tick_seconds = 0.01
+
+    async def scenario():
+        await manager.start_backplane()
+        manager.events.mark_read(3, 4, 7)
+        await asyncio.sleep(0.05)
+        assert persisted == [(3, 4, 7)]
+        await manager.close_backplane()
+
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+import asyncio
+
+from app.websockets.backplane import InProcessBackplane
+from app.websockets.chat_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+def _manager(partners_in_db, queries):
+    manager = ConnectionManager(backplane=InProcessBackplane())
+
+    async def query_chat_partners(user_id, other_ids):
+        queries.append(sorted(other_ids))
+        return {other_id for other_id in other_ids if other_id in partners_in_db}
+
+    manager._query_chat_partners = query_chat_partners
+    return manager
+
+
+def test_only_chat_partners_can_be_watched_and_checked_once():
+    queries = []
+    manager = _manager({2}, queries)
+    websocket = FakeWebSocket()
+
+    async def scenario():
+        await manager.watch_presence(websocket, "1", [2, 3, "x"])
+        typing_allowed = await manager.get_chat_partners("1", ["2"])
+        typing_denied = await manager.get_chat_partners("1", ["3"])
+        return typing_allowed, typing_denied
+
+    typing_allowed, typing_denied = asyncio.run(scenario())
+
+    assert manager.watched_users[websocket] == {"2"}
+    assert [event["user_id"] for event in websocket.sent] == [2]
+    assert typing_allowed == {"2"} and typing_denied == set()
+    # Подтвержденная пара берется из кеша, без запроса в БД
+    assert queries == [[2, 3], [3]]
+
+
+def test_presence_watch_list_is_capped(monkeypatch):
+    from config import settings
+    monkeypatch.setattr(settings, "CHAT_PRESENCE_WATCH_MAX", 3)
+    manager = _manager(set(range(100)), [])
+    websocket = FakeWebSocket()
+
+    asyncio.run(manager.watch_presence(websocket, "1000", list(range(10))))
+    asyncio.run(manager.watch_presence(websocket, "1000", list(range(10, 20))))
+
+    assert len(manager.watched_users[websocket]) == 3
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+
+import httpx
+import pytest
+
+from app.utils.http_clients import HTTPClientRegistry, Provider
+
+TOKEN = "123456:AAHsecret"
+
+
+def test_transport_error_log_does_not_contain_bot_token(caplog):
+    def fail(request):
+        raise httpx.ConnectError(f"connection refused for {request.url}", request=request)
+
+    registry = HTTPClientRegistry()
+    provider = registry.register(Provider("telegram", base_url="https://api.telegram.org", retries=0))
+    provider.create_client = lambda: httpx.AsyncClient(
+        base_url=provider.base_url, transport=httpx.MockTransport(fail)
+    )
+
+    async def scenario():
+        try:
+            with pytest.raises(httpx.ConnectError):
+                await registry.request("telegram", "POST", f"/bot{TOKEN}/sendMessage", json={})
+        finally:
+            await registry.close()
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(scenario())
+
+    assert "/bot***/sendMessage" in caplog.text
+    assert TOKEN not in caplog.text
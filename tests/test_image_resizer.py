@@ -0,0 +1,34 @@
+import asyncio
+
+from PIL import Image
+
+from app.utils.image_resizer import ResizeCache
+
+
+def test_concurrent_requests_render_once_and_count_size_once(tmp_path):
+    (tmp_path / "media").mkdir()
+    Image.new("RGB", (800, 600), (200, 100, 50)).save(tmp_path / "media" / "photo.jpg")
+    cache = ResizeCache(cache_dir=tmp_path / "cache", max_bytes=10 ** 7, allowed_sizes=[320], base_dir=tmp_path)
+
+    renders = []
+    render = cache._render
+
+    def counting_render(*args):
+        renders.append(args)
+        return render(*args)
+
+    cache._render = counting_render
+
+    async def scenario():
+        first = await asyncio.gather(*(cache.get("media/photo.jpg", 320, 0) for _ in range(10)))
+        again = await cache.get("media/photo.jpg", 320, 0)
+        return first, again
+
+    first, again = asyncio.run(scenario())
+
+    assert len(renders) == 1
+    assert sum(1 for _, hit in first if not hit) == 1
+    assert again[1] is True
+    assert cache.stats()["files"] == 1
+    assert cache.stats()["bytes"] == first[0][0].stat().st_size
+    assert cache._key_locks == {}
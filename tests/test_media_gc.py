@@ -0,0 +1,41 @@
+import os
+import time
+
+import pytest
+
+from app import models
+from app.utils.media_gc import MediaGarbageCollector
+
+LIVE_ID = "0123abcd-0000-4000-8000-000000000001"
+ORPHAN_ID = "0123abcd-0000-4000-8000-000000000002"
+
+
+def _old_file(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"jpeg")
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+    return path
+
+
+@pytest.mark.parametrize("model", [models.Property, models.ServiceCard])
+def test_file_referenced_only_by_tour_360_url_survives(tmp_path, monkeypatch, model):
+    live = _old_file(tmp_path / "panoramas" / "5" / f"{LIVE_ID}_original.jpg")
+    orphan = _old_file(tmp_path / "panoramas" / "5" / f"{ORPHAN_ID}_original.jpg")
+
+    collector = MediaGarbageCollector(media_path=tmp_path, grace_seconds=60)
+
+    # Из БД приходит только tour_360_url нужной модели, остальные колонки пустые
+    def iter_rows(db, source_model, *columns):
+        if source_model is model:
+            yield tuple(
+                f"/media/panoramas/5/{LIVE_ID}_original.jpg" if column is model.tour_360_url else None
+                for column in columns
+            )
+
+    monkeypatch.setattr(collector, "_iter_rows", iter_rows)
+    report = collector.run(db=None, dry_run=False)
+
+    assert live.exists()
+    assert not orphan.exists()
+    assert report["deleted_files"] == 1
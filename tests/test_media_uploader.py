@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from app.utils.media_uploader import MediaUploader
+
+
+@pytest.mark.parametrize("media_id", ["..", "../properties", "12/../..", "12\n", ""])
+def test_delete_property_images_rejects_paths(tmp_path, media_id):
+    keep = tmp_path / "properties" / "12" / "photo.jpg"
+    keep.parent.mkdir(parents=True)
+    keep.write_bytes(b"jpeg")
+
+    result = asyncio.run(MediaUploader(media_path=str(tmp_path)).delete_property_images(media_id))
+
+    assert result["status"] == "error"
+    assert keep.exists()
+
+
+def test_delete_property_images_removes_the_property_dir(tmp_path):
+    photo = tmp_path / "properties" / "service-12" / "photo.jpg"
+    photo.parent.mkdir(parents=True)
+    photo.write_bytes(b"jpeg")
+
+    result = asyncio.run(MediaUploader(media_path=str(tmp_path)).delete_property_images("service-12"))
+
+    assert result["status"] == "success"
+    assert not photo.parent.exists()
+    assert (tmp_path / "properties").exists()
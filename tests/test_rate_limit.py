@@ -0,0 +1,75 @@
+import asyncio
+
+from app.utils import rate_limit as rate_limit_module
+from app.utils.rate_limit import MemoryRateLimitBackend
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def _backend(monkeypatch, now=1000.0):
+    clock = Clock(now)
+    monkeypatch.setattr(rate_limit_module.time, "time", clock.time)
+    return MemoryRateLimitBackend(), clock
+
+
+def test_cooldown_lasts_exactly_its_seconds(monkeypatch):
+    backend, clock = _backend(monkeypatch)
+
+    assert asyncio.run(backend.cooldown("send_code_cooldown:996555", 60)) == (True, 0)
+    clock.now += 59
+    assert asyncio.run(backend.cooldown("send_code_cooldown:996555", 60)) == (False, 1)
+    clock.now += 1
+    assert asyncio.run(backend.cooldown("send_code_cooldown:996555", 60)) == (True, 0)
+
+
+def test_rejected_hits_are_not_counted(monkeypatch):
+    backend, clock = _backend(monkeypatch)
+
+    for _ in range(3):
+        assert asyncio.run(backend.hit("login_ip:1.2.3.4", 3, 900))[0]
+    # Перебор во время блокировки не продлевает ее
+    retry_after = asyncio.run(backend.hit("login_ip:1.2.3.4", 3, 900))[1]
+    for _ in range(100):
+        assert asyncio.run(backend.hit("login_ip:1.2.3.4", 3, 900)) == (False, retry_after)
+
+    clock.now += retry_after
+    assert asyncio.run(backend.hit("login_ip:1.2.3.4", 3, 900))[0]
+
+
+SEND_LIMITS = (
+    rate_limit_module.Cooldown("cooldown", 60, key="phone", field="contact"),
+    rate_limit_module.RateLimit("hourly", 1, 3600, key="phone", field="contact"),
+)
+
+
+def _send_code(monkeypatch, success):
+    backend, _ = _backend(monkeypatch)
+    monkeypatch.setattr(rate_limit_module, "rate_limit_backend", backend)
+
+    @rate_limit_module.rate_limit(*SEND_LIMITS, refund_failed=True)
+    async def send_code(request: rate_limit_module.Request, contact: str):
+        return {"success": success}
+
+    return backend, lambda: asyncio.run(send_code(request=None, contact="+996 555 000 001"))
+
+
+def test_cooldown_is_not_set_when_another_limit_rejects(monkeypatch):
+    backend, send_code = _send_code(monkeypatch, success=True)
+    asyncio.run(backend.hit("hourly:996555000001", 1, 3600))
+
+    assert send_code().status_code == 429
+    assert asyncio.run(backend.cooldown("cooldown:996555000001", 60)) == (True, 0)
+
+
+def test_failed_send_is_refunded(monkeypatch):
+    backend, send_code = _send_code(monkeypatch, success=False)
+
+    assert send_code() == {"success": False}
+    assert send_code() == {"success": False}
+    assert asyncio.run(backend.hit("hourly:996555000001", 1, 3600))[0]